@@ -318,6 +318,12 @@ class Bootstrap(object):
             if re.match('^HTTP_TIMEOUT', line):
                 line = 'HTTP_TIMEOUT = 0.01'
 
+            # Reduce retry delays
+            if re.match('^RETRY_MAX_TIME', line):
+                line = 'RETRY_MAX_TIME = 0.5\n'
+            if re.match('^RETRY_BASE_DELAY', line):
+                line = 'RETRY_BASE_DELAY = 0.01\n'
+
             outfile.write(line)
 
         infile.close()
@@ -377,6 +383,13 @@ class Bootstrap(object):
     def eapi_node_information_collected(self):
         return self.eapi_configured() and self.node_information_collected()
 
+    def request_retried(self):
+        return 'retrying in' in self.output
+
+    def retry_delays(self):
+        return [float(x) for x in
+                re.findall(r'retrying in ([0-9.]+)s', self.output)]
+
     def server_connection_failure(self):
         return ('server connection error' in self.output or
                 'Read timed out' in self.output) and \
@@ -508,8 +521,15 @@ class ZTPServer(object):
     # { <URL>: ( <CONTNENT-TYPE>, <STATUS>, <RESPONSE> ) }
     responses = {}
 
+    # { <URL>: [ <NUMBER OF FAILURES>, <STATUS>, <RETRY-AFTER> ] }
+    failures = {}
+
     def cleanup(self):
         self.responses = {}
+        self.failures = {}
+
+    def set_failures(self, url, count, status=503, retry_after=None):
+        self.failures[url] = [count, status, retry_after]
 
     def set_file_response(self, filename, output,
                           content_type='text/plain',
@@ -589,7 +609,17 @@ class ZTPServer(object):
 
             @classmethod
             def do_request(cls, req):
-                if req.path in self.responses.keys():
+                failure = self.failures.get(req.path)
+                if failure and failure[0]:
+                    failure[0] -= 1
+                    req.send_response(failure[1])
+                    req.send_header('Content-type', 'text/html')
+                    if failure[2] is not None:
+                        req.send_header('Retry-After', str(failure[2]))
+                    req.end_headers()
+                    print 'ZTPS: FAILURE: (status=%s, retry-after=%s)' % (
+                        failure[1], failure[2])
+                elif req.path in self.responses.keys():
                     response = self.responses[req.path]
                     req.send_response(response.status)
                     req.error_content_type = response.content_type
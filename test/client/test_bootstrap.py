@@ -108,6 +108,79 @@ class ConfigRequestErrorTest(unittest.TestCase):
             bootstrap.end_test()
 
 
+class RetryTest(unittest.TestCase):
+
+    def test_retry(self):
+        bootstrap = Bootstrap()
+        bootstrap.ztps.set_config_response()
+        bootstrap.ztps.set_failures('/bootstrap/config', 2, retry_after=0.1)
+        bootstrap.ztps.set_node_check_response()
+        bootstrap.ztps.set_failures('/nodes', 1, status=502)
+        bootstrap.ztps.set_definition_response(
+            actions=[{'action' : 'startup_config_action'}])
+        bootstrap.ztps.set_action_response('startup_config_action',
+                                           startup_config_action())
+        bootstrap.start_test()
+
+        try:
+            self.failUnless(bootstrap.request_retried())
+            # jitter is added on top of Retry-After
+            delays = bootstrap.retry_delays()[:2]
+            self.assertEqual(len(delays), 2)
+            self.failUnless(min(delays) >= 0.1)
+            self.failUnless(max(delays) > 0.1)
+            self.failUnless(bootstrap.success())
+            self.failIf(bootstrap.error)
+        except AssertionError as assertion:
+            print 'Output: %s' % bootstrap.output
+            print 'Error: %s' % bootstrap.error
+            raise_exception(assertion)
+        finally:
+            bootstrap.end_test()
+
+    def test_retry_after_exceeds_max_time(self):
+        bootstrap = Bootstrap()
+        bootstrap.ztps.set_config_response()
+        bootstrap.ztps.set_failures('/bootstrap/config', 1, retry_after=60)
+        bootstrap.start_test()
+
+        try:
+            self.failIf(bootstrap.request_retried())
+            self.failUnless(bootstrap.unexpected_response_failure())
+            self.failIf(bootstrap.error)
+        except AssertionError as assertion:
+            print 'Output: %s' % bootstrap.output
+            print 'Error: %s' % bootstrap.error
+            raise_exception(assertion)
+        finally:
+            bootstrap.end_test()
+
+
+    def test_retry_config(self):
+        bootstrap = Bootstrap()
+        module = bootstrap.module
+
+        try:
+            current = (module.RETRY_MAX_TIME, module.RETRY_BASE_DELAY,
+                       module.RETRY_MAX_DELAY)
+
+            # an invalid value leaves the whole policy unchanged
+            module.apply_config(dict(retry=dict(max_time=5,
+                                                base_delay='x')), None)
+            self.assertEqual((module.RETRY_MAX_TIME,
+                              module.RETRY_BASE_DELAY,
+                              module.RETRY_MAX_DELAY), current)
+
+            module.apply_config(dict(retry=dict(max_time=5,
+                                                base_delay=2)), None)
+            self.assertEqual((module.RETRY_MAX_TIME,
+                              module.RETRY_BASE_DELAY,
+                              module.RETRY_MAX_DELAY),
+                             (5.0, 2.0, current[2]))
+        finally:
+            bootstrap.end_test()
+
+
 class EAPIErrorTest(unittest.TestCase):
 
     def test(self):
@@ -0,0 +1,136 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import threading
+import time
+import unittest
+
+from ztpserver.admission import AdmissionControl, Overloaded
+from ztpserver.admission import MAX_RETRY_AFTER, nodes_admission
+from ztpserver.config import runtime
+from ztpserver.metrics import registry
+
+
+class AdmissionControlUnitTests(unittest.TestCase):
+
+    def test_unlimited(self):
+        control = AdmissionControl('unlimited')
+        admitted = [control.admit() for _ in range(100)]
+        self.assertEqual(control.stats()['active'], 100)
+        for entry in admitted:
+            with entry:
+                pass
+        self.assertEqual(control.stats()['active'], 0)
+
+    def test_queue_full(self):
+        control = AdmissionControl('queue_full', limit=1, queue=0)
+        rejected = registry.counter('admission_rejected',
+                                    dict(control='queue_full',
+                                         reason='queue_full'))
+        with control.admit():
+            self.assertRaises(Overloaded, control.admit)
+        self.assertEqual(rejected.value, 1)
+        with control.admit():
+            pass
+
+    def test_queue(self):
+        control = AdmissionControl('queue', limit=1, queue=1, timeout=10)
+        order = list()
+
+        def waiter():
+            with control.admit():
+                order.append('waiter')
+
+        with control.admit():
+            thread = threading.Thread(target=waiter)
+            thread.start()
+            while not control.stats()['waiting']:
+                time.sleep(0.001)
+            self.assertEqual(registry.gauge('admission_queue_depth',
+                                            dict(control='queue')).value, 1)
+            # the queue is full
+            self.assertRaises(Overloaded, control.admit)
+            order.append('holder')
+        thread.join()
+
+        self.assertEqual(order, ['holder', 'waiter'])
+        self.assertEqual(control.stats()['waiting'], 0)
+
+    def test_timeout(self):
+        control = AdmissionControl('timeout', limit=1, queue=1,
+                                   timeout=0.01)
+        with control.admit():
+            start = time.time()
+            self.assertRaises(Overloaded, control.admit)
+            self.assertTrue(time.time() - start >= 0.01)
+        self.assertEqual(control.stats()['waiting'], 0)
+        self.assertEqual(registry.counter('admission_rejected',
+                                          dict(control='timeout',
+                                               reason='timeout')).value, 1)
+
+    def test_retry_after(self):
+        control = AdmissionControl('retry_after', limit=2, queue=0)
+        for elapsed in [4.0, 4.0]:
+            control.acquire()
+            control.release(elapsed)
+
+        control.acquire()
+        control.acquire()
+        try:
+            control.acquire()
+        except Overloaded as err:
+            # 2 requests ahead, 2 at a time, 4s each
+            self.assertEqual(err.retry_after, 4)
+        else:
+            self.fail('request admitted')
+
+        control.release(1000.0)
+        control.acquire()
+        try:
+            control.acquire()
+        except Overloaded as err:
+            self.assertEqual(err.retry_after, MAX_RETRY_AFTER)
+        else:
+            self.fail('request admitted')
+
+    def test_nodes_admission(self):
+        runtime.set_value('max_requests', 3, 'admission')
+        try:
+            control = nodes_admission()
+            self.assertEqual(control.limit, 3)
+        finally:
+            runtime.clear_value('max_requests', 'admission')
+        self.assertEqual(nodes_admission().limit, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,11 +31,25 @@
 #
 # pylint: disable=W0613
 #
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 from mock import patch
 
 import ztpserver.app
+import ztpserver.config
+import ztpserver.resources
+
+from ztpserver.app import read_nodes, parse_reference
+from ztpserver.app import preallocate_assignments, preallocate_resources
+from ztpserver.app import check_definition, validation_tasks, validate_files
+from ztpserver.app import run_validator
+
+PLUGINS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', 'plugins')
 
 class TestApp(unittest.TestCase):
     #pylint: disable=R0904,C0103
@@ -46,5 +60,195 @@ class TestApp(unittest.TestCase):
         obj = ztpserver.app.start_wsgiapp()
         self.assertIsInstance(obj, ztpserver.controller.Router)
 
+class TestPreallocate(unittest.TestCase):
+    #pylint: disable=R0904,C0103
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        for path in ['plugins', 'resources', 'definitions', 'nodes']:
+            os.mkdir(os.path.join(self.data_root, path))
+        shutil.copy(os.path.join(PLUGINS_PATH, 'allocate'),
+                    os.path.join(self.data_root, 'plugins'))
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+        ztpserver.resources.registry.clear()
+
+    def tearDown(self):
+        ztpserver.config.runtime.clear_value('data_root', 'default')
+        shutil.rmtree(self.data_root)
+
+    def write(self, path, contents):
+        filename = os.path.join(self.data_root, path)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+        return filename
+
+    def test_read_nodes(self):
+        filename = self.write('nodes.txt', '# pod 1\nnode1\n\nnode2 # spine'
+                              '\nnode1\n')
+        self.assertEqual(read_nodes(filename), ['node1', 'node2'])
+
+    def test_parse_reference(self):
+        self.assertEqual(parse_reference('mgmt'), ('allocate', 'mgmt'))
+        self.assertEqual(parse_reference("sqlite('mgmt')"),
+                         ('sqlite', 'mgmt'))
+
+    def test_assignments_from_definition(self):
+        self.write('definitions/leaf',
+                   'actions:\n  - action: add_config\n    attributes:\n'
+                   '      variables:\n        ip: allocate(\'mgmt\')\n')
+        self.assertEqual(preallocate_assignments(None, ['n1', 'n2'], 'leaf'),
+                         {('allocate', 'mgmt'): ['n1', 'n2']})
+        self.assertRaises(ValueError, preallocate_assignments,
+                          None, None, 'leaf')
+
+    def test_assignments_from_nodes(self):
+        self.write('nodes/n1/definition',
+                   'actions:\n  - action: add_config\n    attributes:\n'
+                   '      ip: allocate(\'mgmt\')\n')
+        self.write('nodes/n2/attributes', "lo: subnet('loopbacks')\n")
+        self.write('nodes/n3/pattern', 'name: n3\n')
+
+        self.assertEqual(preallocate_assignments([], None, None),
+                         {('allocate', 'mgmt'): ['n1'],
+                          ('subnet', 'loopbacks'): ['n2']})
+        self.assertEqual(preallocate_assignments([], ['n2'], None),
+                         {('subnet', 'loopbacks'): ['n2']})
+
+    @patch('sys.stdout')
+    def test_preallocate_resources(self, _):
+        self.write('resources/mgmt', 'a: null\nb: null\nc: null\n')
+        nodes = self.write('nodes.txt', 'n2\nn1\n')
+
+        preallocate_resources(['mgmt'], nodes, None, False)
+
+        pool = ztpserver.pools.get_pool(
+            os.path.join(self.data_root, 'resources', 'mgmt'))
+        self.assertEqual(pool.lookup('n2'), 'a')
+        self.assertEqual(pool.lookup('n1'), 'b')
+        # written to the resource file, not only to the journal
+        self.assertEqual(open(pool.filename).read(),
+                         'a: n2\nb: n1\nc: null\n')
+
+    @patch('sys.stdout')
+    def test_preallocate_resources_failure(self, _):
+        self.write('resources/mgmt', 'a: null\n')
+        nodes = self.write('nodes.txt', 'n1\nn2\n')
+        self.assertRaises(SystemExit, preallocate_resources, ['mgmt'],
+                          nodes, None, False)
+
+
+class TestValidator(unittest.TestCase):
+    #pylint: disable=R0904,C0103
+
+    NEIGHBORDB = 'patterns:\n  - name: leaf\n    definition: leaf\n' \
+        '    interfaces:\n      - any: any:any\n'
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        for path in ['plugins', 'resources', 'definitions', 'nodes']:
+            os.mkdir(os.path.join(self.data_root, path))
+        shutil.copy(os.path.join(PLUGINS_PATH, 'allocate'),
+                    os.path.join(self.data_root, 'plugins'))
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+        ztpserver.resources.registry.clear()
+
+        self.write('neighbordb', self.NEIGHBORDB)
+        self.write('definitions/leaf',
+                   'actions:\n  - action: add_config\n    attributes:\n'
+                   '      ip: allocate(\'mgmt\')\n')
+        self.write('resources/mgmt', 'a: null\n')
+        self.write('nodes/n1/pattern', 'name: n1\n')
+
+    def tearDown(self):
+        ztpserver.config.runtime.clear_value('data_root', 'default')
+        shutil.rmtree(self.data_root)
+
+    def write(self, path, contents):
+        filename = os.path.join(self.data_root, path)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+        return filename
+
+    def test_check_definition(self):
+        filename = self.write('definitions/spine',
+                              'actions:\n  - attributes:\n'
+                              '      ip: allocate(\'mgmt\')\n'
+                              '      lo: allocate(\'loopbacks\')\n'
+                              '      vlan: vlans(\'pod1\')\n')
+        errors = check_definition(filename, self.data_root,
+                                  ('allocate',), ('mgmt',))
+        self.assertEqual(len(errors), 2)
+        self.assertIn('\'vlans\'', errors[0])
+        self.assertIn('\'loopbacks\'', errors[1])
+
+    def test_validation_tasks(self):
+        tasks = validation_tasks(self.data_root)
+        self.assertEqual([(x, os.path.relpath(y, self.data_root))
+                          for (x, y, _) in tasks],
+                         [('neighbordb', 'neighbordb'),
+                          ('definition', 'definitions/leaf'),
+                          ('resource', 'resources/mgmt'),
+                          ('node', 'nodes/n1/pattern')])
+        # the plugins and pools are listed once for all the definitions
+        self.assertEqual(tasks[1][2],
+                         (self.data_root, ('allocate',), ('mgmt',)))
+
+    def test_validate_files(self):
+        self.write('definitions/broken', 'actions: [\n')
+        tasks = validation_tasks(self.data_root, ['definition'])
+        for jobs in [1, 2]:
+            results = list(validate_files(tasks, jobs))
+            self.assertEqual([x[2] for x in results], ['error', 'ok'])
+            self.assertEqual([x[0] for x in results], tasks)
+
+        manifest = dict((x[0][1], x[1]) for x in results)
+        results = list(validate_files(tasks, 1, manifest))
+        self.assertEqual([x[2] for x in results], ['skipped', 'skipped'])
+
+        # a new pool invalidates the definitions
+        self.write('resources/loopbacks', 'a: null\n')
+        tasks = validation_tasks(self.data_root, ['definition'])
+        results = list(validate_files(tasks, 1, manifest))
+        self.assertEqual([x[2] for x in results], ['error', 'ok'])
+
+    @patch('sys.stdout')
+    def test_run_validator(self, _):
+        manifest = os.path.join(self.data_root, 'manifest')
+        report = os.path.join(self.data_root, 'report')
+
+        self.assertEqual(run_validator(False, 2, manifest, report), 0)
+        with open(report) as fhandler:
+            data = json.load(fhandler)
+        self.assertEqual(data['failed'], 0)
+        self.assertEqual([x['status'] for x in data['files']], ['ok'] * 4)
+        self.assertEqual([x['filename'] for x in data['plugins']],
+                         ['allocate'])
+
+        self.write('nodes/n1/pattern', 'name: [\n')
+        self.assertEqual(run_validator(False, 1, manifest, report), 1)
+        with open(report) as fhandler:
+            data = json.load(fhandler)
+        self.assertEqual([x['status'] for x in data['files']],
+                         ['skipped', 'skipped', 'skipped', 'error'])
+
+        with open(manifest) as fhandler:
+            data = json.load(fhandler)
+        self.assertEqual(len(data['files']), 3)
+
+        # manifests written by another version are ignored
+        self.write('nodes/n1/pattern', 'name: n1\n')
+        self.assertEqual(run_validator(False, 1, manifest, report,
+                                       version='2.0'), 0)
+        with open(report) as fhandler:
+            data = json.load(fhandler)
+        self.assertEqual([x['status'] for x in data['files']], ['ok'] * 4)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -336,6 +336,61 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(obj.group.test, 'value')
         filename.close()
 
+    def test_config_snapshot_read_only(self):
+        self.config.add_attribute(ztpserver.config.IntAttr(name='test',
+                                                           default=1))
+        group = self.config.default
+        self.assertIsInstance(group, ztpserver.config.FrozenGroup)
+        self.assertEqual(dict(group), dict(test=1))
+        self.assertRaises(AttributeError, setattr, group, 'test', 2)
+        self.assertRaises(AttributeError, getattr, group, 'missing')
+
+        self.config.set_value('test', 2, 'default')
+        self.assertEqual(self.config.default.test, 2)
+        # snapshots already handed out are left untouched
+        self.assertEqual(group.test, 1)
+
+        self.config.clear_value('test', 'default')
+        self.assertEqual(self.config.default.test, 1)
+
+    def test_config_reload(self):
+        self.config.add_attribute(ztpserver.config.IntAttr(name='test',
+                                                           default=1))
+        self.config.add_attribute(ztpserver.config.IntAttr(name='test',
+                                                           group='group',
+                                                           min_value=0,
+                                                           default=1))
+        self.config.add_attribute(ztpserver.config.StrAttr(name='other',
+                                                           group='group'))
+
+        conf = tempfile.NamedTemporaryFile(mode='w')
+        conf.write('[default]\ntest = 2\n[group]\ntest = 3\n'
+                   'other = value\n')
+        conf.flush()
+        self.config.read(conf.name)
+        self.assertEqual(self.config.group.test, 3)
+        group = self.config.group
+
+        # removed settings revert to their defaults, invalid values are
+        # ignored and unknown ones are skipped
+        conf.seek(0)
+        conf.truncate()
+        conf.write('[group]\ntest = -1\nunknown = 1\n')
+        conf.flush()
+        self.config.reload()
+
+        self.assertEqual(self.config.default.test, 1)
+        self.assertEqual(self.config.group.test, 1)
+        self.assertIsNone(self.config.group.other)
+        self.assertEqual(self.config.filename, conf.name)
+        self.assertEqual(group.test, 3)
+        conf.close()
+
+    def test_config_reload_missing_file(self):
+        self.assertRaises(IOError, self.config.reload)
+        self.assertRaises(IOError, self.config.reload,
+                          '/tmp/%s.conf' % os.getpid())
+
 
 if __name__ == '__main__':
     unittest.main()
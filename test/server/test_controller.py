@@ -34,6 +34,7 @@
 
 import json
 import random
+import threading
 import unittest
 
 from webob import Request
@@ -132,6 +133,22 @@ class RouterUnitTests(unittest.TestCase):
         url = '/nodes/%s/startup-config' % random_string()
         self.match_routes(url, 'GET,PUT', 'POST,DELETE')
 
+    def test_resources_stats(self):
+        url = '/resources/stats'
+        self.match_routes(url, 'GET', 'POST,PUT,DELETE')
+
+    def test_metrics(self):
+        url = '/metrics'
+        self.match_routes(url, 'GET', 'POST,PUT,DELETE')
+
+    def test_debug_profile(self):
+        url = '/debug/profile'
+        self.match_routes(url, 'GET', 'POST,PUT,DELETE')
+
+    def test_admin_reload(self):
+        url = '/admin/reload'
+        self.match_routes(url, 'POST', 'GET,PUT,DELETE')
+
 
 
 class MetaControllerUnitTests(unittest.TestCase):
@@ -191,6 +208,168 @@ class MetaControllerUnitTests(unittest.TestCase):
         self.assertEqual(resp['content_type'], constants.CONTENT_TYPE_JSON)
 
 
+class ResourcesControllerUnitTests(unittest.TestCase):
+
+    @patch('ztpserver.controller.create_repository')
+    @patch('ztpserver.controller.resource_stats')
+    def test_stats(self, m_stats, _):
+        stats = {'allocate': {'used': 1, 'free': 1, 'total': 2}}
+        m_stats.return_value = stats
+
+        controller = ztpserver.controller.ResourcesController()
+        resp = controller.stats(None)
+
+        self.assertEqual(resp['body'], stats)
+        self.assertEqual(resp['content_type'], constants.CONTENT_TYPE_JSON)
+
+    @patch('ztpserver.controller.create_repository')
+    @patch('ztpserver.controller.resource_stats')
+    def test_stats_failure(self, m_stats, _):
+        m_stats.side_effect = Exception
+
+        controller = ztpserver.controller.ResourcesController()
+        resp = controller.stats(None)
+
+        self.assertEqual(resp['status'],
+                         constants.HTTP_STATUS_INTERNAL_SERVER_ERROR)
+
+
+class MetricsControllerUnitTests(unittest.TestCase):
+
+    @patch('ztpserver.controller.create_repository')
+    def test_index(self, _):
+        request = Request.blank('/resources/stats')
+        request.get_response(ztpserver.controller.Router())
+
+        resp = Request.blank('/metrics').get_response(
+            ztpserver.controller.Router())
+
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+        self.assertEqual(resp.content_type, constants.CONTENT_TYPE_OTHER)
+        self.assertIn('# TYPE ztps_http_requests counter', resp.body)
+        self.assertIn('ztps_http_requests{method="GET",'
+                      'route="/resources/stats",status=', resp.body)
+        self.assertIn('ztps_http_request_seconds_bucket{method="GET",'
+                      'route="/resources/stats",le="+Inf"}', resp.body)
+
+
+class DebugControllerUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        ztpserver.config.runtime.set_value('token', 'secret', 'profiling')
+
+    def tearDown(self):
+        ztpserver.config.runtime.clear_value('token', 'profiling')
+
+    def get(self, url, token='secret'):
+        request = Request.blank(url, headers={'X-ZTPS-Profile': token})
+        return request.get_response(ztpserver.controller.Router())
+
+    @patch('ztpserver.controller.create_repository')
+    def test_profile(self, _):
+        event = threading.Event()
+        worker = threading.Thread(target=event.wait, name='worker')
+        worker.start()
+        try:
+            resp = self.get('/debug/profile?seconds=0.02&rate=100')
+        finally:
+            event.set()
+            worker.join()
+
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+        self.assertEqual(resp.content_type, constants.CONTENT_TYPE_OTHER)
+        stacks = dict(x.rsplit(' ', 1) for x in resp.body.splitlines())
+        self.assertTrue([x for x in stacks
+                         if x.startswith('worker;threading:__bootstrap;')])
+
+    @patch('ztpserver.controller.create_repository')
+    def test_profile_disabled(self, _):
+        ztpserver.config.runtime.clear_value('token', 'profiling')
+        resp = self.get('/debug/profile?seconds=0.02', token='')
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_NOT_FOUND)
+
+    @patch('ztpserver.controller.create_repository')
+    def test_profile_forbidden(self, _):
+        resp = self.get('/debug/profile?seconds=0.02', token='guess')
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_FORBIDDEN)
+
+    @patch('ztpserver.controller.create_repository')
+    def test_profile_bad_request(self, _):
+        for query in ['seconds=x', 'seconds=0', 'seconds=3600', 'rate=0',
+                      'rate=x']:
+            resp = self.get('/debug/profile?%s' % query)
+            self.assertEqual(resp.status_code,
+                             constants.HTTP_STATUS_BAD_REQUEST)
+
+    @patch('ztpserver.controller.sampler')
+    @patch('ztpserver.controller.create_repository')
+    def test_profile_busy(self, _, m_sampler):
+        m_sampler.sample.side_effect = ztpserver.controller.SamplerBusy
+        resp = self.get('/debug/profile?seconds=0.02')
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_CONFLICT)
+
+
+class AdminControllerUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        ztpserver.config.runtime.set_value('token', 'secret', 'admin')
+
+    def tearDown(self):
+        ztpserver.config.runtime.clear_value('token', 'admin')
+        ztpserver.config.runtime.clear_value('token', 'profiling')
+
+    def post(self, url, token='secret', header='X-ZTPS-Admin'):
+        request = Request.blank(url, method='POST', headers={header: token})
+        return request.get_response(ztpserver.controller.Router())
+
+    @patch('ztpserver.controller.reload_workers')
+    @patch('ztpserver.controller.runtime')
+    @patch('ztpserver.controller.create_repository')
+    def test_reload(self, _, m_runtime, m_reload_workers):
+        m_runtime.admin.token = 'secret'
+        m_runtime.filename = '/etc/ztpserver/ztpserver.conf'
+        resp = self.post('/admin/reload')
+
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_OK)
+        self.assertEqual(json.loads(resp.body),
+                         dict(filename='/etc/ztpserver/ztpserver.conf'))
+        self.assertTrue(m_runtime.reload.called)
+        self.assertTrue(m_reload_workers.called)
+
+    @patch('ztpserver.controller.reload_workers')
+    @patch('ztpserver.controller.runtime')
+    @patch('ztpserver.controller.create_repository')
+    def test_reload_failure(self, _, m_runtime, m_reload_workers):
+        m_runtime.admin.token = 'secret'
+        m_runtime.reload.side_effect = IOError
+        resp = self.post('/admin/reload')
+
+        self.assertEqual(resp.status_code,
+                         constants.HTTP_STATUS_INTERNAL_SERVER_ERROR)
+        self.assertFalse(m_reload_workers.called)
+
+    @patch('ztpserver.controller.create_repository')
+    def test_reload_disabled(self, _):
+        ztpserver.config.runtime.clear_value('token', 'admin')
+        resp = self.post('/admin/reload', token='')
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_NOT_FOUND)
+
+        # the profiling token does not enable it
+        ztpserver.config.runtime.set_value('token', 'secret', 'profiling')
+        resp = self.post('/admin/reload', header='X-ZTPS-Profile')
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_NOT_FOUND)
+
+    @patch('ztpserver.controller.create_repository')
+    def test_reload_forbidden(self, _):
+        resp = self.post('/admin/reload', token='guess')
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_FORBIDDEN)
+
+        # nor does the profiling header authorize it
+        ztpserver.config.runtime.set_value('token', 'secret', 'profiling')
+        resp = self.post('/admin/reload', header='X-ZTPS-Profile')
+        self.assertEqual(resp.status_code, constants.HTTP_STATUS_FORBIDDEN)
+
+
 class BootstrapConfigUnitTests(unittest.TestCase):
 
     @patch('ztpserver.controller.create_repository')
@@ -248,6 +427,23 @@ class BootstrapConfigUnitTests(unittest.TestCase):
         self.assertEqual(resp['body'], config.as_dict())
         self.assertEqual(resp['content_type'], constants.CONTENT_TYPE_JSON)
 
+    @patch('ztpserver.controller.create_repository')
+    def test_config_retry(self, m_repository):
+        config = dict(retry=dict(max_time=600, base_delay=0.5,
+                                 max_delay='bogus', bogus=1))
+
+        cfg = {'return_value.read.return_value': config}
+        m_repository.return_value.get_file.configure_mock(**cfg)
+
+        controller = ztpserver.controller.BootstrapController()
+
+        request = Request.blank('')
+        request.remote_addr = ''
+        resp = controller.config(request)
+
+        self.assertEqual(resp['body']['retry'],
+                         dict(max_time=600, base_delay=0.5))
+
     @patch('ztpserver.controller.create_repository')
     def test_config_defaults(self, m_repository):
         cfg = {'return_value.get_file.side_effect': FileObjectNotFound}
@@ -566,6 +762,36 @@ class NodesControllerUnitTests(unittest.TestCase):
             'identifier', 'systemmac', 'default')
         self.test_create_missing_identifier()
 
+    @patch('ztpserver.controller.nodes_admission')
+    @patch('ztpserver.controller.create_repository')
+    def test_fsm_overloaded(self, _, m_admission):
+        m_admission.return_value.admit.side_effect = \
+            ztpserver.controller.Overloaded('overloaded', 7)
+
+        request = Request.blank('/nodes', method='POST')
+        request.body = json.dumps(dict(systemmac=random_string(),
+                                       serialnumber=random_string()))
+        resp = request.get_response(ztpserver.controller.Router())
+
+        self.assertEqual(resp.status_code,
+                         constants.HTTP_STATUS_SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.headers['Retry-After'], '7')
+
+    @patch('ztpserver.controller.create_repository')
+    def test_fsm_admitted(self, _):
+        ztpserver.config.runtime.set_value('max_requests', 1, 'admission')
+        try:
+            controller = ztpserver.controller.NodesController()
+            with patch.object(controller, 'run_fsm') as m_run_fsm:
+                m_run_fsm.return_value = dict()
+                self.assertEqual(controller.fsm('node_exists',
+                                                node_id='node'), dict())
+            m_run_fsm.assert_called_once_with('node_exists', node_id='node')
+            stats = ztpserver.controller.nodes_admission().stats()
+            self.assertEqual(stats['active'], 0)
+        finally:
+            ztpserver.config.runtime.clear_value('max_requests', 'admission')
+
     @patch('ztpserver.controller.create_repository')
     def test_node_exists(self, m_repository):
         m_repository.return_value.exists.return_value = True
@@ -0,0 +1,203 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0103,W0212
+#
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+import ztpserver.config
+import ztpserver.controller
+import ztpserver.leases
+import ztpserver.pools
+import ztpserver.resources
+
+from ztpserver.leases import LeaseTable, LeaseSweeper, lease_times
+from ztpserver.pools import ResourcePool
+
+PLUGINS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', 'plugins')
+
+class LeaseTableUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'leases', 'allocate.pool')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_renew(self):
+        table = LeaseTable(self.filename, 60)
+        table.renew('node1', now=1000)
+        table.renew('node1', now=1030)
+        self.assertEqual(table.expires('node1'), 1090)
+        self.assertIsNone(table.expires('node2'))
+
+        # other processes see the renewals
+        self.assertEqual(LeaseTable(self.filename, 60).expires('node1'), 1090)
+
+    def test_sweep(self):
+        table = LeaseTable(self.filename, 60)
+        table.renew('node1', now=1000)
+        table.renew('node2', now=1010)
+        table.renew('node3', now=1020)
+        table.renew('node1', now=1050)
+
+        released = list()
+        self.assertEqual(table.sweep(released.append, now=1075), ['node2'])
+        self.assertEqual(table.sweep(released.append, now=1200, limit=1),
+                         ['node3'])
+        self.assertEqual(table.sweep(released.append, now=1200), ['node1'])
+        self.assertEqual(table.sweep(released.append, now=1200), [])
+        self.assertEqual(released, ['node2', 'node3', 'node1'])
+
+        # released leases are gone for other processes as well
+        self.assertIsNone(LeaseTable(self.filename, 60).expires('node2'))
+
+    def test_sweep_failure(self):
+        table = LeaseTable(self.filename, 60)
+        table.renew('node1', now=1000)
+
+        def fail(_):
+            raise Exception('failed')
+
+        self.assertEqual(table.sweep(fail, now=1100), [])
+        self.assertEqual(table.expires('node1'), 1060)
+        self.assertEqual(table.sweep(lambda x: None, now=1100), ['node1'])
+
+    def test_compaction(self):
+        table = LeaseTable(self.filename, 60)
+        for now in range(2000):
+            table.renew('node%d' % (now % 2), now=now)
+
+        self.assertLess(len(open(self.filename).readlines()), 1024)
+        other = LeaseTable(self.filename, 60)
+        self.assertEqual(other.expires('node0'), 1998 + 60)
+        self.assertEqual(other.expires('node1'), 1999 + 60)
+
+
+class LeaseSweeperUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        for path in ['plugins', 'resources']:
+            os.mkdir(os.path.join(self.data_root, path))
+        shutil.copy(os.path.join(PLUGINS_PATH, 'allocate'),
+                    os.path.join(self.data_root, 'plugins'))
+        self.pool = os.path.join(self.data_root, 'resources', 'mgmt')
+        with open(self.pool, 'w') as fhandler:
+            fhandler.write('a: null\nb: null\n')
+
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+        ztpserver.config.runtime.set_value('leases', 'allocate:mgmt:60',
+                                           'resources')
+        ztpserver.resources.registry.clear()
+
+    def tearDown(self):
+        ztpserver.config.runtime.clear_value('data_root', 'default')
+        ztpserver.config.runtime.clear_value('leases', 'resources')
+        ztpserver.pools._pools.clear()
+        ztpserver.leases._tables.clear()
+        shutil.rmtree(self.data_root)
+
+    def test_lease_times(self):
+        ztpserver.config.runtime.set_value(
+            'leases', 'allocate:mgmt:60, sqlite:mgmt:3600,invalid',
+            'resources')
+        self.assertEqual(lease_times(), {('allocate', 'mgmt'): 60,
+                                         ('sqlite', 'mgmt'): 3600})
+
+    def test_sweep(self):
+        ztpserver.resources.run_plugins([('allocate', 'mgmt')], 'node1')
+        ztpserver.leases.renew_leases([('allocate', 'mgmt'),
+                                       ('allocate', 'other')], 'node1')
+        table = ztpserver.leases.lease_table('allocate', 'mgmt')
+        expires = table.expires('node1')
+        self.assertIsNone(ztpserver.leases.lease_table('allocate', 'other'))
+
+        sweeper = LeaseSweeper()
+        self.assertEqual(sweeper.sweep(now=expires - 1), {})
+        self.assertEqual(sweeper.sweep(now=expires),
+                         {('allocate', 'mgmt'): ['node1']})
+        self.assertIsNone(ResourcePool(self.pool).lookup('node1'))
+
+    def test_sweep_during_request(self):
+        ztpserver.resources.run_plugins([('allocate', 'mgmt')], 'node1')
+        table = ztpserver.leases.lease_table('allocate', 'mgmt')
+        # the lease has expired, but the node is back
+        table.renew('node1', now=time.time() - 120)
+
+        sweeper = LeaseSweeper()
+        run_plugins = ztpserver.resources.run_plugins
+
+        def resolve(references, node_id):
+            # the sweeper runs right after the lookup
+            result = run_plugins(references, node_id)
+            sweeper.sweep()
+            return result
+
+        response = dict(definition=dict(actions=[
+            dict(name='test', attributes=dict(ip="allocate('mgmt')"))]))
+        controller = ztpserver.controller.NodesController()
+        with patch('ztpserver.controller.run_plugins', resolve):
+            (response, _) = controller.do_resources(response,
+                                                    resource='node1')
+
+        actions = response['definition']['actions']
+        self.assertEqual(actions[0]['attributes'], dict(ip='a'))
+        # still allocated to node1 - not handed out to another node
+        self.assertEqual(ResourcePool(self.pool).lookup('node1'), 'a')
+        self.assertEqual(sweeper.sweep(), {})
+
+    def test_sweep_unsupported_plugin(self):
+        ztpserver.config.runtime.set_value('leases', 'test:mgmt:60',
+                                           'resources')
+        shutil.copy(os.path.join(PLUGINS_PATH, 'test'),
+                    os.path.join(self.data_root, 'plugins'))
+        ztpserver.leases.renew_leases([('test', 'mgmt')], 'node1')
+
+        sweeper = LeaseSweeper()
+        self.assertEqual(sweeper.sweep(now=2 ** 40), {})
+        table = ztpserver.leases.lease_table('test', 'mgmt')
+        self.assertIsNotNone(table.expires('node1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
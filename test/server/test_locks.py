@@ -0,0 +1,204 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import fcntl
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from ztpserver.locks import FileLock, LockManager, RWLock
+from ztpserver.metrics import registry
+
+
+def locked(filename):
+    ''' Returns True if filename is exclusively locked (by another open
+    file description) '''
+
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return False
+    except IOError:
+        return True
+    finally:
+        os.close(fd)
+
+
+class RWLockUnitTests(unittest.TestCase):
+
+    def test_shared(self):
+        lock = RWLock()
+        barrier = threading.Semaphore(0)
+        inside = list()
+
+        def reader():
+            lock.acquire_shared()
+            inside.append(1)
+            barrier.release()
+            # wait until the other reader got in as well
+            while len(inside) < 2:
+                time.sleep(0.001)
+            lock.release_shared()
+
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_exclusive(self):
+        lock = RWLock()
+        events = list()
+
+        lock.acquire_shared()
+
+        def writer():
+            lock.acquire_exclusive()
+            events.append('writer')
+            lock.release_exclusive()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        time.sleep(0.05)
+        events.append('reader')
+        lock.release_shared()
+        thread.join()
+        self.assertEqual(events, ['reader', 'writer'])
+
+    def test_writer_preference(self):
+        lock = RWLock()
+        events = list()
+        lock.acquire_shared()
+
+        def writer():
+            lock.acquire_exclusive()
+            events.append('writer')
+            lock.release_exclusive()
+
+        def reader():
+            lock.acquire_shared()
+            events.append('reader')
+            lock.release_shared()
+
+        threads = [threading.Thread(target=writer)]
+        threads[0].start()
+        time.sleep(0.05)
+        # a writer is waiting - new readers queue up behind it
+        threads.append(threading.Thread(target=reader))
+        threads[1].start()
+        time.sleep(0.05)
+        self.assertEqual(events, [])
+
+        lock.release_shared()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(events, ['writer', 'reader'])
+
+
+class LockManagerUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, '.test.lock')
+        self.manager = LockManager('test', stripes=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_shared(self):
+        with self.manager.shared(self.filename):
+            with FileLock(self.filename, shared=True):
+                pass
+            self.assertFalse(locked(self.filename))
+
+    def test_exclusive(self):
+        with self.manager.exclusive(self.filename):
+            self.assertTrue(locked(self.filename))
+        self.assertFalse(locked(self.filename))
+
+    def test_processes(self):
+        def child(filename, queue):
+            with LockManager('child').exclusive(filename):
+                queue.put(True)
+                time.sleep(0.2)
+
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=child,
+                                       args=(self.filename, queue))
+        proc.start()
+        queue.get(timeout=5)
+        start = time.time()
+        with self.manager.shared(self.filename):
+            self.assertGreater(time.time() - start, 0.05)
+        proc.join()
+
+    def test_threads(self):
+        counter = dict(value=0)
+
+        def worker():
+            for _ in range(100):
+                with self.manager.exclusive(self.filename):
+                    value = counter['value']
+                    time.sleep(0)
+                    counter['value'] = value + 1
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter['value'], 400)
+
+    def test_wait_metrics(self):
+        exclusive = registry.histogram('lock_wait_seconds',
+                                       dict(lock='test', mode='exclusive'))
+        shared = registry.histogram('lock_wait_seconds',
+                                    dict(lock='test', mode='shared'))
+        counts = (exclusive.count, shared.count)
+        with self.manager.exclusive(self.filename):
+            pass
+        with self.manager.shared(self.filename):
+            pass
+        with self.manager.shared(self.filename):
+            pass
+        self.assertEqual((exclusive.count, shared.count),
+                         (counts[0] + 1, counts[1] + 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
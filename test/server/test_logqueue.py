@@ -0,0 +1,181 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import logging
+import sys
+import threading
+import unittest
+
+from ztpserver.logqueue import DuplicateFilter, NodeLevelFilter
+from ztpserver.logqueue import QueueHandler, node_context, node_levels
+from ztpserver.logqueue import current_node
+from ztpserver.metrics import registry
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = list()
+        self.threads = set()
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+def make_record(msg, args=None, level=logging.INFO, created=None):
+    record = logging.LogRecord('ztpserver', level, __file__, 1, msg, args,
+                               None)
+    if created is not None:
+        record.created = created
+    return record
+
+
+class NodeContextUnitTests(unittest.TestCase):
+
+    def test_node_context(self):
+        self.assertIsNone(current_node())
+        with node_context('node1'):
+            self.assertEqual(current_node(), 'node1')
+            with node_context('node2'):
+                self.assertEqual(current_node(), 'node2')
+            self.assertEqual(current_node(), 'node1')
+        self.assertIsNone(current_node())
+
+    def test_node_levels(self):
+        self.assertEqual(node_levels(['node1:debug', ' node2 : ERROR ', '',
+                                      'bogus', 'node3:bogus']),
+                         dict(node1=logging.DEBUG, node2=logging.ERROR))
+
+
+class NodeLevelFilterUnitTests(unittest.TestCase):
+
+    def test_filter(self):
+        log_filter = NodeLevelFilter(logging.INFO,
+                                     dict(node1=logging.DEBUG,
+                                          node2=logging.ERROR))
+        debug = make_record('debug', level=logging.DEBUG)
+        warning = make_record('warning', level=logging.WARNING)
+
+        self.assertFalse(log_filter.filter(debug))
+        self.assertTrue(log_filter.filter(warning))
+        self.assertIsNone(warning.node_id)
+
+        with node_context('node1'):
+            self.assertTrue(log_filter.filter(debug))
+            self.assertEqual(debug.node_id, 'node1')
+        with node_context('node2'):
+            self.assertFalse(log_filter.filter(warning))
+        with node_context('node3'):
+            self.assertFalse(log_filter.filter(debug))
+            self.assertTrue(log_filter.filter(warning))
+
+
+class DuplicateFilterUnitTests(unittest.TestCase):
+
+    def test_filter(self):
+        log_filter = DuplicateFilter(10)
+        self.assertTrue(log_filter.filter(make_record('%s', ('a',),
+                                                      created=100)))
+        for created in [101, 105, 109]:
+            self.assertFalse(log_filter.filter(make_record('a',
+                                                           created=created)))
+        # different level
+        self.assertTrue(log_filter.filter(make_record(
+            'a', level=logging.ERROR, created=101)))
+
+        record = make_record('a', created=110)
+        self.assertTrue(log_filter.filter(record))
+        self.assertEqual(record.getMessage(), 'a (repeated 3 more times)')
+
+        record = make_record('a', created=120)
+        self.assertTrue(log_filter.filter(record))
+        self.assertEqual(record.getMessage(), 'a')
+
+
+class QueueHandlerUnitTests(unittest.TestCase):
+
+    def test_handler(self):
+        target = ListHandler()
+        target.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        handler = QueueHandler([target], 100)
+
+        handler.handle(make_record('%s=%d', ('a', 1)))
+        try:
+            raise ValueError('failed')
+        except ValueError:
+            record = make_record('error', level=logging.ERROR)
+            record.exc_info = sys.exc_info()
+            handler.handle(record)
+        handler.stop()
+
+        self.assertEqual(target.records[0], 'INFO a=1')
+        self.assertTrue(target.records[1].startswith('ERROR error\n'))
+        self.assertIn('ValueError: failed', target.records[1])
+        self.assertEqual(target.threads, set(['log-writer']))
+
+    def test_handler_level(self):
+        target = ListHandler()
+        target.setLevel(logging.WARNING)
+        handler = QueueHandler([target], 100)
+        handler.handle(make_record('info'))
+        handler.handle(make_record('warning', level=logging.WARNING))
+        handler.stop()
+        self.assertEqual(target.records, ['warning'])
+
+    def test_full(self):
+        dropped = registry.counter('log_records_dropped')
+        count = dropped.value
+
+        event = threading.Event()
+
+        class BlockingHandler(ListHandler):
+            def emit(self, record):
+                event.wait()
+                super(BlockingHandler, self).emit(record)
+
+        target = BlockingHandler()
+        handler = QueueHandler([target], 2)
+        # the first one is taken by the (blocked) writer
+        for index in range(10):
+            handler.handle(make_record('record %d' % index))
+        event.set()
+        handler.stop()
+
+        self.assertTrue(dropped.value - count >= 7)
+        self.assertEqual(len(target.records) + dropped.value - count, 10)
+        self.assertEqual(target.records[0], 'record 0')
+
+
+if __name__ == '__main__':
+    unittest.main()
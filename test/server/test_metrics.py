@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0103
+#
+
+import threading
+import unittest
+
+from webob import Request, Response
+
+from ztpserver.metrics import Counter, Gauge, Histogram, Registry
+from ztpserver.metrics import MetricsMiddleware
+
+class MetricsUnitTests(unittest.TestCase):
+
+    def test_counter(self):
+        counter = Counter('requests')
+        threads = [threading.Thread(target=lambda: [counter.inc()
+                                                    for _ in range(1000)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.snapshot(), 4000)
+
+    def test_histogram(self):
+        histogram = Histogram('latency', buckets=(0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            histogram.observe(value)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 4)
+        self.assertAlmostEqual(snapshot['sum'], 2.65)
+        self.assertEqual(snapshot['buckets'],
+                         [['0.1', 2], ['1.0', 3], ['+Inf', 4]])
+
+    def test_histogram_time(self):
+        histogram = Histogram('latency')
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.snapshot()['count'], 1)
+
+    def test_registry(self):
+        registry = Registry()
+        counter = registry.counter('errors', dict(plugin='allocate'))
+        self.assertIs(registry.counter('errors', dict(plugin='allocate')),
+                      counter)
+        self.assertIsNot(registry.counter('errors', dict(plugin='sqlite')),
+                         counter)
+        self.assertEqual(len(registry.find('errors')), 2)
+        self.assertRaises(TypeError, registry.histogram, 'errors',
+                          dict(plugin='allocate'))
+
+
+    def test_gauge(self):
+        gauge = Gauge('in_flight')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(gauge.value, 1)
+
+    def test_exposition(self):
+        registry = Registry()
+        registry.counter('requests', dict(path='/a"b')).inc(2)
+        registry.histogram('latency', buckets=(0.1,)).observe(0.05)
+
+        self.assertEqual(registry.exposition(),
+                         '# TYPE ztps_latency histogram\n'
+                         'ztps_latency_bucket{le="0.1"} 1\n'
+                         'ztps_latency_bucket{le="+Inf"} 1\n'
+                         'ztps_latency_sum 0.05\n'
+                         'ztps_latency_count 1\n'
+                         '# TYPE ztps_requests counter\n'
+                         'ztps_requests{path="/a\\"b"} 2\n')
+
+
+class MetricsMiddlewareUnitTests(unittest.TestCase):
+
+    def test_request(self):
+        registry = Registry()
+        app = MetricsMiddleware(Response(body='12345'), registry)
+        Request.blank('/files/image').get_response(app)
+        Request.blank('/files/image', method='HEAD').get_response(app)
+
+        labels = dict(route='unmatched', method='GET')
+        self.assertEqual(registry.counter('http_response_bytes',
+                                          labels).value, 5)
+        self.assertEqual(registry.histogram('http_request_seconds',
+                                            labels).count, 1)
+        labels['status'] = '200'
+        self.assertEqual(registry.counter('http_requests', labels).value, 1)
+        self.assertEqual(registry.gauge('http_requests_in_flight').value, 0)
+
+        labels = dict(route='unmatched', method='HEAD')
+        self.assertEqual(len(registry.find('http_response_bytes')), 1)
+        self.assertEqual(registry.histogram('http_request_seconds',
+                                            labels).count, 1)
+
+    def test_error(self):
+        def app(environ, start_response):
+            raise ValueError
+
+        registry = Registry()
+        self.assertRaises(ValueError, Request.blank('/').get_response,
+                          MetricsMiddleware(app, registry))
+
+        labels = dict(route='unmatched', method='GET', status='500')
+        self.assertEqual(registry.counter('http_requests', labels).value, 1)
+        self.assertEqual(registry.gauge('http_requests_in_flight').value, 0)
+
+if __name__ == '__main__':
+    unittest.main()
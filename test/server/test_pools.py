@@ -0,0 +1,545 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0103,W0212
+#
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import yaml
+
+from mock import patch
+
+import ztpserver.pools
+
+from ztpserver.pools import ResourcePool, PoolError, PoolFullError
+from ztpserver.pools import SubnetPool, parse_network
+from ztpserver.pools import AllocationService, PoolFlusher
+
+class ResourcePoolUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'pool')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_pool(self, contents):
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write(contents)
+
+    def read_pool(self):
+        return yaml.safe_load(open(self.filename).read())
+
+    def test_allocate_in_file_order(self):
+        self.write_pool('c: null\na: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+        self.assertEqual(pool.allocate('node1'), 'c')
+        self.assertEqual(pool.allocate('node2'), 'a')
+        self.assertEqual(pool.allocate('node1'), 'c')
+        self.assertEqual(pool.lookup('node2'), 'a')
+        self.assertIsNone(pool.lookup('node3'))
+
+    def test_allocate_existing(self):
+        self.write_pool('a: null\nb: node1\n')
+        pool = ResourcePool(self.filename)
+        self.assertEqual(pool.allocate('node1'), 'b')
+        self.assertEqual(pool.stats(), dict(used=1, free=1, total=2))
+
+    def test_allocate_cleared_values(self):
+        # 'None' was written by older versions of ztps --clear-resources
+        self.write_pool('a: None\nb: null\n')
+        pool = ResourcePool(self.filename)
+        self.assertEqual(pool.allocate('node1'), 'a')
+
+    def test_allocate_full(self):
+        self.write_pool('a: node1\n')
+        pool = ResourcePool(self.filename)
+        self.assertRaises(PoolFullError, pool.allocate, 'node2')
+
+    def test_allocate_invalid_pool(self):
+        pool = ResourcePool(self.filename)
+        self.assertRaises(PoolError, pool.allocate, 'node1')
+
+        self.write_pool('')
+        self.assertRaises(PoolError, pool.allocate, 'node1')
+
+    def test_allocate_many(self):
+        self.write_pool('a: null\nb: node2\nc: null\nd: null\n')
+        pool = ResourcePool(self.filename)
+
+        result = pool.allocate_many(['node1', 'node2', 'node3'])
+        self.assertEqual(result.items(), [('node1', 'a'), ('node2', 'b'),
+                                          ('node3', 'c')])
+        # a single journal write (header + 2 entries)
+        self.assertEqual(len(open(pool.journal).readlines()), 3)
+        self.assertEqual(ResourcePool(self.filename).lookup('node3'), 'c')
+
+    def test_allocate_many_full(self):
+        self.write_pool('a: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+
+        self.assertRaises(PoolFullError, pool.allocate_many,
+                          ['node1', 'node2', 'node3'])
+        other = ResourcePool(self.filename)
+        self.assertEqual(other.lookup('node2'), 'b')
+        self.assertIsNone(other.lookup('node3'))
+
+    def test_journal_does_not_rewrite_pool(self):
+        self.write_pool('a: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+        pool.allocate('node1')
+
+        self.assertEqual(self.read_pool(), dict(a=None, b=None))
+        self.assertTrue(os.path.exists(pool.journal))
+
+        # a different process sees the allocation
+        other = ResourcePool(self.filename)
+        self.assertEqual(other.lookup('node1'), 'a')
+        self.assertEqual(other.allocate('node2'), 'b')
+        self.assertEqual(pool.lookup('node2'), 'b')
+
+    def test_compact(self):
+        self.write_pool('a: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+        pool.allocate('node1')
+        pool.compact()
+
+        self.assertEqual(self.read_pool(), dict(a='node1', b=None))
+        self.assertEqual(ResourcePool(self.filename).lookup('node1'), 'a')
+
+    def test_flush(self):
+        self.write_pool('a: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+        self.assertFalse(pool.flush())
+
+        pool.allocate('node1')
+        self.assertTrue(pool.flush())
+        self.assertEqual(self.read_pool(), dict(a='node1', b=None))
+        self.assertFalse(pool.flush())
+
+    def test_compact_threshold(self):
+        self.write_pool(''.join('%s: null\n' % x for x in range(10)))
+        pool = ResourcePool(self.filename)
+
+        threshold = ztpserver.pools.COMPACT_THRESHOLD
+        ztpserver.pools.COMPACT_THRESHOLD = 4
+        try:
+            for index in range(5):
+                pool.allocate('node%s' % index)
+        finally:
+            ztpserver.pools.COMPACT_THRESHOLD = threshold
+
+        self.assertEqual(len([x for x in self.read_pool().values() if x]), 4)
+        self.assertEqual(ResourcePool(self.filename).stats()['used'], 5)
+
+    def test_hand_edit_merges_journal(self):
+        self.write_pool('a: null\nb: null\nc: node3\n')
+        pool = ResourcePool(self.filename)
+        pool.allocate('node1')
+
+        # free 'c' by hand, while 'a' is only recorded in the journal
+        self.write_pool('a: null\nb: null\nc: null\n')
+        stat = os.stat(self.filename)
+        os.utime(self.filename, (stat.st_atime, stat.st_mtime + 1))
+
+        self.assertEqual(pool.lookup('node1'), 'a')
+        self.assertIsNone(pool.lookup('node3'))
+        self.assertEqual(pool.allocate('node2'), 'b')
+        self.assertEqual(self.read_pool(), dict(a='node1', b='node2', c=None))
+
+    def test_partial_journal_entry(self):
+        self.write_pool('a: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+        pool.allocate('node1')
+        with open(pool.journal, 'a') as fhandler:
+            fhandler.write('["a", "b", "no')
+
+        other = ResourcePool(self.filename)
+        self.assertIsNone(other.lookup('no'))
+        self.assertEqual(other.allocate('node2'), 'b')
+        self.assertEqual(ResourcePool(self.filename).lookup('node2'), 'b')
+
+    def test_concurrent_readers(self):
+        self.write_pool('a: node1\nb: null\n')
+        pool = ResourcePool(self.filename)
+        pool.lookup('node1')
+
+        done = threading.Event()
+        def reader():
+            self.assertEqual(pool.lookup('node1'), 'a')
+            done.set()
+
+        def wait():
+            thread = threading.Thread(target=reader)
+            thread.start()
+            # the second reader completes while the first one holds the
+            # shared lock
+            done.wait(5)
+            thread.join()
+            return done.is_set()
+
+        self.assertTrue(pool._read(wait))
+
+    def test_refresh_only_if_modified(self):
+        self.write_pool('a: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+        locks = ztpserver.pools.POOL_LOCKS
+        with patch.object(locks, 'exclusive',
+                          wraps=locks.exclusive) as exclusive:
+            self.assertIsNone(pool.lookup('node1'))
+            self.assertEqual(exclusive.call_count, 1)
+            self.assertIsNone(pool.lookup('node1'))
+            self.assertEqual(pool.stats()['used'], 0)
+            self.assertEqual(exclusive.call_count, 1)
+
+            ResourcePool(self.filename).allocate('node1')
+            exclusive.reset_mock()
+            self.assertEqual(pool.lookup('node1'), 'a')
+            self.assertEqual(pool.lookup('node1'), 'a')
+            self.assertEqual(exclusive.call_count, 1)
+
+    def test_release(self):
+        self.write_pool('a: null\nb: null\n')
+        pool = ResourcePool(self.filename)
+        pool.allocate('node1')
+        pool.allocate('node2')
+
+        self.assertEqual(pool.release('node1'), ['a'])
+        self.assertEqual(pool.release('node1'), [])
+        self.assertEqual(ResourcePool(self.filename).allocate('node3'), 'a')
+
+    def test_clear(self):
+        self.write_pool('a: null\nb: node2\n')
+        pool = ResourcePool(self.filename)
+        pool.allocate('node1')
+        pool.clear()
+
+        self.assertEqual(self.read_pool(), dict(a=None, b=None))
+        self.assertEqual(pool.stats(), dict(used=0, free=2, total=2))
+
+    def test_get_pool(self):
+        pool = ztpserver.pools.get_pool(self.filename)
+        self.assertIs(ztpserver.pools.get_pool(self.filename), pool)
+
+    def test_is_pool_file(self):
+        self.assertTrue(ztpserver.pools.is_pool_file('/a/pool'))
+        self.assertFalse(ztpserver.pools.is_pool_file('/a/.pool.journal'))
+
+
+class SubnetPoolUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'subnet')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_subnet(self, contents):
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write(contents)
+        # make sure the change is detected
+        stat = os.stat(self.filename)
+        os.utime(self.filename, (stat.st_atime, stat.st_mtime + 1))
+
+    def test_parse_network(self):
+        (_, first, last, prefixlen) = parse_network('10.1.2.3/24')
+        self.assertEqual((last - first, prefixlen), (255, 24))
+        (_, first, last, prefixlen) = parse_network('2001:db8::/120')
+        self.assertEqual((last - first, prefixlen), (255, 120))
+        self.assertRaises(PoolError, parse_network, '10.1.2.3/33')
+        self.assertRaises(PoolError, parse_network, 'foo/24')
+
+    def test_allocate(self):
+        self.write_subnet('network: 10.0.0.0/29\n'
+                          'exclude: [10.0.0.1, 10.0.0.4/31]\n')
+        pool = SubnetPool(self.filename)
+
+        self.assertEqual(pool.allocate('node1'), '10.0.0.2/29')
+        self.assertEqual(pool.allocate('node2'), '10.0.0.3/29')
+        self.assertEqual(pool.allocate('node3'), '10.0.0.6/29')
+        self.assertEqual(pool.allocate('node1'), '10.0.0.2/29')
+        self.assertRaises(PoolFullError, pool.allocate, 'node4')
+        self.assertEqual(pool.stats(), dict(used=3, free=0, total=3))
+
+    def test_allocate_many(self):
+        self.write_subnet('network: 10.0.0.0/29\n')
+        pool = SubnetPool(self.filename)
+        pool.allocate('node2')
+
+        result = pool.allocate_many(['node1', 'node2', 'node3'])
+        self.assertEqual(result.items(), [('node1', '10.0.0.2/29'),
+                                          ('node2', '10.0.0.1/29'),
+                                          ('node3', '10.0.0.3/29')])
+        self.assertEqual(SubnetPool(self.filename).lookup('node3'),
+                         '10.0.0.3/29')
+
+        self.assertRaises(PoolFullError, pool.allocate_many,
+                          ['node%d' % x for x in range(4, 9)])
+        self.assertEqual(SubnetPool(self.filename).stats()['free'], 0)
+
+    def test_allocate_ipv6(self):
+        self.write_subnet('network: 2001:db8::/126\nprefixlen: 64\n')
+        pool = SubnetPool(self.filename)
+        self.assertEqual(pool.allocate('node1'), '2001:db8::/64')
+        self.assertEqual(pool.allocate('node2'), '2001:db8::1/64')
+
+    def test_persistence(self):
+        self.write_subnet('network: 10.0.0.0/24\n')
+        pool = SubnetPool(self.filename)
+        pool.allocate('node1')
+        pool.allocate('node2')
+
+        other = SubnetPool(self.filename)
+        self.assertEqual(other.lookup('node2'), '10.0.0.2/24')
+        self.assertEqual(other.allocate('node3'), '10.0.0.3/24')
+        self.assertEqual(pool.lookup('node3'), '10.0.0.3/24')
+
+    def test_release(self):
+        self.write_subnet('network: 10.0.0.0/24\n')
+        pool = SubnetPool(self.filename)
+        pool.allocate('node1')
+        pool.allocate('node2')
+
+        self.assertEqual(pool.release('node1'), ['10.0.0.1/24'])
+        self.assertEqual(pool.release('node1'), [])
+        self.assertEqual(SubnetPool(self.filename).allocate('node3'),
+                         '10.0.0.1/24')
+
+        pool.clear()
+        self.assertEqual(pool.stats()['used'], 0)
+
+    def test_journal(self):
+        self.write_subnet('network: 10.0.0.0/16\n')
+        pool = SubnetPool(self.filename)
+        pool.allocate_many(['node1', 'node2'])
+        pool.release('node1')
+        self.assertEqual([json.loads(x) for x in open(pool.statefile)],
+                         [['a', 'node1', 0x0a000001],
+                          ['a', 'node2', 0x0a000002],
+                          ['f', 'node1', 0x0a000001]])
+
+        other = SubnetPool(self.filename)
+        self.assertEqual(other.lookup('node2'), '10.0.0.2/16')
+
+        # other processes only replay the new entries
+        pool.allocate('node3')
+        with patch.object(other, '_load') as load:
+            self.assertEqual(other.lookup('node3'), '10.0.0.1/16')
+            self.assertEqual(other.allocate('node4'), '10.0.0.3/16')
+            self.assertFalse(load.called)
+        self.assertEqual(pool.lookup('node4'), '10.0.0.3/16')
+
+    def test_compact(self):
+        self.write_subnet('network: 10.0.0.0/24\n')
+        pool = SubnetPool(self.filename)
+        pool.allocate('node1')
+        with patch.object(ztpserver.pools, 'COMPACT_THRESHOLD', 4):
+            for _ in range(5):
+                pool.allocate('node2')
+                pool.release('node2')
+
+        self.assertEqual(len(open(pool.statefile).readlines()), 3)
+        other = SubnetPool(self.filename)
+        self.assertEqual(other.stats()['used'], 1)
+        self.assertEqual(other.allocate('node3'), '10.0.0.2/24')
+
+    def test_partial_journal_entry(self):
+        self.write_subnet('network: 10.0.0.0/24\n')
+        pool = SubnetPool(self.filename)
+        pool.allocate('node1')
+        with open(pool.statefile, 'a') as fhandler:
+            fhandler.write('["a", "no')
+
+        other = SubnetPool(self.filename)
+        self.assertIsNone(other.lookup('no'))
+        self.assertEqual(other.allocate('node2'), '10.0.0.2/24')
+        self.assertEqual(SubnetPool(self.filename).lookup('node2'),
+                         '10.0.0.2/24')
+
+    def test_definition_change(self):
+        self.write_subnet('network: 10.0.0.0/24\n')
+        pool = SubnetPool(self.filename)
+        pool.allocate('node1')
+        pool.allocate('node2')
+
+        self.write_subnet('network: 10.0.0.0/16\nexclude: [10.0.0.2]\n')
+        self.assertEqual(pool.lookup('node1'), '10.0.0.1/16')
+        self.assertEqual(pool.lookup('node2'), '10.0.0.2/16')
+        self.assertEqual(pool.allocate('node3'), '10.0.0.3/16')
+        self.assertEqual(pool.stats(), dict(used=3, free=65531, total=65534))
+
+    def test_too_large(self):
+        self.write_subnet('network: 10.0.0.0/7\n')
+        self.assertRaises(PoolError, SubnetPool(self.filename).allocate,
+                          'node1')
+
+
+class PoolFlusherUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'pool')
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write('a: null\nb: null\n')
+        ztpserver.pools._pools.clear()
+
+    def tearDown(self):
+        ztpserver.pools._pools.clear()
+        shutil.rmtree(self.path)
+
+    def read_pool(self):
+        return yaml.safe_load(open(self.filename).read())
+
+    def test_flush_pools(self):
+        ztpserver.pools.get_pool(self.filename).allocate('node1')
+        self.assertEqual(ztpserver.pools.flush_pools(), [self.filename])
+        self.assertEqual(self.read_pool(), dict(a='node1', b=None))
+        self.assertEqual(ztpserver.pools.flush_pools(), [])
+
+    def test_interval(self):
+        flusher = PoolFlusher(0.01)
+        flusher.start()
+        try:
+            ztpserver.pools.get_pool(self.filename).allocate('node1')
+            for _ in range(500):
+                if self.read_pool()['a'] is not None:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(self.read_pool(), dict(a='node1', b=None))
+        finally:
+            flusher.stop()
+
+    def test_stop(self):
+        flusher = PoolFlusher(3600)
+        flusher.start()
+        ztpserver.pools.get_pool(self.filename).allocate('node1')
+        self.assertEqual(self.read_pool(), dict(a=None, b=None))
+        flusher.stop()
+        self.assertEqual(self.read_pool(), dict(a='node1', b=None))
+
+
+class AllocationServiceUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'pool')
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write('a: null\nb: node2\nc: null\nd: null\n')
+        self.service = AllocationService(self.path, flush_interval=60)
+
+    def tearDown(self):
+        self.service.stop()
+        ztpserver.pools._pools.clear()
+        shutil.rmtree(self.path)
+
+    def read_pool(self):
+        return yaml.safe_load(open(self.filename).read())
+
+    def test_loads_pools_on_start(self):
+        self.service.start()
+        self.assertEqual(self.service.lookup(self.filename, 'node2'), 'b')
+        self.assertIsNone(self.service.lookup(self.filename, 'node1'))
+
+    def test_allocate(self):
+        self.service.start()
+        self.assertEqual(self.service.allocate(self.filename, 'node1'), 'a')
+        self.assertEqual(self.service.allocate(self.filename, 'node1'), 'a')
+        self.assertEqual(self.service.lookup(self.filename, 'node1'), 'a')
+
+        # journaled (not compacted) until the next flush
+        self.assertIsNone(self.read_pool()['a'])
+        self.assertEqual(ResourcePool(self.filename).lookup('node1'), 'a')
+
+        self.service.stop()
+        self.assertEqual(self.read_pool()['a'], 'node1')
+
+    def test_allocate_concurrent(self):
+        self.service.start()
+        results = dict()
+
+        def allocate(node_id):
+            results[node_id] = self.service.allocate(self.filename, node_id)
+
+        threads = [threading.Thread(target=allocate, args=(x,))
+                   for x in ['node1', 'node3', 'node4']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results.values()), ['a', 'c', 'd'])
+        self.assertRaises(PoolFullError, self.service.allocate,
+                          self.filename, 'node5')
+
+    def test_release(self):
+        self.service.start()
+        self.assertEqual(self.service.release(self.filename, 'node2'), ['b'])
+        self.assertIsNone(self.service.lookup(self.filename, 'node2'))
+        self.assertEqual(self.service.allocate(self.filename, 'node3'), 'a')
+
+    def test_external_changes(self):
+        self.service.start()
+        ResourcePool(self.filename).allocate('node1')
+
+        # picked up by the writer before allocating
+        self.assertEqual(self.service.allocate(self.filename, 'node1'), 'a')
+        self.assertEqual(self.service.allocate(self.filename, 'node3'), 'c')
+
+    def test_released_by_other_process(self):
+        self.service.start()
+        self.assertEqual(self.service.allocate(self.filename, 'node1'), 'a')
+
+        other = ResourcePool(self.filename)
+        self.assertEqual(other.release('node1'), ['a'])
+        self.assertEqual(other.allocate('node3'), 'a')
+
+        # the cached answer is not served once the pool has changed
+        self.assertEqual(self.service.lookup(self.filename, 'node3'), 'a')
+        self.assertEqual(self.service.allocate(self.filename, 'node1'), 'c')
+        self.assertEqual(other.lookup('node1'), 'c')
+
+    def test_not_running(self):
+        self.assertRaises(PoolError, self.service.allocate,
+                          self.filename, 'node1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from webob import Request
+
+from ztpserver.config import runtime
+from ztpserver.profiling import PROFILE_HEADER, RequestProfiler
+from ztpserver.profiling import load_profiles, profile_files, profile_tags
+from ztpserver.profiling import SamplerBusy, StackSampler, collapsed
+from ztpserver.wsgiapp import WSGIController
+
+
+class Controller(WSGIController):
+
+    def show(self, request, resource, **kwargs):
+        return dict(body=resource)
+
+
+class ProfilingUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        runtime.set_value('enabled', True, 'profiling')
+        runtime.set_value('directory', self.directory, 'profiling')
+
+    def tearDown(self):
+        for name in ['enabled', 'sample', 'token', 'directory']:
+            runtime.clear_value(name, 'profiling')
+        shutil.rmtree(self.directory)
+
+    def test_wanted_sample(self):
+        runtime.set_value('sample', 3, 'profiling')
+        profiler = RequestProfiler()
+        request = Request.blank('/')
+        self.assertEqual([profiler.wanted(request) for _ in range(6)],
+                         [False, False, True, False, False, True])
+
+    def test_wanted_disabled(self):
+        runtime.set_value('enabled', False, 'profiling')
+        runtime.set_value('sample', 1, 'profiling')
+        self.assertFalse(RequestProfiler().wanted(Request.blank('/')))
+
+    def test_wanted_token(self):
+        runtime.set_value('sample', 0, 'profiling')
+        runtime.set_value('token', 'secret', 'profiling')
+        profiler = RequestProfiler()
+        self.assertFalse(profiler.wanted(Request.blank('/')))
+        self.assertFalse(profiler.wanted(Request.blank(
+            '/', headers={PROFILE_HEADER: 'guess'})))
+        self.assertTrue(profiler.wanted(Request.blank(
+            '/', headers={PROFILE_HEADER: 'secret'})))
+
+    def test_wanted_no_token(self):
+        runtime.set_value('sample', 0, 'profiling')
+        self.assertFalse(RequestProfiler().wanted(Request.blank(
+            '/', headers={PROFILE_HEADER: ''})))
+
+    def test_controller(self):
+        runtime.set_value('sample', 1, 'profiling')
+
+        request = Request.blank('/nodes/001c73aabbcc')
+        request.urlvars = dict(action='show', resource='001c73aabbcc')
+        resp = request.get_response(Controller())
+        self.assertEqual(resp.body, '001c73aabbcc')
+
+        filenames = profile_files([self.directory])
+        self.assertEqual(len(filenames), 1)
+        self.assertEqual(profile_tags(filenames[0]),
+                         ('nodes_001c73aabbcc', '001c73aabbcc'))
+
+        stats = load_profiles([self.directory])
+        self.assertTrue([x for x in stats.stats
+                         if x[2] == 'show'])
+
+    def test_write_failure(self):
+        runtime.set_value('sample', 1, 'profiling')
+        filename = os.path.join(self.directory, 'file')
+        open(filename, 'w').close()
+        runtime.set_value('directory', filename, 'profiling')
+
+        request = Request.blank('/')
+        request.urlvars = dict(action='show', resource='node')
+        self.assertEqual(request.get_response(Controller()).body, 'node')
+
+    def test_load_profiles_none(self):
+        self.assertIsNone(load_profiles([self.directory]))
+
+
+def blocked_in_sampler_test(event):
+    event.wait()
+
+
+class StackSamplerUnitTests(unittest.TestCase):
+
+    def test_sample(self):
+        event = threading.Event()
+        worker = threading.Thread(target=blocked_in_sampler_test,
+                                  args=(event,), name='worker')
+        worker.start()
+        try:
+            counts = StackSampler().sample(0.05, 100)
+        finally:
+            event.set()
+            worker.join()
+
+        stacks = [x for x in counts
+                  if x.startswith('worker;') and
+                  'test_profiling:blocked_in_sampler_test;threading:wait'
+                  in x]
+        self.assertEqual(len(stacks), 1)
+        self.assertTrue(counts[stacks[0]] >= 2)
+        self.assertFalse([x for x in counts if 'StackSampler' in x or
+                          ' ' in x])
+
+    def test_busy(self):
+        sampler = StackSampler()
+        sampler._lock.acquire()         #pylint: disable=W0212
+        self.assertRaises(SamplerBusy, sampler.sample, 0.01, 100)
+
+    def test_collapsed(self):
+        self.assertEqual(collapsed({'a;b': 2, 'a': 1}), 'a 1\na;b 2\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
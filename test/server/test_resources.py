@@ -0,0 +1,230 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0103
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ztpserver.config
+import ztpserver.metrics
+import ztpserver.resources
+
+from ztpserver.resources import PluginRegistry, PluginError
+from ztpserver.resources import run_plugin, run_plugins, preallocate
+from ztpserver.resources import resource_stats
+
+BATCH_PLUGIN = '''
+CALLS = []
+
+def main(node_id, pool):
+    raise NotImplementedError
+
+def main_batch(node_id, pools):
+    CALLS.append(pools)
+    return dict((x, '%s:%s' % (node_id, x)) for x in pools)
+'''
+
+PREALLOCATE_PLUGIN = '''
+CALLS = []
+
+def main(node_id, pool):
+    raise NotImplementedError
+
+def main_preallocate(node_ids, pool):
+    CALLS.append((node_ids, pool))
+    return dict((x, '%s:%s' % (x, pool)) for x in node_ids)
+'''
+
+STATS_PLUGIN = '''
+def main(node_id, pool):
+    raise Exception('failed')
+
+def main_stats():
+    return dict(pool1=dict(used=1, free=2, total=3),
+                pool2=dict(used=0, free=5, total=5))
+'''
+
+PLUGIN = '''
+def main(node_id, pool):
+    return '%%s:%%s:%%s' %% (node_id, pool, VERSION)
+
+VERSION = %d
+'''
+
+class PluginRegistryUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.data_root, 'plugins'))
+        ztpserver.config.runtime.set_value('data_root', self.data_root,
+                                           'default')
+
+    def tearDown(self):
+        ztpserver.config.runtime.clear_value('data_root', 'default')
+        shutil.rmtree(self.data_root)
+
+    def write_plugin(self, name, contents):
+        filename = os.path.join(self.data_root, 'plugins', name)
+        with open(filename, 'w') as fhandler:
+            fhandler.write(contents)
+        return filename
+
+    def test_get_loads_once(self):
+        self.write_plugin('demo', PLUGIN % 1)
+        registry = PluginRegistry()
+
+        plugin = registry.get('demo')
+        self.assertIs(registry.get('demo'), plugin)
+        self.assertEqual(plugin.module.main('node', 'pool'), 'node:pool:1')
+        self.assertEqual(registry.plugins, ['demo'])
+
+    def test_get_reloads_on_change(self):
+        filename = self.write_plugin('demo', PLUGIN % 1)
+        registry = PluginRegistry()
+        plugin = registry.get('demo')
+
+        self.write_plugin('demo', PLUGIN % 22)
+        mtime = os.stat(filename).st_mtime + 1
+        os.utime(filename, (mtime, mtime))
+
+        reloaded = registry.get('demo')
+        self.assertIsNot(reloaded, plugin)
+        self.assertEqual(reloaded.module.main('node', 'pool'),
+                         'node:pool:22')
+
+    def test_get_missing_plugin(self):
+        registry = PluginRegistry()
+        self.assertRaises(PluginError, registry.get, 'missing')
+
+    def test_get_invalid_signature(self):
+        self.write_plugin('nomain', 'def run(node_id, pool):\n    pass\n')
+        self.write_plugin('badargs', 'def main(node_id):\n    pass\n')
+        registry = PluginRegistry()
+
+        self.assertRaises(PluginError, registry.get, 'nomain')
+        self.assertRaises(PluginError, registry.get, 'badargs')
+        self.assertEqual(registry.plugins, [])
+
+    def test_load_reports_errors(self):
+        self.write_plugin('demo', PLUGIN % 1)
+        self.write_plugin('broken', 'def main(:\n')
+        registry = PluginRegistry()
+
+        errors = registry.load()
+        self.assertEqual(errors.keys(), ['broken'])
+        self.assertEqual(registry.plugins, ['demo'])
+
+    def test_run_plugin(self):
+        self.write_plugin('demo', PLUGIN % 1)
+        ztpserver.resources.registry.clear()
+        self.assertEqual(run_plugin('demo', 'node', 'pool'), 'node:pool:1')
+
+    def test_run_plugin_failure(self):
+        self.assertRaises(Exception, run_plugin, 'missing', 'node', 'pool')
+
+    def test_run_plugins(self):
+        self.write_plugin('demo', PLUGIN % 1)
+        self.write_plugin('batch', BATCH_PLUGIN)
+        ztpserver.resources.registry.clear()
+
+        references = set([('demo', 'pool1'), ('demo', 'pool2'),
+                          ('batch', 'pool1'), ('batch', 'pool2')])
+        result = run_plugins(references, 'node')
+
+        self.assertEqual(result, {('demo', 'pool1'): 'node:pool1:1',
+                                  ('demo', 'pool2'): 'node:pool2:1',
+                                  ('batch', 'pool1'): 'node:pool1',
+                                  ('batch', 'pool2'): 'node:pool2'})
+        module = ztpserver.resources.registry.get('batch').module
+        self.assertEqual(module.CALLS, [['pool1', 'pool2']])
+
+    def test_run_plugins_missing_value(self):
+        self.write_plugin('batch', BATCH_PLUGIN.replace('for x in pools',
+                                                        'for x in pools[1:]'))
+        ztpserver.resources.registry.clear()
+        self.assertRaises(Exception, run_plugins,
+                          set([('batch', 'pool1'), ('batch', 'pool2')]),
+                          'node')
+
+    def test_preallocate(self):
+        self.write_plugin('demo', PLUGIN % 1)
+        self.write_plugin('bulk', PREALLOCATE_PLUGIN)
+        ztpserver.resources.registry.clear()
+
+        result = preallocate({('demo', 'pool1'): ['node1', 'node2'],
+                              ('bulk', 'pool1'): ['node1', 'node2'],
+                              ('bulk', 'pool2'): ['node3']})
+
+        self.assertEqual(result,
+                         {('demo', 'pool1'): {'node1': 'node1:pool1:1',
+                                              'node2': 'node2:pool1:1'},
+                          ('bulk', 'pool1'): {'node1': 'node1:pool1',
+                                              'node2': 'node2:pool1'},
+                          ('bulk', 'pool2'): {'node3': 'node3:pool2'}})
+        module = ztpserver.resources.registry.get('bulk').module
+        self.assertEqual(module.CALLS, [(['node1', 'node2'], 'pool1'),
+                                        (['node3'], 'pool2')])
+
+    def test_preallocate_missing_value(self):
+        self.write_plugin('bulk', PREALLOCATE_PLUGIN.replace(
+            'for x in node_ids', 'for x in node_ids[1:]'))
+        ztpserver.resources.registry.clear()
+        self.assertRaises(Exception, preallocate,
+                          {('bulk', 'pool1'): ['node1', 'node2']})
+
+    def test_resource_stats(self):
+        self.write_plugin('demo', PLUGIN % 1)
+        self.write_plugin('stats', STATS_PLUGIN)
+        ztpserver.resources.registry.clear()
+        ztpserver.metrics.registry.clear()
+
+        run_plugin('demo', 'node', 'pool')
+        self.assertRaises(Exception, run_plugin, 'stats', 'node', 'pool')
+        stats = resource_stats()
+
+        self.assertEqual(sorted(stats.keys()), ['demo', 'stats'])
+        self.assertEqual(stats['stats']['pools']['pool1'],
+                         dict(used=1, free=2, total=3))
+        self.assertEqual((stats['stats']['used'], stats['stats']['free'],
+                          stats['stats']['total']), (1, 7, 8))
+        self.assertEqual(stats['stats']['errors'], 1)
+        self.assertNotIn('pools', stats['demo'])
+        self.assertEqual(stats['demo']['latency']['count'], 1)
+        self.assertEqual(stats['demo']['errors'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,13 +30,25 @@
 # IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import collections
+import json
 import os
 import random
+import shutil
+import stat
+import tempfile
+import threading
 import unittest
 
+import yaml
+
 import ztpserver.serializers as serializers
 
-from ztpserver.constants import CONTENT_TYPE_JSON
+from collections import OrderedDict
+
+from ztpserver.config import runtime
+from ztpserver.constants import CONTENT_TYPE_JSON, CONTENT_TYPE_YAML
+from ztpserver.constants import CONTENT_TYPE_OTHER
 
 TMP_FILE = '/tmp/test_serializers-%s' % os.getpid()
 
@@ -49,6 +61,26 @@ def get_data():
 
     return result
 
+def convert_from_unicode(data):
+    # reference: the conversion pass previously applied to every document
+    if isinstance(data, basestring):
+        return str(data)
+    elif isinstance(data, collections.Mapping):
+        return dict([convert_from_unicode(x) for x in data.items()])
+    elif isinstance(data, collections.Iterable):
+        return type(data)([convert_from_unicode(x) for x in data])
+    else:
+        return data
+
+DOCUMENTS = [
+    'a: b\nc: [1, 2.5, x, null, true]\nd: {e: [[f, {g: h}]]}\n',
+    '- x\n- !!set {a, b}\n- 2015-01-01\n- !!binary aGVsbG8=\n',
+    '"quoted": \'single\'\nkey with spaces: |\n  block\n  text\n',
+    '!!omap [a: 1, b: 2]',
+    'plain string',
+    '',
+]
+
 class SerializersUnitTest(unittest.TestCase):
 
     def test_dump_success(self):
@@ -63,6 +95,82 @@ class SerializersUnitTest(unittest.TestCase):
     def test_loads_success(self):
         pass
 
+    def test_yaml_backend(self):
+        if yaml.__with_libyaml__:
+            self.assertEqual(serializers.YAML_BACKEND, 'libyaml')
+            self.assertTrue(issubclass(serializers.YAMLLoader,
+                                       yaml.CSafeLoader))
+
+        # only the safe constructors are available
+        self.assertRaises(serializers.SerializerError, serializers.loads,
+                          '!!python/object/apply:os.system ["true"]',
+                          CONTENT_TYPE_YAML, 'test')
+
+    def test_yaml_ordered_dict(self):
+        data = OrderedDict([('b', 1), ('a', None), ('c', 'x')])
+        self.assertEqual(serializers.dumps(data, CONTENT_TYPE_YAML, 'test'),
+                         'b: 1\na: null\nc: x\n')
+
+    def test_shared_handlers(self):
+        handler = serializers.get_handler(CONTENT_TYPE_YAML)
+        self.assertIs(serializers.Serializer('test').handlers[
+            CONTENT_TYPE_YAML], handler)
+        self.assertIs(serializers.get_handler('unknown'),
+                      serializers.get_handler(CONTENT_TYPE_OTHER))
+
+    def test_add_handler(self):
+        serializer = serializers.Serializer('test')
+        serializer.add_handler(CONTENT_TYPE_JSON,
+                               serializers.TextSerializer())
+        self.assertEqual(serializer.deserialize('{}', CONTENT_TYPE_JSON),
+                         '{}')
+
+        # the shared handler is not affected
+        self.assertEqual(serializers.loads('{}', CONTENT_TYPE_JSON, 'test'),
+                         {})
+
+    def test_error_message(self):
+        try:
+            serializers.loads('{', CONTENT_TYPE_JSON, 'node1')
+        except serializers.SerializerError as err:
+            self.assertTrue(str(err).startswith('node1: '))
+        else:
+            self.fail('SerializerError not raised')
+
+    def assertSameTypes(self, first, second):
+        self.assertEqual(type(first), type(second))
+        if isinstance(first, dict):
+            for key in first:
+                self.assertEqual(type(key),
+                                 type([x for x in second if x == key][0]))
+                self.assertSameTypes(first[key], second[key])
+        elif isinstance(first, (list, tuple)):
+            for (item1, item2) in zip(first, second):
+                self.assertSameTypes(item1, item2)
+
+    def test_yaml_same_as_conversion_pass(self):
+        for document in DOCUMENTS:
+            expected = convert_from_unicode(yaml.safe_load(document))
+            result = serializers.loads(document, CONTENT_TYPE_YAML, 'test')
+            self.assertEqual(result, expected)
+            self.assertSameTypes(result, expected)
+
+    def test_json_same_as_conversion_pass(self):
+        for document in DOCUMENTS[:1] + ['"string"', '[["a", {"b": ["c"]}]]',
+                                         '{"a": {"b": [1, null, "x"]}}']:
+            document = json.dumps(yaml.safe_load(document))
+            expected = convert_from_unicode(json.loads(document))
+            result = serializers.loads(document, CONTENT_TYPE_JSON, 'test')
+            self.assertEqual(result, expected)
+            self.assertSameTypes(result, expected)
+
+    def test_non_ascii(self):
+        # as before, non-ASCII strings cannot be converted to str
+        self.assertRaises(UnicodeEncodeError, serializers.loads,
+                          'a: \xc3\xa9', CONTENT_TYPE_YAML, 'test')
+        self.assertRaises(UnicodeEncodeError, serializers.loads,
+                          '{"a": "\\u00e9"}', CONTENT_TYPE_JSON, 'test')
+
     @classmethod
     def test_stress(cls):
         # stress test writing and loading the same file over and
@@ -77,5 +185,175 @@ class SerializersUnitTest(unittest.TestCase):
             assert serializers.load(TMP_FILE, 
                                     CONTENT_TYPE_JSON) == data
 
+
+class DumpUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_new_file(self):
+        # the mode of a file created the usual way (less the umask)
+        expected = os.path.join(self.path, 'expected')
+        os.close(os.open(expected, os.O_WRONLY | os.O_CREAT,
+                         serializers.FILE_MODE))
+        expected_mode = stat.S_IMODE(os.stat(expected).st_mode)
+        os.remove(expected)
+
+        serializers.dump({'a': 'b'}, self.filename, CONTENT_TYPE_YAML)
+        self.assertEqual(os.listdir(self.path), ['file'])
+        self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode),
+                         expected_mode)
+        self.assertEqual(serializers.load(self.filename, CONTENT_TYPE_YAML),
+                         {'a': 'b'})
+
+    def test_replace(self):
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write('old')
+        os.chmod(self.filename, 0640)
+        inode = os.stat(self.filename).st_ino
+
+        serializers.dump('new', self.filename, CONTENT_TYPE_OTHER, sync=True)
+        self.assertEqual(os.listdir(self.path), ['file'])
+        self.assertNotEqual(os.stat(self.filename).st_ino, inode)
+        self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode), 0640)
+        self.assertEqual(open(self.filename).read(), 'new')
+
+    def test_symlink(self):
+        target = os.path.join(self.path, 'target')
+        open(target, 'w').close()
+        os.symlink(target, self.filename)
+        serializers.dump('new', self.filename, CONTENT_TYPE_OTHER)
+        self.assertTrue(os.path.islink(self.filename))
+        self.assertEqual(open(target).read(), 'new')
+
+    def test_serialize_failure(self):
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write('old')
+        self.assertRaises(serializers.SerializerError, serializers.dump,
+                          object(), self.filename, CONTENT_TYPE_JSON)
+        self.assertEqual(os.listdir(self.path), ['file'])
+        self.assertEqual(open(self.filename).read(), 'old')
+
+    def test_lock(self):
+        serializers.dump('new', self.filename, CONTENT_TYPE_OTHER, lock=True)
+        self.assertEqual(os.listdir(self.path), ['file'])
+        self.assertEqual(open(self.filename).read(), 'new')
+
+    def test_write_failure(self):
+        filename = os.path.join(self.path, 'missing', 'file')
+        self.assertRaises(serializers.SerializerError, serializers.dump,
+                          'new', filename, CONTENT_TYPE_OTHER)
+
+    def test_concurrent_readers(self):
+        data = dict(('key%d' % x, 'x' * 100) for x in range(100))
+        serializers.dump(data, self.filename, CONTENT_TYPE_JSON)
+        done = threading.Event()
+        errors = list()
+
+        def reader():
+            while not done.is_set():
+                try:
+                    assert serializers.load(self.filename,
+                                            CONTENT_TYPE_JSON) == data
+                except Exception as err:    #pylint: disable=W0703
+                    errors.append(err)
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for _ in range(200):
+            serializers.dump(data, self.filename, CONTENT_TYPE_JSON)
+        done.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class FileCacheUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        runtime.set_value('file_cache_size', 2, 'default')
+        serializers.FILE_CACHE.clear()
+        self.files = ['%s-%d' % (TMP_FILE, x) for x in range(3)]
+        for filename in self.files:
+            with open(filename, 'w') as fhandler:
+                fhandler.write('name: %s\nactions: [{a: b}]\n' % filename)
+        self.stats = serializers.FILE_CACHE.stats()
+
+    def tearDown(self):
+        runtime.clear_value('file_cache_size', 'default')
+        serializers.FILE_CACHE.clear()
+        for filename in self.files:
+            os.remove(filename)
+
+    def load(self, filename):
+        return serializers.load(filename, CONTENT_TYPE_YAML, 'test')
+
+    def delta(self):
+        stats = serializers.FILE_CACHE.stats()
+        return (stats['hits'] - self.stats['hits'],
+                stats['misses'] - self.stats['misses'])
+
+    def test_disabled(self):
+        runtime.set_value('file_cache_size', 0, 'default')
+        self.load(self.files[0])
+        self.load(self.files[0])
+        self.assertEqual(self.delta(), (0, 0))
+        self.assertEqual(len(serializers.FILE_CACHE), 0)
+
+    def test_hit(self):
+        first = self.load(self.files[0])
+        second = self.load(self.files[0])
+        self.assertEqual(first, second)
+        self.assertEqual(first['name'], self.files[0])
+        self.assertEqual(self.delta(), (1, 1))
+
+    def test_copies(self):
+        self.load(self.files[0])['actions'][0]['a'] = 'modified'
+        self.assertEqual(self.load(self.files[0])['actions'], [{'a': 'b'}])
+        self.load(self.files[0])['actions'].append('x')
+        self.assertEqual(self.load(self.files[0])['actions'], [{'a': 'b'}])
+
+    def test_modified(self):
+        self.load(self.files[0])
+        with open(self.files[0], 'a') as fhandler:
+            fhandler.write('extra: true\n')
+        self.assertTrue(self.load(self.files[0])['extra'])
+        self.assertEqual(self.delta(), (0, 2))
+        # the previous version of the file is dropped
+        self.assertEqual(len(serializers.FILE_CACHE), 1)
+
+    def test_content_type(self):
+        self.load(self.files[0])
+        self.assertIsInstance(serializers.load(self.files[0],
+                                               CONTENT_TYPE_OTHER, 'test'),
+                              str)
+        self.assertEqual(self.delta(), (0, 2))
+
+    def test_lru(self):
+        self.load(self.files[0])
+        self.load(self.files[1])
+        self.load(self.files[0])
+        self.load(self.files[2])        # evicts files[1]
+        self.assertEqual(self.delta(), (1, 3))
+        self.load(self.files[0])
+        self.assertEqual(self.delta(), (2, 3))
+        self.load(self.files[1])
+        self.assertEqual(self.delta(), (2, 4))
+        self.assertEqual(len(serializers.FILE_CACHE), 2)
+
+    def test_resize(self):
+        for filename in self.files:
+            self.load(filename)
+        runtime.set_value('file_cache_size', 1, 'default')
+        self.load(self.files[2])
+        self.assertEqual(len(serializers.FILE_CACHE), 1)
+        self.assertEqual(self.delta(), (1, 3))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,442 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import httplib
+import os
+import shutil
+import signal
+import socket
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from mock import patch
+from webob.static import FileApp
+
+import ztpserver.server
+
+from ztpserver.server import make_server, FileWrapper, PreforkServer
+
+
+def app(environ, start_response):
+    path = environ['PATH_INFO']
+    if path == '/slow':
+        time.sleep(0.2)
+    if path == '/echo':
+        body = environ['wsgi.input'].read()
+    elif path == '/stream':
+        # no Content-Length
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return iter(['a', 'b'])
+    else:
+        body = '%s %s' % (os.getpid(), path)
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def setUpModule():
+    # silence the access log
+    global quiet                        #pylint: disable=W0601
+    quiet = patch.object(BaseHTTPRequestHandler, 'log_message')
+    quiet.start()
+
+def tearDownModule():
+    quiet.stop()
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class WSGIServerUnitTests(unittest.TestCase):
+
+    def start(self, threads=4, keepalive_timeout=5):
+        self.server = make_server('127.0.0.1', 0, app, threads=threads,
+                                  keepalive_timeout=keepalive_timeout)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs=dict(poll_interval=0.05))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def connection(self):
+        return httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+
+    def request(self, conn, path, method='GET', body=None):
+        conn.request(method, path, body)
+        response = conn.getresponse()
+        return (response, response.read())
+
+    def test_keepalive(self):
+        self.start()
+        conn = self.connection()
+        (response, body) = self.request(conn, '/a')
+        self.assertEqual(response.version, 11)
+        self.assertEqual(body.split()[1], '/a')
+        sock = conn.sock
+        self.assertIsNotNone(sock)
+
+        # the body of the POST is not read by the application
+        (response, body) = self.request(conn, '/b', 'POST', 'x' * 1000)
+        self.assertEqual(body.split()[1], '/b')
+        (response, body) = self.request(conn, '/echo', 'POST', 'data')
+        self.assertEqual(body, 'data')
+        self.assertIs(conn.sock, sock)
+        conn.close()
+
+    def test_no_content_length(self):
+        self.start()
+        conn = self.connection()
+        (response, body) = self.request(conn, '/stream')
+        self.assertEqual(body, 'ab')
+        self.assertEqual(response.getheader('connection'), 'close')
+        conn.close()
+
+    def test_connection_close(self):
+        self.start()
+        conn = self.connection()
+        conn.request('GET', '/a', headers={'Connection': 'close'})
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual(response.getheader('connection'), 'close')
+        conn.close()
+
+    def test_http10(self):
+        self.start()
+        sock = socket.create_connection(('127.0.0.1', self.port), 5)
+        sock.sendall('GET /a HTTP/1.0\r\n\r\n')
+        data = ''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+        self.assertTrue(data.startswith('HTTP/1.0 200'))
+        self.assertTrue(data.endswith('/a'))
+
+    def test_idle_timeout(self):
+        self.start(keepalive_timeout=1)
+        conn = self.connection()
+        self.request(conn, '/a')
+        sock = conn.sock
+        sock.settimeout(5)
+        start = time.time()
+        self.assertEqual(sock.recv(1), '')
+        self.assertLess(time.time() - start, 3)
+        conn.close()
+
+    def test_threads(self):
+        self.start(threads=4)
+        results = list()
+
+        def client():
+            conn = self.connection()
+            results.append(self.request(conn, '/slow')[0].status)
+            conn.close()
+
+        clients = [threading.Thread(target=client) for _ in range(4)]
+        start = time.time()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        self.assertEqual(results, [200] * 4)
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_idle_connections(self):
+        # idle keep-alive connections make way for new connections
+        self.start(threads=2, keepalive_timeout=5)
+        idle = [self.connection() for _ in range(2)]
+        for conn in idle:
+            self.request(conn, '/a')
+        start = time.time()
+        conn = self.connection()
+        self.assertEqual(self.request(conn, '/b')[0].status, 200)
+        self.assertLess(time.time() - start, 1)
+        for conn in idle + [conn]:
+            conn.close()
+
+    def test_buffered(self):
+        #pylint: disable=W0212
+        buffered = ztpserver.server._buffered
+
+        class FileObject(object):
+            def __init__(self, rbuf):
+                self._rbuf = rbuf
+
+        stringio = StringIO.StringIO()
+        stringio.write('GET /a')
+        self.assertEqual(buffered(FileObject(stringio)), 6)
+        self.assertEqual(buffered(FileObject(StringIO.StringIO())), 0)
+        self.assertEqual(buffered(FileObject('GET /a')), 6)
+        self.assertEqual(buffered(FileObject('')), 0)
+        self.assertIsNone(buffered(object()))
+
+        # the next request is served even if it is already buffered
+        self.start(threads=2, keepalive_timeout=5)
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        sock.sendall('GET /a HTTP/1.1\r\nHost: x\r\n\r\n' * 2)
+        sock.settimeout(5)
+        data = ''
+        while data.count('HTTP/1.1 200') < 2:
+            chunk = sock.recv(4096)
+            self.assertTrue(chunk)
+            data += chunk
+        sock.close()
+
+    def test_single_thread(self):
+        # one thread: no keep-alive (HTTP/1.0)
+        self.start(threads=1)
+        conn = self.connection()
+        (response, _) = self.request(conn, '/a')
+        self.assertEqual(response.version, 10)
+        conn.close()
+
+
+class FileWrapperUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = tempfile.mktemp()
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write(''.join(chr(x % 256) for x in range(1000)))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_iter(self):
+        wrapper = FileWrapper(open(self.filename), 64)
+        self.assertEqual(''.join(wrapper), open(self.filename).read())
+
+    def test_range(self):
+        wrapper = FileWrapper(open(self.filename), 64)
+        self.assertEqual(''.join(wrapper.app_iter_range(100, 300)),
+                         open(self.filename).read()[100:300])
+        self.assertEqual(''.join(wrapper.app_iter_range(990, 2000)),
+                         open(self.filename).read()[990:])
+
+
+class SendfileUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = tempfile.mktemp()
+        self.data = os.urandom(1 << 20)
+        with open(self.filename, 'w') as fhandler:
+            fhandler.write(self.data)
+
+        self.server = make_server('127.0.0.1', 0, FileApp(self.filename),
+                                  threads=2)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs=dict(poll_interval=0.05))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        os.remove(self.filename)
+
+    def request(self, method='GET', headers=None):
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        conn.request(method, '/', headers=headers or dict())
+        response = conn.getresponse()
+        return (conn, response, response.read())
+
+    def test_available(self):
+        self.assertIsNotNone(ztpserver.server.sendfile)
+
+    def check(self):
+        (conn, response, body) = self.request()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response.getheader('accept-ranges'), 'bytes')
+
+        # the connection is kept alive
+        sock = conn.sock
+        conn.request('GET', '/', headers=dict(Range='bytes=1000-1999'))
+        response = conn.getresponse()
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader('content-range'),
+                         'bytes 1000-1999/%d' % len(self.data))
+        self.assertEqual(response.read(), self.data[1000:2000])
+        self.assertIs(conn.sock, sock)
+
+        (_, response, body) = self.request(headers=dict(Range='bytes=-100'))
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, self.data[-100:])
+
+        (_, response, body) = self.request('HEAD')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('content-length'),
+                         str(len(self.data)))
+        self.assertEqual(body, '')
+
+        (_, response, body) = self.request(
+            headers=dict(Range='bytes=%d-' % (len(self.data) + 1)))
+        self.assertEqual(response.status, 416)
+
+    def test_sendfile(self):
+        calls = list()
+        func = ztpserver.server.sendfile
+
+        def wrapper(*args):
+            calls.append(args)
+            return func(*args)
+
+        with patch.object(ztpserver.server, 'sendfile', wrapper):
+            self.check()
+        # GET and both ranges
+        self.assertGreaterEqual(len(calls), 3)
+        self.assertEqual(set(x[2] for x in calls).issuperset(
+            [1000, len(self.data) - 100]), True)
+
+    def test_no_sendfile(self):
+        with patch.object(ztpserver.server, 'sendfile', None):
+            self.check()
+
+
+class PreforkServerUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_workers(self):
+        port = free_port()
+        path = self.path
+
+        class Service(object):
+            def stop(self):
+                open(os.path.join(path, 'stopped.%d' % os.getpid()),
+                     'w').close()
+
+        def init():
+            open(os.path.join(path, 'started.%d' % os.getpid()),
+                 'w').close()
+            return [Service()]
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server = PreforkServer('127.0.0.1', port, app, 2,
+                                       threads=2, init=init)
+                server.run()
+            finally:
+                os._exit(0)             #pylint: disable=W0212
+
+        try:
+            deadline = time.time() + 10
+            while len([x for x in os.listdir(self.path)
+                       if x.startswith('started')]) < 2:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+
+            pids = set()
+            for _ in range(20):
+                conn = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+                conn.request('GET', '/a')
+                response = conn.getresponse()
+                self.assertEqual(response.status, 200)
+                pids.add(response.read().split()[0])
+                conn.close()
+            workers = set(x.split('.')[1] for x in os.listdir(self.path))
+            self.assertTrue(pids.issubset(workers))
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+        self.assertEqual(
+            sorted(x.split('.')[1] for x in os.listdir(self.path)
+                   if x.startswith('stopped')),
+            sorted(x.split('.')[1] for x in os.listdir(self.path)
+                   if x.startswith('started')))
+
+    def test_reload(self):
+        port = free_port()
+        path = self.path
+
+        def init():
+            open(os.path.join(path, 'started.%d' % os.getpid()),
+                 'w').close()
+            return list()
+
+        def reload_():
+            open(os.path.join(path, 'reloaded.%d' % os.getpid()),
+                 'w').close()
+
+        def count(prefix):
+            return len([x for x in os.listdir(path)
+                        if x.startswith(prefix)])
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server = PreforkServer('127.0.0.1', port, app, 2,
+                                       init=init, on_reload=reload_)
+                server.run()
+            finally:
+                os._exit(0)             #pylint: disable=W0212
+
+        try:
+            deadline = time.time() + 10
+            while count('started') < 2:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+
+            # the parent and both workers reload
+            os.kill(pid, signal.SIGHUP)
+            while count('reloaded') < 3:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.05)
+            self.assertIn('reloaded.%d' % pid, os.listdir(path))
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
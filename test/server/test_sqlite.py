@@ -0,0 +1,163 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+# pylint: disable=C0103,W0212
+#
+
+import imp
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'plugins', 'sqlite')
+
+def load_plugin(db_url):
+    # every instance has its own connection, like separate processes
+    plugin = imp.load_source('sqlite_plugin', PLUGIN)
+    plugin.DB_URL = db_url
+    return plugin
+
+class SqlitePluginUnitTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db_url = os.path.join(self.path, 'resources.db')
+        self.plugin = load_plugin(self.db_url)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def create_table(self, table, size, used=None):
+        used = used or dict()
+        con = sqlite3.connect(self.db_url)
+        with con:
+            con.execute('CREATE TABLE "%s"(key TEXT, node_id TEXT)' %
+                        table.replace('"', '""'))
+            con.executemany('INSERT INTO "%s" VALUES(?, ?)' %
+                            table.replace('"', '""'),
+                            [('key%d' % x, used.get(x))
+                             for x in range(size)])
+        con.close()
+
+    def owners(self, table):
+        con = sqlite3.connect(self.db_url)
+        try:
+            return dict(con.execute('SELECT key, node_id FROM "%s"' %
+                                    table.replace('"', '""')).fetchall())
+        finally:
+            con.close()
+
+    def test_allocate_idempotent(self):
+        self.create_table('mgmt-pod1', 3, {0: 'node0'})
+
+        self.assertEqual(self.plugin.main('node0', 'mgmt-pod1'), 'key0')
+        self.assertEqual(self.plugin.main('node1', 'mgmt-pod1'), 'key1')
+        self.assertEqual(self.plugin.main('node1', 'mgmt-pod1'), 'key1')
+        self.assertEqual(load_plugin(self.db_url).main('node1', 'mgmt-pod1'),
+                         'key1')
+        self.assertEqual(self.owners('mgmt-pod1'),
+                         dict(key0='node0', key1='node1', key2=None))
+
+    def test_quoted_table(self):
+        self.create_table('a "b" c', 1)
+        self.assertEqual(self.plugin.main('node1', 'a "b" c'), 'key0')
+        self.assertEqual(self.plugin.main_stats(),
+                         {'a "b" c': dict(used=1, free=0, total=1)})
+        self.assertEqual(self.plugin.main_release('node1', 'a "b" c'),
+                         ['key0'])
+
+    def test_batch_rollback(self):
+        self.create_table('free', 2)
+        self.create_table('full', 1, {0: 'node0'})
+
+        self.assertRaises(Exception, self.plugin.main_batch, 'node1',
+                          ['free', 'full'])
+        self.assertEqual(self.owners('free'), dict(key0=None, key1=None))
+        self.assertEqual(self.owners('full'), dict(key0='node0'))
+
+        self.assertEqual(self.plugin.main_batch('node0', ['free', 'full']),
+                         dict(free='key0', full='key0'))
+
+    def test_preallocate_rollback(self):
+        self.create_table('mgmt', 2)
+        self.assertRaises(Exception, self.plugin.main_preallocate,
+                          ['node1', 'node2', 'node3'], 'mgmt')
+        self.assertEqual(self.owners('mgmt'), dict(key0=None, key1=None))
+
+    def test_create_indexes(self):
+        self.create_table('mgmt-pod1', 1)
+        self.plugin.main('node1', 'mgmt-pod1')
+
+        con = sqlite3.connect(self.db_url)
+        try:
+            indexes = con.execute('SELECT name, tbl_name FROM sqlite_master '
+                                  'WHERE type = \'index\'').fetchall()
+        finally:
+            con.close()
+        self.assertEqual(sorted(indexes),
+                         [('mgmt-pod1_key_idx', 'mgmt-pod1'),
+                          ('mgmt-pod1_node_id_idx', 'mgmt-pod1')])
+
+    def test_allocate_concurrent(self):
+        self.create_table('mgmt', 100)
+        plugins = [self.plugin, load_plugin(self.db_url)]
+
+        results = dict()
+        lock = threading.Lock()
+        def run(plugin, nodes):
+            for node in nodes:
+                key = plugin.main(node, 'mgmt')
+                with lock:
+                    results[node] = key
+
+        nodes = ['node%d' % x for x in range(80)]
+        threads = [threading.Thread(target=run,
+                                    args=(plugins[x % 2], nodes[x::10]))
+                   for x in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 80)
+        self.assertEqual(len(set(results.values())), 80)
+        owners = self.owners('mgmt')
+        self.assertEqual(dict((x, owners[y]) for (x, y) in results.items()),
+                         dict((x, x) for x in nodes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,7 +41,7 @@ import ztpserver.topology
 from ztpserver.topology import Neighbordb, Pattern
 from ztpserver.topology import create_node, load_file, load_neighbordb
 from ztpserver.topology import neighbordb_path, replace_config_action
-from ztpserver.topology import load_pattern
+from ztpserver.topology import load_pattern, find_resources, load_resources
 from server_test_lib import enable_logging, random_string
 
 class NeighbordbUnitTests(unittest.TestCase):
@@ -123,6 +123,49 @@ class NeighbordbUnitTests(unittest.TestCase):
         self.assertEqual('replace_config', result['action'])
         self.assertTrue(result['always_execute'])
 
+    def test_find_resources(self):
+        attributes = {'foo': "allocate('pool1')",
+                      'bar': {'baz': "allocate('pool2')",
+                              'qux': ["test('pool3')", 'plain', 10]},
+                      'dup': "allocate('pool1')",
+                      'none': 'plain'}
+        self.assertEqual(find_resources(attributes),
+                         set([('allocate', 'pool1'),
+                              ('allocate', 'pool2'),
+                              ('test', 'pool3')]))
+
+    @patch('ztpserver.topology.run_plugin')
+    def test_load_resources_precomputed(self, m_run_plugin):
+        attributes = {'foo': "allocate('pool1')",
+                      'bar': {'baz': ["allocate('pool1')", 'plain']}}
+        resources = {('allocate', 'pool1'): '1.1.1.1'}
+        result = load_resources(attributes, None, random_string(),
+                                resources)
+        self.assertEqual(result, {'foo': '1.1.1.1',
+                                  'bar': {'baz': ['1.1.1.1', 'plain']}})
+        self.assertFalse(m_run_plugin.called)
+
+    @patch('ztpserver.topology.run_plugin')
+    def test_load_resources_runs_plugin_once(self, m_run_plugin):
+        m_run_plugin.return_value = '1.1.1.1'
+        attributes = {'foo': "allocate('pool1')",
+                      'bar': "allocate('pool1')"}
+        result = load_resources(attributes, None, random_string())
+        self.assertEqual(result, {'foo': '1.1.1.1', 'bar': '1.1.1.1'})
+        self.assertEqual(m_run_plugin.call_count, 1)
+
+    @patch('ztpserver.topology.run_plugin')
+    def test_load_resources_list_of_dicts(self, m_run_plugin):
+        m_run_plugin.return_value = '1.1.1.1'
+        attributes = {'x': [{'ip': "allocate('p')"}, ["allocate('p')"]]}
+        references = find_resources(attributes)
+        self.assertEqual(references, set([('allocate', 'p')]))
+
+        # every reference found (and allocated) is substituted
+        result = load_resources(attributes, None, random_string())
+        self.assertEqual(result, {'x': [{'ip': '1.1.1.1'}, ['1.1.1.1']]})
+        self.assertEqual(m_run_plugin.call_count, 1)
+
     def test_create_node_fixup_systemmac_colon(self):
         attrs = Mock(systemmac='99:99:99:99:99:99')
         result = create_node({'systemmac': 
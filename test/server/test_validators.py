@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import unittest
+
+from ztpserver.validators import NeighbordbValidator, PatternValidator
+from ztpserver.validators import InterfacePatternValidator, Validator
+from ztpserver.validators import ValidationError
+
+
+class ValidatorUnitTests(unittest.TestCase):
+
+    def test_validators(self):
+        for cls in [NeighbordbValidator, PatternValidator,
+                    InterfacePatternValidator]:
+            names = cls.validators()
+            self.assertTrue(names)
+            self.assertEqual(list(names), sorted(x for x in dir(cls)
+                                                 if x.startswith('validate_')))
+            # computed once per class
+            self.assertIs(cls.validators(), names)
+        self.assertEqual(NeighbordbValidator.validators(),
+                         ('validate_patterns', 'validate_variables'))
+
+    def test_validate(self):
+        calls = list()
+
+        class TestValidator(Validator):
+            def validate_b(self):
+                calls.append('b')
+                raise ValidationError('b')
+
+            def validate_a(self):
+                calls.append('a')
+
+            def other(self):
+                calls.append('other')
+
+        validator = TestValidator('test')
+        self.assertFalse(validator.validate(dict(name='test')))
+        self.assertEqual(calls, ['a', 'b'])
+
+        del calls[:]
+        self.assertFalse(TestValidator('test').validate())
+        self.assertEqual(calls, ['a', 'b'])
+
+    def test_neighbordb(self):
+        validator = NeighbordbValidator('test')
+        self.assertTrue(validator.validate(dict(patterns=[
+            dict(name='test', definition='test',
+                 interfaces=[dict(any=dict(device='any', port='any'))])])))
+        self.assertEqual(validator.valid_patterns, set([(0, 'test')]))
+
+        validator = NeighbordbValidator('test')
+        self.assertFalse(validator.validate(dict(patterns=[
+            dict(definition='test')])))
+        self.assertEqual(validator.invalid_patterns, set([(0, 'N/A')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
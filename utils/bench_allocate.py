@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Benchmark for file-based resource pools (allocate plugin).
+#
+# Allocates resources for NODES nodes from a single pool using THREADS
+# threads, directly via ResourcePool.allocate() and via the in-memory
+# AllocationService, and reports the time per allocation and per lookup.
+#
+# usage: bench_allocate.py [--threads 50] [--nodes 5000]
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import ztpserver.pools                      #pylint: disable=C0413
+
+from ztpserver.pools import ResourcePool, AllocationService
+
+
+def create_pool(path, size):
+    filename = os.path.join(path, 'pool')
+    with open(filename, 'w') as fhandler:
+        for index in range(size):
+            fhandler.write('10.%d.%d.%d/8: null\n' %
+                           (index >> 16, (index >> 8) & 255, index & 255))
+    return filename
+
+
+def run(func, nodes, threads):
+    chunks = [nodes[x::threads] for x in range(threads)]
+    results = list()
+
+    def worker(chunk):
+        results.extend(func(x) for x in chunk)
+
+    pool = [threading.Thread(target=worker, args=(x,)) for x in chunks]
+    start = time.time()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.time() - start
+
+    if len(set(results)) != len(nodes):
+        print 'ERROR: %d resources allocated for %d nodes' % \
+            (len(set(results)), len(nodes))
+    return elapsed
+
+
+def report(name, operation, elapsed, count):
+    print '%-10s %-9s %6d ops in %6.2fs (%8.1f us/op)' % \
+        (name, operation, count, elapsed, elapsed * 1e6 / count)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--nodes', type=int, default=5000)
+    args = parser.parse_args()
+
+    nodes = ['node%06d' % x for x in range(args.nodes)]
+
+    path = tempfile.mkdtemp()
+    try:
+        filename = create_pool(path, args.nodes * 2)
+        pool = ResourcePool(filename)
+        report('direct', 'allocate',
+               run(pool.allocate, nodes, args.threads), len(nodes))
+        report('direct', 'lookup',
+               run(pool.allocate, nodes, args.threads), len(nodes))
+        shutil.rmtree(path)
+
+        os.mkdir(path)
+        ztpserver.pools._pools.clear()
+        filename = create_pool(path, args.nodes * 2)
+        service = AllocationService(path)
+        service.start()
+        allocate = lambda x: service.allocate(filename, x)
+        report('service', 'allocate',
+               run(allocate, nodes, args.threads), len(nodes))
+        report('service', 'lookup',
+               run(allocate, nodes, args.threads), len(nodes))
+        service.stop()
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
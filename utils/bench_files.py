@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Throughput benchmark for GET /files/<name> on the standalone server.
+#
+# Creates a (sparse) SIZE GB file under a temporary data_root, serves it
+# via the ztpserver application and downloads it CLIENTS times in
+# parallel, with the file sent via sendfile() and read/written in
+# blocks.  Reports the throughput and the CPU time used by the server.
+#
+# usage: bench_files.py [--size 2] [--clients 4] [--threads 8]
+
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import ztpserver.server                     #pylint: disable=C0413
+
+from ztpserver import controller            #pylint: disable=C0413
+from ztpserver.config import runtime        #pylint: disable=C0413
+from ztpserver.server import make_server    #pylint: disable=C0413
+
+BUFFER = 1 << 20
+
+
+def serve(port, threads, use_sendfile, pipe):
+    if not use_sendfile:
+        ztpserver.server.sendfile = None
+    server = make_server('127.0.0.1', port, controller.Router(),
+                         threads=threads)
+    server.RequestHandlerClass.log_message = lambda *args: None
+
+    def stop(*args):                        #pylint: disable=W0613
+        times = os.times()
+        os.write(pipe, '%f' % (times[0] + times[1]))
+        os._exit(0)                         #pylint: disable=W0212
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+
+
+def download(port, name, results):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall('GET /files/%s HTTP/1.1\r\nHost: ztps\r\n\r\n' % name)
+    data = ''
+    while '\r\n\r\n' not in data:
+        data += sock.recv(4096)
+    (headers, body) = data.split('\r\n\r\n', 1)
+    length = [int(x.split(':')[1]) for x in headers.split('\r\n')
+              if x.lower().startswith('content-length')][0]
+
+    received = len(body)
+    buf = bytearray(BUFFER)
+    while received < length:
+        count = sock.recv_into(buf)
+        if not count:
+            break
+        received += count
+    sock.close()
+    results.append(received == length)
+
+
+def run(port, name, size, clients, threads, use_sendfile):
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        serve(port, threads, use_sendfile, wfd)
+    os.close(wfd)
+    time.sleep(0.5)
+
+    results = list()
+    pool = [threading.Thread(target=download, args=(port, name, results))
+            for _ in range(clients)]
+    start = time.time()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.time() - start
+
+    os.kill(pid, signal.SIGTERM)
+    cpu = float(os.read(rfd, 64))
+    os.waitpid(pid, 0)
+    os.close(rfd)
+
+    total = size * clients
+    print '%-10s %3d x %5.1fGB in %6.2fs %9.1f MB/s   server CPU %6.2fs ' \
+        '%s' % ('sendfile' if use_sendfile else 'read/write', clients,
+                size / float(1 << 30), elapsed, total / elapsed / (1 << 20),
+                cpu, '' if all(results) else 'ERRORS')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=float, default=2)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=18081)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        runtime.set_value('data_root', path, 'default')
+        os.mkdir(os.path.join(path, 'files'))
+        size = int(args.size * (1 << 30))
+        with open(os.path.join(path, 'files', 'image.swi'), 'w') as fhandler:
+            fhandler.truncate(size)
+
+        for use_sendfile in (False, True):
+            run(args.port, 'image.swi', size, args.clients, args.threads,
+                use_sendfile)
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Benchmark for ztpserver.serializers.
+#
+# Compares the cost of loading a (generated) neighbordb, definition,
+# resource pool and .node file via the original implementation
+# (pure-Python yaml.safe_load / json.loads followed by a recursive
+# unicode -> str conversion pass) with serializers.loads().
+#
+# usage: bench_serializers.py [--patterns 500] [--actions 50]
+#                             [--resources 10000] [--neighbors 64]
+#                             [--repeat 5]
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from ztpserver import serializers           #pylint: disable=C0413
+from ztpserver.constants import CONTENT_TYPE_YAML     #pylint: disable=C0413
+from ztpserver.constants import CONTENT_TYPE_JSON     #pylint: disable=C0413
+
+
+def neighbordb(patterns):
+    data = dict(patterns=list())
+    for index in range(patterns):
+        data['patterns'].append(dict(
+            name='pattern %d' % index,
+            definition='leaf',
+            variables=dict(spine='regex(\'spine\\d+\')'),
+            interfaces=[{'Ethernet%d' % x: dict(device='$spine',
+                                                port='Ethernet%d' % index)}
+                        for x in range(1, 5)]))
+    return yaml.safe_dump(data, default_flow_style=False)
+
+
+def definition(actions):
+    data = dict(name='leaf', attributes=dict(ntp='10.0.0.1'), actions=list())
+    for index in range(actions):
+        data['actions'].append(dict(
+            name='action %d' % index,
+            action='add_config',
+            always_execute=True,
+            attributes=dict(url='files/templates/%d.template' % index,
+                            variables=dict(ipaddress='allocate(\'mgmt\')',
+                                           ntp='$ntp'))))
+    return yaml.safe_dump(data, default_flow_style=False)
+
+
+def pool(resources):
+    return ''.join('10.%d.%d.%d/8: %s\n' %
+                   (x >> 16, (x >> 8) & 255, x & 255,
+                    'node%d' % x if x % 2 else 'null')
+                   for x in range(resources))
+
+
+def node(neighbors):
+    return json.dumps(dict(
+        serialnumber='JPE12345678', systemmac='001c73aabbcc',
+        model='DCS-7050T-64', version='4.14.5F',
+        neighbors=dict(('Ethernet%d' % x, [dict(device='spine%d' % x,
+                                                port='Ethernet%d' % x)])
+                       for x in range(neighbors))))
+
+
+def convert_from_unicode(data):
+    if isinstance(data, basestring):
+        return str(data)
+    elif isinstance(data, collections.Mapping):
+        return dict([convert_from_unicode(x) for x in data.items()])
+    elif isinstance(data, collections.Iterable):
+        return type(data)([convert_from_unicode(x) for x in data])
+    else:
+        return data
+
+
+def original(data, content_type):
+    if content_type == CONTENT_TYPE_JSON:
+        return convert_from_unicode(json.loads(data))
+    return convert_from_unicode(yaml.load(data, Loader=yaml.SafeLoader))
+
+
+def current(data, content_type):
+    return serializers.loads(data, content_type, 'bench')
+
+
+def measure(func, data, content_type, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(data, content_type)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patterns', type=int, default=500)
+    parser.add_argument('--actions', type=int, default=50)
+    parser.add_argument('--resources', type=int, default=10000)
+    parser.add_argument('--neighbors', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print 'YAML backend: %s' % serializers.YAML_BACKEND
+    print '%-12s %10s %12s %12s %8s' % ('document', 'size', 'original',
+                                        'current', 'speedup')
+    for (name, data, content_type) in [
+            ('neighbordb', neighbordb(args.patterns), CONTENT_TYPE_YAML),
+            ('definition', definition(args.actions), CONTENT_TYPE_YAML),
+            ('pool', pool(args.resources), CONTENT_TYPE_YAML),
+            ('.node', node(args.neighbors), CONTENT_TYPE_JSON)]:
+        assert original(data, content_type) == current(data, content_type)
+        before = measure(original, data, content_type, args.repeat)
+        after = measure(current, data, content_type, args.repeat)
+        print '%-12s %9dK %10.3fms %10.3fms %7.1fx' % \
+            (name, len(data) / 1024, before * 1000, after * 1000,
+             before / after)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Concurrency benchmark for the sqlite resource plugin.
+#
+# Allocates resources for NODES nodes from a single table using THREADS
+# threads (and, optionally, several processes) and verifies that no
+# resource was allocated twice.
+#
+# usage: bench_sqlite.py [--threads 50] [--nodes 2000] [--processes 1]
+
+import argparse
+import imp
+import multiprocessing
+import os
+import sqlite3 as lite
+import sys
+import tempfile
+import threading
+import time
+
+PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', 'plugins', 'sqlite')
+TABLE = 'mgmt_subnet'
+
+
+def create_db(filename, size):
+    con = lite.connect(filename)
+    with con:
+        con.execute('CREATE TABLE `%s`(key TEXT, node_id TEXT)' % TABLE)
+        con.executemany('INSERT INTO `%s` VALUES(?, NULL)' % TABLE,
+                        [('10.%d.%d.%d/16' % (x >> 16, (x >> 8) & 255,
+                                              x & 255),)
+                         for x in range(size)])
+    con.close()
+
+
+def load_plugin(filename):
+    plugin = imp.load_source('sqlite', PLUGIN)
+    plugin.DB_URL = filename
+    return plugin
+
+
+def worker(filename, nodes, threads, results):
+    plugin = load_plugin(filename)
+    lock = threading.Lock()
+
+    def run(chunk):
+        for node in chunk:
+            # every node asks twice - the second request must return
+            # the same resource
+            first = plugin.main(node, TABLE)
+            second = plugin.main(node, TABLE)
+            with lock:
+                results.append((node, first, second))
+
+    chunks = [nodes[x::threads] for x in range(threads)]
+    pool = [threading.Thread(target=run, args=(x,)) for x in chunks]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+
+def process_worker(filename, nodes, threads, queue):
+    results = list()
+    worker(filename, nodes, threads, results)
+    queue.put(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--nodes', type=int, default=2000)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    filename = tempfile.mktemp(suffix='.db')
+    create_db(filename, args.nodes * 2)
+
+    nodes = ['node%06d' % x for x in range(args.nodes)]
+    results = list()
+
+    start = time.time()
+    if args.processes == 1:
+        worker(filename, nodes, args.threads, results)
+    else:
+        queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=process_worker,
+                                         args=(filename,
+                                               nodes[x::args.processes],
+                                               args.threads, queue))
+                 for x in range(args.processes)]
+        for proc in procs:
+            proc.start()
+        for _ in procs:
+            results.extend(queue.get())
+        for proc in procs:
+            proc.join()
+    elapsed = time.time() - start
+
+    errors = 0
+    allocated = dict()
+    for (node, first, second) in results:
+        if first != second:
+            print 'ERROR: %s was allocated %s and %s' % (node, first, second)
+            errors += 1
+        if first in allocated:
+            print 'ERROR: %s allocated to both %s and %s' % \
+                (first, allocated[first], node)
+            errors += 1
+        allocated[first] = node
+
+    con = lite.connect(filename)
+    rows = con.execute('SELECT COUNT(*) FROM `%s` WHERE node_id IS NOT NULL'
+                       % TABLE).fetchone()[0]
+    con.close()
+    if rows != len(nodes):
+        print 'ERROR: %d rows allocated for %d nodes' % (rows, len(nodes))
+        errors += 1
+
+    print '%d allocations (%d processes x %d threads) in %.2fs ' \
+        '(%.0f/s), %d errors' % \
+        (len(results) * 2, args.processes, args.threads, elapsed,
+         len(results) * 2 / elapsed, errors)
+
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(filename + suffix):
+            os.remove(filename + suffix)
+
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Benchmark for the subnet resource pools (ztpserver.pools.SubnetPool).
+#
+# Measures the average time to allocate an address from networks of
+# different sizes, with some addresses already allocated - it should not
+# depend on the size of the network, nor on the number of allocations.
+#
+# usage: bench_subnet.py [--allocations 1000] [--preallocated 10000]
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from ztpserver.pools import SubnetPool      #pylint: disable=F0401
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--allocations', type=int, default=1000)
+    parser.add_argument('--preallocated', type=int, default=10000)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        for network in ['10.0.0.0/16', '10.0.0.0/12', '10.0.0.0/8']:
+            filename = os.path.join(path, network.replace('/', '_'))
+            with open(filename, 'w') as fhandler:
+                fhandler.write('network: %s\n' % network)
+
+            SubnetPool(filename).allocate_many(['pre%s' % x for x in
+                                                range(args.preallocated)])
+
+            pool = SubnetPool(filename)
+            start = time.time()
+            pool.lookup('node')
+            loaded = time.time() - start
+
+            start = time.time()
+            for index in range(args.allocations):
+                pool.allocate('node%s' % index)
+            elapsed = time.time() - start
+
+            print '%-12s load: %8.2fms   allocate: %8.3fms/op' % \
+                (network, loaded * 1000, elapsed * 1000 / args.allocations)
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Benchmark for ztpserver.validators.
+#
+# Validates a (generated) neighbordb with the original Validator.validate
+# (which looked up the validate_* methods via inspect.getmembers() on
+# every call - i.e. for every pattern and interface) and with the
+# current one (method names computed once per class).
+#
+# usage: bench_validators.py [--patterns 10000] [--interfaces 4]
+#                            [--repeat 3]
+
+import argparse
+import inspect
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from ztpserver import validators            #pylint: disable=C0413
+from ztpserver.validators import NeighbordbValidator    #pylint: disable=C0413
+from ztpserver.validators import ValidationError        #pylint: disable=C0413
+
+
+def neighbordb(patterns, interfaces):
+    data = dict(patterns=list())
+    for index in range(patterns):
+        data['patterns'].append(dict(
+            name='pattern %d' % index,
+            definition='leaf',
+            variables=dict(spine='regex(\'spine\\d+\')'),
+            interfaces=[{'Ethernet%d' % x: dict(device='$spine',
+                                                port='Ethernet%d' % index)}
+                        for x in range(1, interfaces + 1)]))
+    return data
+
+
+def original(self, data=None):
+    validators.log.debug('%s: running %s.validate' %
+                         (self.node_id, self.__class__.__name__))
+    self.data = data or dict()
+
+    error = None
+    methods = inspect.getmembers(self, predicate=inspect.ismethod)
+    for name in methods:
+        if name[0].startswith('validate_'):
+            if 'name' not in self.data:
+                name_string = ''
+            else:
+                name_string = 'for \'%s\'' % self.data['name']
+            validators.log.debug('%s: running %s.%s %s' %
+                                 (self.node_id, self.__class__.__name__,
+                                  name[0], name_string))
+            try:
+                getattr(self, name[0])()
+            except ValidationError as err:
+                if not error:
+                    error = err
+    if error:
+        self.error(error)
+
+    return not self.fail
+
+
+def measure(data, repeat):
+    best = None
+    for _ in range(repeat):
+        validator = NeighbordbValidator('bench')
+        start = time.time()
+        validator.validate(data)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, len(validator.valid_patterns),
+            len(validator.invalid_patterns))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patterns', type=int, default=10000)
+    parser.add_argument('--interfaces', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger('ztpserver').addHandler(logging.NullHandler())
+    data = neighbordb(args.patterns, args.interfaces)
+
+    current = validators.Validator.validate
+    validators.Validator.validate = original
+    try:
+        (before, valid, invalid) = measure(data, args.repeat)
+    finally:
+        validators.Validator.validate = current
+    (after, valid_after, invalid_after) = measure(data, args.repeat)
+    assert (valid, invalid) == (valid_after, invalid_after)
+
+    print '%d patterns x %d interfaces (%d valid, %d invalid)' % \
+        (args.patterns, args.interfaces, valid, invalid)
+    print 'original: %8.3fs' % before
+    print 'current:  %8.3fs (%.1fx)' % (after, before / after)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.admission
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The admission module limits the number of requests which are
+        processed concurrently.  Requests beyond the limit wait in a
+        bounded queue (for at most queue_timeout seconds); requests which
+        do not fit in the queue, or time out, are rejected with
+        :py:class:`Overloaded`, which carries a Retry-After estimate based
+        on the recent service times.  The limits are per process.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import math
+import threading
+import time
+
+from ztpserver.config import runtime
+from ztpserver.metrics import registry as metrics
+
+# weight of the latest service time in the moving average
+SERVICE_TIME_WEIGHT = 0.2
+
+# bounds of the Retry-After estimates (seconds)
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class Overloaded(Exception):
+    ''' Raised when a request is not admitted '''
+
+    def __init__(self, message, retry_after):
+        super(Overloaded, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class _Admitted(object):
+    ''' Context manager for an admitted request '''
+
+    def __init__(self, control):
+        self.control = control
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.control.release(time.time() - self.start)
+
+
+class AdmissionControl(object):
+    ''' Admits at most limit concurrent requests (0 - unlimited), with up
+    to queue requests waiting for at most timeout seconds '''
+
+    def __init__(self, name, limit=0, queue=0, timeout=0):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+
+        self._cond = threading.Condition(threading.Lock())
+        self._active = 0
+        self._waiting = 0
+        self._service_time = None
+
+        labels = dict(control=name)
+        self._active_gauge = metrics.gauge('admission_active', labels)
+        self._queue_gauge = metrics.gauge('admission_queue_depth', labels)
+        self._wait_histogram = metrics.histogram('admission_wait_seconds',
+                                                 labels)
+        self._rejected = dict(
+            (x, metrics.counter('admission_rejected',
+                                dict(labels, reason=x)))
+            for x in ['queue_full', 'timeout'])
+
+    def __repr__(self):
+        return 'AdmissionControl(name=%s, limit=%s, queue=%s, timeout=%s)' % \
+            (self.name, self.limit, self.queue, self.timeout)
+
+    def configure(self, limit, queue, timeout):
+        with self._cond:
+            self.limit = limit
+            self.queue = queue
+            self.timeout = timeout
+            # a raised limit may admit the waiting requests
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(active=self._active, waiting=self._waiting,
+                        service_time=self._service_time)
+
+    def retry_after(self):
+        ''' Returns the estimated time (seconds) until the requests ahead
+        of a new one are served - the caller must hold the lock '''
+
+        if not self._service_time or not self.limit:
+            return MIN_RETRY_AFTER
+        backlog = float(self._active + self._waiting) / self.limit
+        return int(min(MAX_RETRY_AFTER,
+                       max(MIN_RETRY_AFTER,
+                           math.ceil(backlog * self._service_time))))
+
+    def _reject(self, reason):
+        self._rejected[reason].inc()
+        raise Overloaded('%s: request rejected (%s, active=%d, waiting=%d)'
+                         % (self.name, reason, self._active, self._waiting),
+                         self.retry_after())
+
+    def acquire(self):
+        ''' Waits until the request is admitted; raises
+        :py:class:`Overloaded` if it is rejected '''
+
+        with self._cond:
+            if not self.limit or \
+               (self._active < self.limit and not self._waiting):
+                self._active += 1
+                self._active_gauge.inc()
+                return
+
+            if self._waiting >= self.queue:
+                self._reject('queue_full')
+
+            start = time.time()
+            deadline = start + self.timeout
+            self._waiting += 1
+            self._queue_gauge.inc()
+            try:
+                while self.limit and self._active >= self.limit:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._reject('timeout')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+                self._queue_gauge.dec()
+                self._wait_histogram.observe(time.time() - start)
+
+            self._active += 1
+            self._active_gauge.inc()
+
+    def release(self, elapsed=None):
+        ''' Releases an admitted request, which took elapsed seconds '''
+
+        with self._cond:
+            self._active -= 1
+            self._active_gauge.dec()
+            if elapsed is not None:
+                if self._service_time is None:
+                    self._service_time = elapsed
+                else:
+                    self._service_time += SERVICE_TIME_WEIGHT * \
+                        (elapsed - self._service_time)
+            if self._waiting:
+                self._cond.notify()
+
+    def admit(self):
+        ''' Returns a context manager for an admitted request; raises
+        :py:class:`Overloaded` if it is rejected '''
+
+        self.acquire()
+        return _Admitted(self)
+
+NODES_ADMISSION = AdmissionControl('nodes')
+
+
+def nodes_admission():
+    ''' Returns the admission control of the /nodes requests, configured
+    from the [admission] section '''
+
+    group = runtime.admission
+    (limit, queue, timeout) = (group.max_requests, group.max_queue,
+                               group.queue_timeout)
+    if (limit, queue, timeout) != (NODES_ADMISSION.limit,
+                                   NODES_ADMISSION.queue,
+                                   NODES_ADMISSION.timeout):
+        NODES_ADMISSION.configure(limit, queue, timeout)
+    return NODES_ADMISSION
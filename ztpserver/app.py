@@ -34,22 +34,33 @@
 #
 
 import argparse
+import hashlib
+import itertools
+import json
 import logging
+import multiprocessing
 import os
 import re
+import signal
 import sys
 
-from wsgiref.simple_server import make_server
-
-
 from ztpserver import config, controller
 
-from ztpserver.serializers import load, dump
+from ztpserver.serializers import load
 from ztpserver.validators import NeighbordbValidator
 from ztpserver.constants import CONTENT_TYPE_YAML
-from ztpserver.topology import FUNC_RE, neighbordb_path
+from ztpserver.topology import FUNC_RE, neighbordb_path, find_resources
+from ztpserver.topology import load_neighbordb
 from ztpserver.utils import all_files
-from ztpserver.resources import resource_plugins
+from ztpserver.resources import resource_plugins, registry, preallocate
+from ztpserver.resources import resource_stats
+from ztpserver.pools import get_pool, is_pool_file, allocation_service
+from ztpserver.pools import flush_pools, pool_flusher
+from ztpserver.leases import lease_sweeper
+from ztpserver.server import make_server, PreforkServer
+from ztpserver.profiling import profile_files, profile_tags, load_profiles
+from ztpserver.logqueue import DuplicateFilter, NodeLevelFilter, QueueHandler
+from ztpserver.logqueue import node_levels
 
 log = logging.getLogger('ztpserver')
 log.setLevel(logging.DEBUG)
@@ -73,10 +84,20 @@ def enable_handler_console(level=None):
     level = level or 'DEBUG'
     level = str(level).upper()
     level = logging.getLevelName(level)
-    ch.setLevel(level)
     ch.setFormatter(formatter)
 
-    log.addHandler(ch)
+    group = config.runtime.logging
+    if group.duplicate_interval:
+        ch.addFilter(DuplicateFilter(group.duplicate_interval))
+
+    handler = ch
+    if group.queue_size:
+        # write the logs from a background thread
+        handler = QueueHandler([ch], group.queue_size)
+        handler.tag = ch.tag
+
+    handler.addFilter(NodeLevelFilter(level, node_levels(group.node_levels)))
+    log.addHandler(handler)
 
 def python_supported():
     ''' Returns True if the current version of the python runtime is valid '''
@@ -103,11 +124,19 @@ def load_config(conf=None):
         log.info('Loading config file: %s' % conf)
         config.runtime.read(conf)
 
-def start_wsgiapp(config_file=None, debug=False):
-    ''' Provides the entry point into the application for wsgi compliant
-    servers.   Accepts a single keyword argument ``conf``.   The ``conf``
-    keyword argument specifies the path the server configuration file.  The
-    default value is /etc/ztpserver/ztpserver.conf.
+def reload_config(*args):       #pylint: disable=W0613
+    ''' Re-reads the configuration file which was loaded at startup (on
+    SIGHUP).  Settings which are only used at startup (see the docs)
+    still require a restart. '''
+
+    try:
+        config.runtime.reload()
+    except IOError as exc:
+        log.error('Failed to reload config: %s' % exc)
+
+def load_app(config_file=None, debug=False):
+    ''' Loads the configuration and returns the wsgi application object,
+    without starting any of the (per process) background services.
 
     :param conf: string path pointing to configuration file
     :return: a wsgi application object
@@ -131,6 +160,65 @@ def start_wsgiapp(config_file=None, debug=False):
 
     return controller.Router()
 
+def start_services():
+    ''' Starts the background services (allocation service or pool
+    flusher, lease sweeper) which are enabled in the configuration.
+    Threads do not survive fork(), so this is called in each worker
+    process.  Returns the list of services started.
+    '''
+
+    services = list()
+
+    # load the resource pools before the first request
+    service = allocation_service() or pool_flusher()
+    if service:
+        log.info('Started %s' % service)
+        services.append(service)
+
+    sweeper = lease_sweeper()
+    if sweeper:
+        log.info('Started %s' % sweeper)
+        services.append(sweeper)
+
+    return services
+
+def warm_app():
+    ''' Loads neighbordb, the resource plugins and pools and (if the file
+    cache is enabled) the definitions, so that pre-forked workers start
+    with them in memory '''
+
+    load_neighbordb('N/A')
+    registry.load()
+
+    data_root = config.runtime.default.data_root
+    for filename in resource_files(data_root):
+        try:
+            get_pool(filename).stats()
+        except Exception as exc:            #pylint: disable=W0703
+            log.warning('Failed to load resource pool %s: %s' %
+                        (filename, exc))
+
+    if config.runtime.default.file_cache_size:
+        for filename in all_files(os.path.join(data_root, 'definitions')):
+            try:
+                load(filename, CONTENT_TYPE_YAML, 'N/A')
+            except Exception:               #pylint: disable=W0703
+                pass
+
+def start_wsgiapp(config_file=None, debug=False):
+    ''' Provides the entry point into the application for wsgi compliant
+    servers.   Accepts a single keyword argument ``conf``.   The ``conf``
+    keyword argument specifies the path the server configuration file.  The
+    default value is /etc/ztpserver/ztpserver.conf.
+
+    :param conf: string path pointing to configuration file
+    :return: a wsgi application object
+
+    '''
+    app = load_app(config_file, debug)
+    start_services()
+    return app
+
 def run_server(version, config_file, debug):
     ''' The :py:func:`run_server` is called by the main command line routine to
     run the server as standalone.   This function accepts a single argument
@@ -140,130 +228,256 @@ def run_server(version, config_file, debug):
 
     :param conf: string path pointing to configuration file
     '''
-    app = start_wsgiapp(config_file, debug)
+    app = load_app(config_file, debug)
 
     host = config.runtime.server.interface
     port = config.runtime.server.port
+    workers = config.runtime.server.workers
+    threads = config.runtime.server.threads
+    keepalive_timeout = config.runtime.server.keepalive_timeout
 
     log.info('URL: http://%s:%s' % (host, port))
 
-    httpd = make_server(host, port, app)
+    if workers > 1:
+        warm_app()
+        httpd = PreforkServer(host, port, app, workers, threads=threads,
+                              keepalive_timeout=keepalive_timeout,
+                              init=start_services,
+                              on_reload=reload_config)
+        log.info('Starting ZTPServer v%s on http://%s:%s '
+                 '(%d workers, %d threads each)' %
+                 (version, host, port, workers, threads))
+        httpd.run()
+        log.info('Shutdown...')
+        return
+
+    services = start_services()
+    signal.signal(signal.SIGHUP, reload_config)
+    signal.signal(signal.SIGTERM, terminate)
+    httpd = make_server(host, port, app, threads=threads,
+                        keepalive_timeout=keepalive_timeout)
 
-    log.info('Starting ZTPServer v%s on http://%s:%s' % 
-             (version, host, port))
+    log.info('Starting ZTPServer v%s on http://%s:%s (%d threads)' % 
+             (version, host, port, threads))
 
     try:
         httpd.serve_forever()
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, SystemExit):
         log.info('Shutdown...')
+    finally:
+        httpd.server_close()
+        # e.g. write the pending allocations to the resource files
+        for service in services:
+            service.stop()
+
+def terminate(*args):                   #pylint: disable=W0613
+    ''' SIGTERM handler: stops the server (and its services) cleanly '''
+    raise SystemExit()
+
+def resource_files(data_root):
+    ''' Returns the resource pool files (skipping journals and locks) '''
+    return [x for x in all_files(os.path.join(data_root, 'resources'))
+            if is_pool_file(x)]
+
+def file_digest(filename, context=''):
+    ''' Returns the SHA-1 of the contents of filename followed by context,
+    or None if the file cannot be read '''
+
+    digest = hashlib.sha1()
+    try:
+        with open(filename, 'rb') as fhandler:
+            for block in iter(lambda: fhandler.read(1 << 16), ''):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    digest.update(context)
+    return digest.hexdigest()
+
+def check_neighbordb(filename):
+    ''' Returns the errors found in neighbordb '''
 
-def validate_neighbordb():
-    # Validating neighbordb
     validator = NeighbordbValidator('N/A')
-    neighbordb = neighbordb_path()
-    print 'Validating neighbordb (\'%s\')...' % neighbordb
+    validator.validate(load(filename, CONTENT_TYPE_YAML, 'validator'))
+    total = len(validator.valid_patterns) + len(validator.invalid_patterns)
+    return ['Invalid pattern [%d] %s (%d/%d patterns invalid)' %
+            (index, name, len(validator.invalid_patterns), total)
+            for (index, name) in sorted(validator.invalid_patterns)]
+
+def check_definition(filename, data_root, plugins, pools):
+    ''' Returns the errors found in a definition: plugins which are missing
+    and allocate() pools which do not exist '''
+
+    resources = re.findall(FUNC_RE,
+                           str(load(filename, CONTENT_TYPE_YAML,
+                                    'validator')))
+    errors = ['Plugin \'%s\' configured in \'%s\' is missing from '
+              '\'%s\'!' % (plugin, filename,
+                           os.path.join(data_root, 'plugins'))
+              for plugin in sorted(set(x for (x, _) in resources
+                                       if x not in plugins))]
+    errors.extend('Resource file \'%s\' configured in \'%s\' is missing '
+                  'from \'%s\'!' % (pool, filename,
+                                    os.path.join(data_root, 'resources'))
+                  for pool in sorted(set(y for (x, y) in resources
+                                         if x == 'allocate' and
+                                         y not in pools)))
+    return errors
+
+def check_file(filename):
+    ''' Returns the errors found in a YAML file (resource pools, node
+    definitions and patterns) - only the syntax is checked '''
+
+    load(filename, CONTENT_TYPE_YAML, 'validator')
+    return []
+
+CHECKS = dict(neighbordb=check_neighbordb,
+              definition=check_definition,
+              resource=check_file,
+              node=check_file)
+
+def run_check(task):
+    ''' Runs a validation task - (kind, filename, args) - and returns the
+    list of errors (called in the validation worker processes) '''
+
+    (kind, filename, args) = task
     try:
-        validator.validate(load(neighbordb, CONTENT_TYPE_YAML,
-                                'validator'))
-        total_patterns = len(validator.valid_patterns) + \
-            len(validator.invalid_patterns)
-            
-        if validator.invalid_patterns:
-            print '\nERROR: Failed to validate neighbordb patterns'
-            print '   Invalid Patterns (count: %d/%d)' % \
-                (len(validator.invalid_patterns),
-                 total_patterns)
-            print '   ---------------------------'
-            for index, pattern in enumerate(
-                sorted(validator.invalid_patterns)):
-                print '   [%d] %s' % (index, pattern[1])
-        else:
-            print 'Ok!'            
+        return CHECKS[kind](filename, *args)
     except Exception as exc:        #pylint: disable=W0703
-        print 'ERROR: Failed to validate neighbordb\n%s' % exc
+        return ['Failed to validate %s\n%s' % (filename, exc)]
+
+def validation_tasks(data_root, kinds=None):
+    ''' Returns the validation tasks for the files in data_root, in the
+    order in which they are reported '''
+
+    kinds = kinds or ['neighbordb', 'definition', 'resource', 'node']
+    pools = tuple(sorted(set(os.path.basename(x)
+                             for x in resource_files(data_root))))
+    tasks = list()
+    if 'neighbordb' in kinds:
+        tasks.append(('neighbordb', neighbordb_path(), ()))
+    if 'definition' in kinds:
+        # listed once, rather than for each definition
+        plugins = tuple(sorted(resource_plugins()))
+        tasks.extend(('definition', x, (data_root, plugins, pools))
+                     for x in sorted(all_files(os.path.join(data_root,
+                                                            'definitions'))))
+    if 'resource' in kinds:
+        tasks.extend(('resource', x, ())
+                     for x in sorted(resource_files(data_root)))
+    if 'node' in kinds:
+        tasks.extend(('node', x, ())
+                     for x in sorted(all_files(os.path.join(data_root,
+                                                            'nodes')))
+                     if os.path.basename(x) in ['definition', 'pattern'])
+    return tasks
+
+def validate_files(tasks, jobs=1, manifest=None):
+    ''' Runs the validation tasks in jobs processes and yields (task,
+    digest, status, errors) in the order of tasks.  Files whose digest
+    (contents and task arguments) matches the manifest entry are not
+    validated again (status: skipped). '''
+
+    manifest = manifest or dict()
+    digests = [file_digest(x[1], repr(x[2])) for x in tasks]
+    skipped = [x is not None and manifest.get(y[1]) == x
+               for (x, y) in zip(digests, tasks)]
+    pending = [x for (x, y) in zip(tasks, skipped) if not y]
+
+    pool = None
+    if jobs > 1 and len(pending) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(pending)))
+        results = pool.imap(run_check, pending,
+                            max(len(pending) // (jobs * 4), 1))
+    else:
+        results = itertools.imap(run_check, pending)
 
-def validate_definitions():
-    data_root = config.runtime.default.data_root
-
-    print '\nValidating definitions...'
-
-    for definition in all_files(os.path.join(data_root, 
-                                             'definitions')):
-        print 'Validating %s...' % definition,
-        try:
-            def_data = load(definition, CONTENT_TYPE_YAML,
-                            'validator')
-
-            resources = re.findall(FUNC_RE, 
-                                   str(def_data))
-
-            # Validating plugins
-            plugins = resource_plugins()
-            missing_plugins = set([x for (x, _) in resources 
-                                   if x not in plugins])
-            if missing_plugins:
-                plugins_path = os.path.join(data_root, 
-                                            'plugins')
-                print ''
-                for plugin in missing_plugins:
-                    print 'ERROR: Plugin \'%s\' configured in \'%s\' ' \
-                        'is missing from \'%s\'!' % \
-                        (plugin, definition, plugins_path)
-
-            # Special validation for 'allocate' plugin
-            resources_path = os.path.join(data_root, 
-                                          'resources')
-            resource_files = [x.split('/')[-1] 
-                              for x in resources_path]
-            missing_resources = [x for (y, x) in resources 
-                                 if x not in resource_files and
-                                 y == 'allocate']
-            if missing_resources:
-                if not missing_plugins:
-                    print ''
-                for res in missing_resources:
-                    print 'ERROR: Resource file \'%s\' configured in \'%s\' ' \
-                        'is missing from \'%s\'!' % \
-                        (res, definition, resources_path)
+    try:
+        for (task, digest, skip) in zip(tasks, digests, skipped):
+            if skip:
+                yield (task, digest, 'skipped', [])
             else:
-                print 'Ok!'
-        except Exception as exc:        #pylint: disable=W0703            
-            print '\nERROR: Failed to validate %s\n%s' % \
-                (definition, exc)
+                errors = results.next()
+                yield (task, digest, 'error' if errors else 'ok', errors)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+SECTIONS = dict(neighbordb='neighbordb',
+                definition='definitions',
+                resource='resources',
+                node='nodes')
+
+def print_results(results):
+    ''' Prints the results of :py:func:`validate_files` and returns them
+    as a list of report entries '''
+
+    entries = list()
+    kind = None
+    for (task, digest, status, errors) in results:
+        if task[0] != kind:
+            kind = task[0]
+            print '\nValidating %s...' % SECTIONS[kind]
+        print 'Validating %s...' % task[1],
+        if errors:
+            print ''
+            for error in errors:
+                print 'ERROR: %s' % error
+        else:
+            print 'Ok! (unchanged)' if status == 'skipped' else 'Ok!'
+        entries.append(dict(type=task[0], filename=task[1], digest=digest,
+                            status=status, errors=errors))
+    return entries
+
+def validate_plugins():
+    ''' Loads the resource plugins and returns a list of report entries '''
+
+    print '\nValidating plugins...'
+
+    entries = list()
+    errors = registry.load()
+    for plugin in registry.plugins:
+        print 'Validating %s... Ok!' % plugin
+        entries.append(dict(type='plugin', filename=plugin, status='ok',
+                            errors=[]))
+    for plugin, err in sorted(errors.items()):
+        print 'Validating %s...' % plugin
+        print 'ERROR: Failed to validate %s\n%s' % (plugin, err)
+        entries.append(dict(type='plugin', filename=plugin, status='error',
+                            errors=[str(err)]))
+    return entries
 
 def validate_resources(raiseException=False):
     data_root = config.runtime.default.data_root
 
-    print '\nValidating resources...'
-    for resource in all_files(os.path.join(data_root, 
-                                           'resources')):
-        print 'Validating %s...' % resource,
-        try:
-            load(resource, CONTENT_TYPE_YAML,
-                 'validator')
-            print 'Ok!'
-        except Exception as exc:        #pylint: disable=W0703 
-            print '\nERROR: Failed to validate %s\n%s' % \
-                (resource, exc)
-            if raiseException:
-                raise exc
+    entries = print_results(validate_files(
+        validation_tasks(data_root, ['resource'])))
+    failed = [x['filename'] for x in entries if x['errors']]
+    if failed and raiseException:
+        raise ValueError('Failed to validate %s' % ', '.join(failed))
 
-def validate_nodes():
-    data_root = config.runtime.default.data_root
+def load_manifest(filename, version):
+    ''' Returns the {filename: digest} entries of the files which passed
+    the last validation - none if the manifest is missing or was written
+    by another version '''
 
-    print '\nValidating nodes...'
-    for filename in [x for x in all_files(os.path.join(data_root, 
-                                                       'nodes'))
-                     if x.split('/')[-1] in ['definition',
-                                             'pattern']]:
-        print 'Validating %s...' % filename,
-        try:
-            load(filename, CONTENT_TYPE_YAML,
-                 'validator')
-            print 'Ok!'
-        except Exception as exc:        #pylint: disable=W0703            
-            print '\nERROR: Failed to validate %s\n%s' % \
-                (filename, exc)
+    try:
+        with open(filename) as fhandler:
+            manifest = json.load(fhandler)
+        if manifest.get('version') == version:
+            return dict(manifest['files'])
+    except (IOError, ValueError, AttributeError, KeyError, TypeError):
+        pass
+    return dict()
+
+def write_json(filename, data):
+    ''' Writes data to filename (atomically) '''
+
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp, 'w') as fhandler:
+        json.dump(data, fhandler, indent=2, sort_keys=True)
+        fhandler.write('\n')
+    os.rename(tmp, filename)
 
 def clear_resources(debug):
     start_logging(debug)
@@ -276,28 +490,202 @@ def clear_resources(debug):
     data_root = config.runtime.default.data_root
 
     print '\nClearing resources...'
-    for resource in all_files(os.path.join(data_root, 
-                                           'resources')):
+    for resource in resource_files(data_root):
         print 'Clearing %s...' % resource,
         try:
-            contents = load(resource, CONTENT_TYPE_YAML,
-                            'clear_resource')
-            for key in contents:
-                contents[key] = 'None'
-            dump(contents, resource, CONTENT_TYPE_YAML,
-                 'clear_resource')
+            get_pool(resource).clear()
             print 'Ok!'            
         except Exception as exc:        #pylint: disable=W0703            
             print '\nERROR: Failed to clear %s\n%s' % \
                 (resource, exc)
     
-def run_validator(debug):
+def read_nodes(filename):
+    ''' Returns the node IDs listed in filename (one per line, in order;
+    blank lines and lines starting with '#' are ignored) '''
+
+    node_ids = list()
+    seen = set()
+    with open(filename) as fhandler:
+        for line in fhandler:
+            line = line.split('#', 1)[0].strip()
+            if line and line not in seen:
+                seen.add(line)
+                node_ids.append(line)
+    return node_ids
+
+def parse_reference(reference):
+    ''' Returns (plugin, pool) for plugin('pool') - a bare pool name
+    refers to an allocate() pool '''
+
+    match = FUNC_RE.match(reference)
+    if match:
+        return (match.group('function'), match.group('arg'))
+    return ('allocate', reference)
+
+def definition_references(filename):
+    ''' Returns the (plugin, pool) references in a definition (or
+    attributes) file '''
+
+    return find_resources(load(filename, CONTENT_TYPE_YAML, 'preallocate'))
+
+def node_references(data_root, node_id):
+    ''' Returns the (plugin, pool) references in the static definition
+    (and attributes) of a node '''
+
+    references = set()
+    for filename in ['definition', 'attributes']:
+        path = os.path.join(data_root, 'nodes', node_id, filename)
+        if os.path.isfile(path):
+            references.update(definition_references(path))
+    return references
+
+def preallocate_assignments(pools, node_ids, definition):
+    ''' Returns a dict mapping each (plugin, pool) reference to the list
+    of nodes to preallocate resources for '''
+
+    data_root = config.runtime.default.data_root
+
+    if pools or definition:
+        if not node_ids:
+            raise ValueError('--nodes is required in order to preallocate '
+                             'resources from pools or definitions')
+        if pools:
+            references = [parse_reference(x) for x in pools]
+        else:
+            path = definition
+            if not os.path.isfile(path):
+                path = os.path.join(data_root, 'definitions', definition)
+            references = definition_references(path)
+        return dict((x, list(node_ids)) for x in references)
+
+    # definitions-driven: use the static definition of each node
+    if node_ids is None:
+        path = os.path.join(data_root, 'nodes')
+        node_ids = sorted(x for x in os.listdir(path)
+                          if os.path.isdir(os.path.join(path, x)))
+
+    assignments = dict()
+    for node_id in node_ids:
+        for reference in node_references(data_root, node_id):
+            assignments.setdefault(reference, list()).append(node_id)
+    return assignments
+
+def preallocate_resources(pools, nodes, definition, debug):
+    ''' Allocates resources for a list of nodes ahead of time, so that
+    requests from the nodes only need to look the resources up '''
+
+    start_logging(debug)
+
+    try:
+        node_ids = read_nodes(nodes) if nodes else None
+        assignments = preallocate_assignments(pools, node_ids, definition)
+    except Exception as exc:            #pylint: disable=W0703
+        sys.exit('ERROR: Unable to preallocate resources: %s' % exc)
+
+    print '\nPreallocating resources...'
+    errors = 0
+    for (plugin, pool), node_ids in sorted(assignments.items()):
+        print 'Preallocating %s(\'%s\') for %d node(s)...' % \
+            (plugin, pool, len(node_ids)),
+        try:
+            values = preallocate({(plugin, pool): node_ids})[(plugin, pool)]
+            print 'Ok!'
+            for node_id in node_ids:
+                print '   %s: %s' % (node_id, values[node_id])
+        except Exception as exc:        #pylint: disable=W0703
+            errors += 1
+            print '\nERROR: Failed to preallocate %s(\'%s\')\n%s' % \
+                (plugin, pool, exc)
+
+    # write the allocations to the resource files
+    flush_pools()
+
+    if errors:
+        sys.exit(1)
+
+def show_resource_stats(debug):
+    start_logging(debug)
+
+    print '\nResource utilization...'
+    stats = dict((x, y) for (x, y) in resource_stats().items()
+                 if y.get('pools'))
+    if not stats:
+        print 'No resource pools found'
+
+    row = '   %-30s %10s %10s %10s %7s'
+    for plugin, entry in sorted(stats.items()):
+        print '\n%s (used: %d, free: %d, total: %d)' % \
+            (plugin, entry['used'], entry['free'], entry['total'])
+        print row % ('pool', 'used', 'free', 'total', 'used%')
+        for pool, counts in sorted(entry['pools'].items()):
+            usage = 100.0 * counts['used'] / counts['total'] \
+                if counts['total'] else 0.0
+            print row % (pool, counts['used'], counts['free'],
+                         counts['total'], '%.1f' % usage)
+
+def show_profile_stats(paths, top, debug):
+    start_logging(debug)
+
+    paths = paths or [config.runtime.profiling.directory]
+    filenames = profile_files(paths)
+    if not filenames:
+        print 'No request profiles found in %s' % ', '.join(paths)
+        return
+
+    routes = dict()
+    nodes = dict()
+    for filename in filenames:
+        (route, resource) = profile_tags(filename)
+        routes[route] = routes.get(route, 0) + 1
+        nodes[resource] = nodes.get(resource, 0) + 1
+
+    print '\nRequest profiles (%d)...' % len(filenames)
+    row = '   %-40s %10s'
+    print row % ('route', 'profiles')
+    for route, count in sorted(routes.items()):
+        print row % (route, count)
+    print row % ('resource (node)', 'profiles')
+    for resource, count in sorted(nodes.items(), key=lambda x: -x[1])[:top]:
+        print row % (resource, count)
+
+    stats = load_profiles(filenames)
+    # do not list every profile in the reports
+    stats.files = []
+    for (key, name) in [('cumulative', 'cumulative'), ('tottime', 'own')]:
+        print '\nTop %d functions by %s time...' % (top, name)
+        stats.sort_stats(key).print_stats(top)
+
+def run_validator(debug, jobs=1, manifest=None, report=None,
+                  version='N/A'):
+    ''' Validates the plugins, neighbordb, definitions, resource pools and
+    node files, using jobs processes.  If manifest is set, the files which
+    did not change since they last passed are skipped (and the manifest
+    is updated).  If report is set, the results are written to it as
+    JSON.  Returns the number of files which failed. '''
+
     start_logging(debug)
 
-    validate_neighbordb()
-    validate_definitions()
-    validate_resources()
-    validate_nodes()
+    data_root = config.runtime.default.data_root
+    previous = load_manifest(manifest, version) if manifest else dict()
+
+    plugins = validate_plugins()
+    entries = print_results(validate_files(validation_tasks(data_root),
+                                           jobs, previous))
+    failed = len([x for x in plugins + entries if x['errors']])
+    print '\n%d files validated, %d skipped, %d failed' % \
+        (len([x for x in entries if x['status'] != 'skipped']),
+         len([x for x in entries if x['status'] == 'skipped']), failed)
+
+    if manifest:
+        write_json(manifest, dict(
+            version=version,
+            files=dict((x['filename'], x['digest']) for x in entries
+                       if not x['errors'] and x['digest'])))
+    if report:
+        write_json(report, dict(version=version, data_root=data_root,
+                                failed=failed, plugins=plugins,
+                                files=entries))
+    return failed
 
 def main():
     ''' The :py:func:`main` is the main entry point for the ztpserver if called
@@ -323,6 +711,25 @@ def main():
                         action='store_true',
                         help='Validates config files')
 
+    parser.add_argument('--jobs', '-j',
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Number of processes used by --validate-config '
+                        '(defaults to the number of CPUs)')
+
+    parser.add_argument('--manifest',
+                        type=str,
+                        metavar='FILE',
+                        help='Digests of the files which passed '
+                        '--validate-config - unchanged files are skipped '
+                        'and FILE is updated')
+
+    parser.add_argument('--report',
+                        type=str,
+                        metavar='FILE',
+                        help='Writes the results of --validate-config to '
+                        'FILE (JSON)')
+
     parser.add_argument('--debug',
                         action='store_true',
                         help='Enables debug output to the STDOUT')
@@ -331,6 +738,45 @@ def main():
                         action='store_true',
                         help='Clears all resource files')
 
+    parser.add_argument('--resource-stats', '-s',
+                        action='store_true',
+                        help='Displays the used, free and total counts of '
+                        'all the resource pools')
+
+    parser.add_argument('--preallocate', '-p',
+                        nargs='*',
+                        metavar='POOL',
+                        help='Allocates resources ahead of time from each '
+                        'POOL (e.g. "sqlite(\'mgmt_subnet\')" - a bare name '
+                        'refers to an allocate() pool) for the nodes listed '
+                        'in --nodes.  Without POOL, the pools referenced by '
+                        '--definition (or by the definition of each node) '
+                        'are used')
+
+    parser.add_argument('--nodes', '-n',
+                        type=str,
+                        metavar='FILE',
+                        help='File listing the node IDs to preallocate '
+                        'resources for (one per line)')
+
+    parser.add_argument('--definition', '-d',
+                        type=str,
+                        help='Definition (name under [data_root]/definitions '
+                        'or path) whose resources are preallocated')
+
+    parser.add_argument('--profile-stats', '-P',
+                        nargs='*',
+                        metavar='PATH',
+                        help='Aggregates the request profiles in each PATH '
+                        '(pstats file or directory - defaults to the '
+                        '[profiling] directory) and displays the top '
+                        'functions')
+
+    parser.add_argument('--top',
+                        type=int,
+                        default=25,
+                        help='Number of functions displayed by '
+                        '--profile-stats')
 
     args = parser.parse_args()
 
@@ -343,13 +789,32 @@ def main():
     if args.version:
         print 'ZTPServer version %s' % version
 
+    status = 0
     if args.validate_config:
-        run_validator(args.debug)
+        load_config(args.conf)
+        if run_validator(args.debug, max(args.jobs, 1), args.manifest,
+                         args.report, version):
+            status = 1
 
     if args.clear_resources:
         clear_resources(args.debug)
 
-    if args.version or args.validate_config or args.clear_resources:
-        sys.exit()
+    if args.resource_stats:
+        load_config(args.conf)
+        show_resource_stats(args.debug)
+
+    if args.preallocate is not None:
+        load_config(args.conf)
+        preallocate_resources(args.preallocate, args.nodes, args.definition,
+                              args.debug)
+
+    if args.profile_stats is not None:
+        load_config(args.conf)
+        show_profile_stats(args.profile_stats, args.top, args.debug)
+
+    if args.version or args.validate_config or args.clear_resources or \
+       args.resource_stats or args.preallocate is not None or \
+       args.profile_stats is not None:
+        sys.exit(status)
 
     return run_server(version, args.conf, args.debug)
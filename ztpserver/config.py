@@ -170,12 +170,64 @@ class Group(collections.Mapping):
         self.config.add_attribute(item, self.name)
 
 
+class FrozenGroup(Group):
+    """ Read-only snapshot of the values of a group.  The values are
+    plain instance attributes, so reading one (e.g.
+    runtime.default.data_root) is a single attribute lookup.  Snapshots
+    are rebuilt by the Config object whenever a value changes and must
+    never be modified.
+
+    :param name: the name of the group
+    :param config: the config object the group is associated with
+    :param values: dict of attribute names and values
+
+    """
+
+    def __init__(self, name, config, values):
+        #pylint: disable=W0231
+        self.__dict__.update(values)
+        self.__dict__['_group'] = (name, config)
+
+    def __getattr__(self, name):
+        # only reached for attributes missing from the snapshot
+        (group, config) = self.__dict__['_group']
+        return config.__get_attribute__(name, group)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Failed to set value (name=%s, group=%s): '
+                             'config snapshots are read-only - use '
+                             'set_value' % (name, self.__dict__['_group'][0]))
+
+    def __delattr__(self, name):
+        self.__setattr__(name, None)
+
+    def __repr__(self):
+        return 'FrozenGroup(name=%s)' % self.__dict__['_group'][0]
+
+    def _keys(self):
+        return [key for key in self.__dict__ if key != '_group']
+
+    def add_attribute(self, item):
+        (group, config) = self.__dict__['_group']
+        config.add_attribute(item, group)
+
+
 class Config(collections.Mapping):
-    """ The Config class represents the configuration for collection.  """
+    """ The Config class represents the configuration for collection.
+
+    Each group is published as a :py:class:`FrozenGroup` instance
+    attribute, so runtime.<group>.<name> does not go through
+    __getattr__.  The snapshots are rebuilt whenever a value changes;
+    :py:meth:`reload` swaps all of them at once.
+    """
 
     def __init__(self):
         self.attributes = dict()
         self.groups = list()
+        self.filename = None
 
     def __getattr__(self, name):
         return self.__get_attribute__(name)
@@ -200,7 +252,7 @@ class Config(collections.Mapping):
 
     def __get_attribute__(self, name, group=None):
         if not group and name in self.groups:
-            return Group(name, self)
+            return self.__dict__.get(name) or Group(name, self)
 
         key = (group, name)
         if key not in self.attributes:
@@ -227,13 +279,30 @@ class Config(collections.Mapping):
         self.attributes[key] = obj
         if item.default is not None:
             obj['value'] = self._transform(obj, item.default)
+        self._publish(group)
 
     def add_group(self, group):
         if isinstance(group, Group):
-            self.groups.append(group.name)
+            group = group.name
         else:
             group = str(group)
-            self.groups.append(group)
+        self.groups.append(group)
+        self._publish(group)
+
+    def _snapshot(self, group, values):
+        """ returns a FrozenGroup from an iterable of (key, value) """
+
+        return FrozenGroup(group, self, dict((key[1], value)
+                                             for (key, value) in values
+                                             if key[0] == group))
+
+    def _publish(self, group):
+        """ rebuilds the snapshot of a group """
+
+        if group and group in self.groups:
+            self.__dict__[group] = self._snapshot(
+                group, ((key, item.get('value'))
+                        for (key, item) in self.attributes.items()))
 
     def _transform(self, item, value):
         # pylint: disable=R0201
@@ -251,6 +320,7 @@ class Config(collections.Mapping):
                                  'missing item' %
                                  (name, group))
         item['value'] = self._transform(item, value)
+        self._publish(group)
 
     def clear_value(self, name, group=None):
         """ clears the attributes value and resets it to default """
@@ -262,12 +332,16 @@ class Config(collections.Mapping):
 
         item = self.attributes.get((group, name))
 
+        item['value'] = self._default(item)
+        self._publish(group)
+
+    def _default(self, item):
         if item['_metadata'].default is None:   # pylint: disable=W0104
-            item['value'] = None
-        else:
-            item['value'] = self._transform(item, item['_metadata'].default)
+            return None
+        return self._transform(item, item['_metadata'].default)
 
     def read(self, filename):
+        self.filename = filename
         cp = ConfigParser.RawConfigParser() #pylint: disable=C0103
         cp.read(filename)
         for section in cp.sections():
@@ -279,6 +353,52 @@ class Config(collections.Mapping):
                                 (filename, err))
                     continue
 
+    def reload(self, filename=None):
+        """ Re-reads the configuration file (by default, the last file
+        read) without disturbing requests in progress: the values are
+        reset to their defaults, the file is applied to a copy and the
+        new snapshots of all the groups are published at once.  Values
+        which fail validation keep their defaults (and are logged).
+
+        :param filename: path of the configuration file
+        :raises IOError: if the file cannot be read
+
+        """
+
+        filename = filename or self.filename
+        if filename is None:
+            raise IOError('No configuration file to reload')
+
+        cp = ConfigParser.RawConfigParser() #pylint: disable=C0103
+        if not cp.read(filename):
+            raise IOError('Failed to read %s' % filename)
+
+        values = dict((key, self._default(item))
+                      for (key, item) in self.attributes.items())
+        for section in cp.sections():
+            for key, value in cp.items(section):
+                item = self.attributes.get((section, key))
+                if item is None:
+                    log.warning('Error detected while reading %s: '
+                                'unknown attribute (name=%s, group=%s)' %
+                                (filename, key, section))
+                    continue
+                try:
+                    values[(section, key)] = self._transform(item, value)
+                except (AttributeError, ValueError) as err:
+                    log.warning('Error detected while reading %s: %s' %
+                                (filename, err))
+
+        snapshots = dict((group, self._snapshot(group, values.items()))
+                         for group in self.groups if group)
+        for (key, value) in values.items():
+            self.attributes[key]['value'] = value
+        # a single dict update - readers see either the old or the new
+        # snapshot of each group, never a half-applied file
+        self.__dict__.update(snapshots)
+        self.filename = filename
+        log.info('Reloaded config file: %s' % filename)
+
 runtime = Config()
 
 # Group: default
@@ -322,6 +442,12 @@ runtime.add_attribute(BoolAttr(
     default=False
 ))
 
+runtime.add_attribute(IntAttr(
+    name='file_cache_size',
+    min_value=0,
+    default=0
+))
+
 # Group: server
 runtime.add_attribute(StrAttr(
     name='interface',
@@ -337,6 +463,27 @@ runtime.add_attribute(IntAttr(
     default=8080
 ))
 
+runtime.add_attribute(IntAttr(
+    name='workers',
+    group='server',
+    min_value=1,
+    default=1
+))
+
+runtime.add_attribute(IntAttr(
+    name='threads',
+    group='server',
+    min_value=1,
+    default=1
+))
+
+runtime.add_attribute(IntAttr(
+    name='keepalive_timeout',
+    group='server',
+    min_value=0,
+    default=5
+))
+
 
 # Group: bootstrap
 runtime.add_attribute(StrAttr(
@@ -353,3 +500,141 @@ runtime.add_attribute(StrAttr(
     default='neighbordb',
     environ='ZTPS_NEIGHBORDB_FILENAME'
 ))
+
+# Group: resources
+runtime.add_attribute(BoolAttr(
+    name='allocation_service',
+    group='resources',
+    default=False
+))
+
+runtime.add_attribute(IntAttr(
+    name='flush_interval',
+    group='resources',
+    min_value=1,
+    default=5
+))
+
+runtime.add_attribute(IntAttr(
+    name='batch_size',
+    group='resources',
+    min_value=1,
+    default=256
+))
+
+runtime.add_attribute(ListAttr(
+    name='leases',
+    group='resources',
+    default=[]
+))
+
+runtime.add_attribute(IntAttr(
+    name='sweep_interval',
+    group='resources',
+    min_value=1,
+    default=60
+))
+
+runtime.add_attribute(IntAttr(
+    name='sweep_batch',
+    group='resources',
+    min_value=1,
+    default=100
+))
+
+# Group: logging
+runtime.add_attribute(IntAttr(
+    name='queue_size',
+    group='logging',
+    min_value=0,
+    default=10000
+))
+
+runtime.add_attribute(ListAttr(
+    name='node_levels',
+    group='logging',
+    default=[]
+))
+
+runtime.add_attribute(IntAttr(
+    name='duplicate_interval',
+    group='logging',
+    min_value=0,
+    default=10
+))
+
+runtime.add_attribute(BoolAttr(
+    name='payloads',
+    group='logging',
+    default=False
+))
+
+# Group: admission
+runtime.add_attribute(IntAttr(
+    name='max_requests',
+    group='admission',
+    min_value=0,
+    default=0
+))
+
+runtime.add_attribute(IntAttr(
+    name='max_queue',
+    group='admission',
+    min_value=0,
+    default=100
+))
+
+runtime.add_attribute(IntAttr(
+    name='queue_timeout',
+    group='admission',
+    min_value=0,
+    default=10
+))
+
+# Group: profiling
+runtime.add_attribute(BoolAttr(
+    name='enabled',
+    group='profiling',
+    default=False
+))
+
+runtime.add_attribute(IntAttr(
+    name='sample',
+    group='profiling',
+    min_value=0,
+    default=100
+))
+
+runtime.add_attribute(StrAttr(
+    name='token',
+    group='profiling',
+    default=''
+))
+
+runtime.add_attribute(StrAttr(
+    name='directory',
+    group='profiling',
+    default='/var/tmp/ztpserver/profiles'
+))
+
+runtime.add_attribute(IntAttr(
+    name='sample_rate',
+    group='profiling',
+    min_value=1,
+    max_value=1000,
+    default=100
+))
+
+runtime.add_attribute(IntAttr(
+    name='max_seconds',
+    group='profiling',
+    min_value=1,
+    default=60
+))
+
+# Group: admin
+runtime.add_attribute(StrAttr(
+    name='token',
+    group='admin',
+    default=''
+))
@@ -32,6 +32,7 @@
 # pylint: disable=W0622,W0402,W0613,W0142,R0201,E1103,W0150
 #
 
+import hmac
 import logging
 import os
 import routes
@@ -43,7 +44,9 @@ from webob.static import FileApp
 
 from ztpserver.constants import HTTP_STATUS_NOT_FOUND, HTTP_STATUS_CREATED
 from ztpserver.constants import HTTP_STATUS_BAD_REQUEST, HTTP_STATUS_CONFLICT
+from ztpserver.constants import HTTP_STATUS_FORBIDDEN, HTTP_STATUS_OK
 from ztpserver.constants import HTTP_STATUS_INTERNAL_SERVER_ERROR
+from ztpserver.constants import HTTP_STATUS_SERVICE_UNAVAILABLE
 from ztpserver.constants import CONTENT_TYPE_JSON, CONTENT_TYPE_PYTHON
 from ztpserver.constants import CONTENT_TYPE_YAML, CONTENT_TYPE_OTHER
 
@@ -52,6 +55,14 @@ from ztpserver.repository import FileObjectNotFound, FileObjectError
 from ztpserver.serializers import SerializerError
 from ztpserver.topology import create_node, load_pattern
 from ztpserver.topology import load_neighbordb, load_resources
+from ztpserver.topology import find_resources
+from ztpserver.resources import run_plugins, resource_stats
+from ztpserver.leases import renew_leases
+from ztpserver.admission import nodes_admission, Overloaded
+from ztpserver.logqueue import node_context
+from ztpserver.metrics import registry as metrics
+from ztpserver.profiling import authorized, collapsed, sampler, SamplerBusy
+from ztpserver.server import reload_workers
 from ztpserver.topology import replace_config_action
 from ztpserver.wsgiapp import WSGIController, WSGIRouter
 from ztpserver.config import runtime
@@ -65,6 +76,12 @@ NODE_FN = '.node'
 ATTRIBUTES_FN = 'attributes'
 BOOTSTRAP_CONF = 'bootstrap.conf'
 
+# retry policy settings of the bootstrap client (bootstrap.conf)
+RETRY_KEYS = ['max_time', 'base_delay', 'max_delay']
+
+# header carrying the [admin] token, required by /admin/reload
+ADMIN_HEADER = 'X-ZTPS-Admin'
+
 log = logging.getLogger(__name__)    # pylint: disable=C0103
 
 
@@ -106,6 +123,13 @@ class BaseController(WSGIController):
         return dict(body='', content_type='text/html',
                     status=HTTP_STATUS_INTERNAL_SERVER_ERROR)
 
+    def http_service_unavailable(self, retry_after, *args, **kwargs):
+        ''' Returns HTTP 503 Service Unavailable '''
+
+        return dict(body='', content_type='text/html',
+                    status=HTTP_STATUS_SERVICE_UNAVAILABLE,
+                    retry_after=retry_after)
+
 
 class FilesController(BaseController):
 
@@ -116,7 +140,8 @@ class FilesController(BaseController):
 
     def show(self, request, resource, **kwargs):
         ''' Handles GET /files/{resource} '''
-        log.debug('%s\nResource: %s\n' % (request, resource))
+        if runtime.logging.payloads:
+            log.debug('%s\nResource: %s\n' % (request, resource))
 
         try:
             urlvars = request.urlvars
@@ -139,7 +164,8 @@ class ActionsController(BaseController):
 
     def show(self, request, resource, **kwargs):
         ''' Handles GET /actions/{resource} '''
-        log.debug('%s\nResource: %s\n' % (request, resource))
+        if runtime.logging.payloads:
+            log.debug('%s\nResource: %s\n' % (request, resource))
 
         try:
             file_path = self.expand(resource)
@@ -157,9 +183,29 @@ class NodesController(BaseController):
     def __repr__(self):
         return 'NodesController(folder=%s)' % self.FOLDER
 
+    def dispatch(self, request):
+        # tag the logs of /nodes/{resource} requests with the node ID
+        with node_context(request.urlvars.get('resource')):
+            return super(NodesController, self).dispatch(request)
+
 
     def fsm(self, state, **kwargs):
-        ''' Execute the FSM for the request '''
+        ''' Execute the FSM for the request, once admitted (see
+        [admission]) '''
+
+        with node_context(kwargs['node_id']):
+            try:
+                admitted = nodes_admission().admit()
+            except Overloaded as err:
+                log.warning('%s: %s (retry after %ss)' %
+                            (kwargs['node_id'], err, err.retry_after))
+                return self.http_service_unavailable(err.retry_after)
+
+            with admitted:
+                return self.run_fsm(state, **kwargs)
+
+    def run_fsm(self, state, **kwargs):
+        ''' Runs the FSM states, starting with state '''
 
         response = dict()
         try:
@@ -177,15 +223,21 @@ class NodesController(BaseController):
                       (kwargs['node_id'], prev_state, str(err)))
             response = self.http_bad_request()
 
-        log.debug('%s: response to %s: %s' %
-                  (kwargs['node_id'], prev_state, response))
+        if runtime.logging.payloads:
+            log.debug('%s: response to %s: %s' %
+                      (kwargs['node_id'], prev_state, response))
+        else:
+            log.debug('%s: response to %s: status=%s' %
+                      (kwargs['node_id'], prev_state,
+                       response.get('status', HTTP_STATUS_OK)))
         return response                     # pylint: disable=W0150
 
     #-------------------------------------------------------------------
 
     def get_config(self, request, resource, **kwargs):
-        log.debug('%s: node resource GET request: \n%s\n' %
-                  (resource, request))
+        if runtime.logging.payloads:
+            log.debug('%s: node resource GET request: \n%s\n' %
+                      (resource, request))
 
         response = dict()
 
@@ -209,8 +261,9 @@ class NodesController(BaseController):
     def put_config(self, request, **kwargs):
         node_id = kwargs['resource']
 
-        log.debug('%s: startup-config PUT request: \n%s\n' %
-                  (node_id, request))
+        if runtime.logging.payloads:
+            log.debug('%s: startup-config PUT request: \n%s\n' %
+                      (node_id, request))
 
         fobj = None
         try:
@@ -273,8 +326,11 @@ class NodesController(BaseController):
             create a WSGI response object.
 
         """
-        log.info('%s: received system information from node:\n%s' %
-                 (request.remote_addr, request.json))
+        log.info('%s: received system information from node' %
+                 request.remote_addr)
+        if runtime.logging.payloads:
+            log.debug('%s: system information:\n%s' %
+                      (request.remote_addr, request.json))
 
         try:
             node = create_node(request.json)
@@ -399,7 +455,8 @@ class NodesController(BaseController):
             return (self.http_bad_request(), None)
 
         # pylint: disable=E1103
-        matches = neighbordb.match_node(node)
+        with metrics.histogram('neighbordb_match_seconds').time():
+            matches = neighbordb.match_node(node)
         if not matches:
             log.info('%s: node matched no patterns in neighbordb' %
                      node_id)
@@ -516,8 +573,9 @@ class NodesController(BaseController):
         finally:
             fobj.write(contents, CONTENT_TYPE_JSON)
 
-        log.info('%s: node data written to %s:\n%s' %
-                 (node_id, filename, contents))
+        log.info('%s: node data written to %s' % (node_id, filename))
+        if runtime.logging.payloads:
+            log.debug('%s: node data:\n%s' % (node_id, contents))
 
         return (response, 'set_location')
 
@@ -556,7 +614,8 @@ class NodesController(BaseController):
         """
         log.info('%s: received request for definition: %s' %
                  (resource, request.url))
-        log.debug('%s\nResource: %s\n' % (request, resource))
+        if runtime.logging.payloads:
+            log.debug('%s\nResource: %s\n' % (request, resource))
 
         node_id = resource.split('/')[0]
         try:
@@ -728,11 +787,23 @@ class NodesController(BaseController):
         _actions = list()
 
         try:
+            # Collect all the references first, so that each
+            # (plugin, pool) is only resolved once per request
+            references = set()
+            for action in definition.get('actions'):
+                references.update(
+                    find_resources(action.get('attributes', dict())))
+            # renew the leases first: once renewed, the lease sweeper
+            # cannot free the resources which are about to be looked up
+            renew_leases(references, kwargs['resource'])
+            resources = run_plugins(references, kwargs['resource'])
+
             for action in definition.get('actions'):
                 attrs = action.get('attributes', dict())
 
                 action['attributes'] = \
-                    load_resources(attrs, node, kwargs['resource'])
+                    load_resources(attrs, node, kwargs['resource'],
+                                   resources)
                 _actions.append(action)
         except Exception as exc:
             log.error(exc)
@@ -764,6 +835,24 @@ class BootstrapController(BaseController):
     def __repr__(self):
         return 'BootstrapController(folder=%s)' % self.FOLDER
 
+    @staticmethod
+    def retry_config(config):
+        ''' Returns the valid entries of the retry section of the bootstrap
+        config '''
+
+        result = dict()
+        for (key, value) in config.items():
+            if key not in RETRY_KEYS:
+                log.warning('Bootstrap config: unknown retry setting '
+                            '\'%s\'' % key)
+            elif isinstance(value, bool) or \
+                 not isinstance(value, (int, long, float)) or value < 0:
+                log.warning('Bootstrap config: invalid retry %s: %s' %
+                            (key, value))
+            else:
+                result[key] = value
+        return result
+
     def config(self, request, **kwargs):
         ''' Handles GET /bootstrap/config '''
 
@@ -792,6 +881,11 @@ class BootstrapController(BaseController):
                                     'configured')
                     log.info('%s: xmpp info included in bootstrap config' %
                              request.remote_addr)
+
+                if 'retry' in config and config['retry']:
+                    body['retry'] = self.retry_config(config['retry'])
+                    log.info('%s: retry policy included in bootstrap config' %
+                             request.remote_addr)
             resp = dict(body=body, content_type=CONTENT_TYPE_JSON)
         except FileObjectNotFound:
             log.warning('Bootstrap config file not found')
@@ -864,6 +958,117 @@ class MetaController(BaseController):
         return resp
 
 
+class ResourcesController(BaseController):
+
+    FOLDER = 'resources'
+
+    def __repr__(self):
+        return 'ResourcesController(folder=%s)' % self.FOLDER
+
+    def stats(self, request, **kwargs):
+        ''' Handles GET /resources/stats '''
+
+        try:
+            body = resource_stats()
+            resp = dict(body=body, content_type=CONTENT_TYPE_JSON)
+        except Exception as exc:            #pylint: disable=W0703
+            log.error('Failed to collect resource stats: %s' % exc)
+            resp = self.http_internal_server_error()
+        return resp
+
+
+class MetricsController(BaseController):
+
+    def __repr__(self):
+        return 'MetricsController'
+
+    def index(self, request, **kwargs):
+        ''' Handles GET /metrics '''
+
+        return dict(body=metrics.exposition(),
+                    content_type=CONTENT_TYPE_OTHER)
+
+
+class DebugController(BaseController):
+
+    def __repr__(self):
+        return 'DebugController'
+
+    def profile(self, request, **kwargs):
+        ''' Handles GET /debug/profile?seconds=<seconds>&rate=<rate>
+
+        Samples the stacks of all the threads of the server process and
+        returns the collapsed stacks.  Requires the X-ZTPS-Profile header
+        to match [profiling] token.
+        '''
+
+        if not runtime.profiling.token:
+            return self.http_not_found()
+
+        if not authorized(request):
+            log.warning('Unauthorized stack sampling request from %s' %
+                        request.remote_addr)
+            return dict(body='', content_type='text/html',
+                        status=HTTP_STATUS_FORBIDDEN)
+
+        try:
+            seconds = float(request.GET.get('seconds', 10))
+            rate = int(request.GET.get('rate',
+                                       runtime.profiling.sample_rate))
+        except ValueError:
+            return self.http_bad_request()
+
+        if not 0 < seconds <= runtime.profiling.max_seconds or \
+           not 0 < rate <= 1000:
+            return self.http_bad_request()
+
+        log.info('Sampling stacks for %ss (%d/s)' % (seconds, rate))
+        try:
+            counts = sampler.sample(seconds, rate)
+        except SamplerBusy:
+            return dict(body='', content_type='text/html',
+                        status=HTTP_STATUS_CONFLICT)
+
+        return dict(body=collapsed(counts), content_type=CONTENT_TYPE_OTHER)
+
+
+class AdminController(BaseController):
+
+    def __repr__(self):
+        return 'AdminController'
+
+    def reload(self, request, **kwargs):
+        ''' Handles POST /admin/reload
+
+        Re-reads the configuration file.  Requires the X-ZTPS-Admin
+        header to match [admin] token.  Under the pre-fork server, all
+        the workers are reloaded.
+        '''
+
+        token = runtime.admin.token
+        if not token:
+            return self.http_not_found()
+
+        if not hmac.compare_digest(
+                str(request.headers.get(ADMIN_HEADER, '')), token):
+            log.warning('Unauthorized config reload request from %s' %
+                        request.remote_addr)
+            return dict(body='', content_type='text/html',
+                        status=HTTP_STATUS_FORBIDDEN)
+
+        try:
+            runtime.reload()
+        except IOError as exc:
+            log.error('Failed to reload config: %s' % exc)
+            return self.http_internal_server_error()
+
+        # the other workers (this one is reloaded again, harmlessly)
+        reload_workers()
+
+        return dict(body=dict(filename=runtime.filename),
+                    content_type=CONTENT_TYPE_JSON)
+
+
 class Router(WSGIRouter):
     ''' Routes incoming requests by mapping the URL to a controller '''
 
@@ -896,6 +1101,30 @@ class Router(WSGIRouter):
                                   action='metadata',
                                   conditions=dict(method=['GET']))
 
+            # configure /resources
+            router_mapper.connect('resource_stats', '/resources/stats',
+                                  controller=ResourcesController,
+                                  action='stats',
+                                  conditions=dict(method=['GET']))
+
+            # configure /metrics
+            router_mapper.connect('metrics', '/metrics',
+                                  controller=MetricsController,
+                                  action='index',
+                                  conditions=dict(method=['GET']))
+
+            # configure /debug
+            router_mapper.connect('debug_profile', '/debug/profile',
+                                  controller=DebugController,
+                                  action='profile',
+                                  conditions=dict(method=['GET']))
+
+            # configure /admin
+            router_mapper.connect('admin_reload', '/admin/reload',
+                                  controller=AdminController,
+                                  action='reload',
+                                  conditions=dict(method=['POST']))
+
             # configure /nodes
             router_mapper.collection('nodes', 'node',
                                      controller=NodesController,
@@ -0,0 +1,383 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.leases
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The leases module implements (optional) lease times for the
+        resources allocated via plugins.  A lease is renewed every time
+        a node fetches its definition; a background sweeper frees the
+        resources of the nodes whose lease has expired, via the plugin's
+        main_release(node_id, pool) entry point.
+
+        Lease renewals are appended to [data_root]/leases/<plugin>.<pool>
+        (one JSON record per line) and indexed in memory by expiry time,
+        so neither renewing nor sweeping requires scanning or rewriting
+        the resource pools.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+from ztpserver.config import runtime
+from ztpserver.locks import LockManager
+from ztpserver.resources import run_release
+
+# compact a lease file once it holds COMPACT_RATIO records per lease
+COMPACT_RATIO = 4
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+# lease tables release resources from pools while locked, so they use
+# their own lock manager (always taken before the pool locks)
+LEASE_LOCKS = LockManager('leases')
+
+
+def leases_path():
+    return os.path.join(runtime.default.data_root, 'leases')
+
+def lease_times():
+    ''' Returns a dict mapping (plugin, pool) to the lease time (seconds)
+    configured via [resources] leases (<plugin>:<pool>:<seconds>, ...)
+    '''
+
+    result = dict()
+    for entry in runtime.resources.leases or []:
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            (plugin, pool, seconds) = [x.strip() for x in entry.split(':')]
+            result[(plugin, pool)] = int(seconds)
+        except ValueError:
+            log.error('invalid lease \'%s\' - expecting '
+                      '<plugin>:<pool>:<seconds>' % entry)
+    return result
+
+
+class LeaseTable(object):
+    ''' The :py:class:`LeaseTable` tracks the last time each node renewed
+    its lease on the resources allocated from one pool.  All the public
+    methods are safe to call from multiple threads and multiple processes.
+    '''
+
+    def __init__(self, filename, ttl):
+        self.filename = filename
+        self.ttl = ttl
+        (path, name) = os.path.split(filename)
+        self.lockfile = os.path.join(path, '.%s.lock' % name)
+
+        self._lock = threading.RLock()
+
+        self.renewed = dict()       # node -> time of last renewal
+        self._expiry = list()       # heap of (expiry, node), may be stale
+        self._inode = None
+        self._offset = 0
+        self._records = 0
+
+    def __repr__(self):
+        return 'LeaseTable(filename=%s, ttl=%s, leases=%d)' % \
+            (self.filename, self.ttl, len(self.renewed))
+
+    def _apply(self, record):
+        (node_id, timestamp) = (str(record[0]), record[1])
+        if timestamp is None:
+            self.renewed.pop(node_id, None)
+        elif timestamp >= self.renewed.get(node_id, 0):
+            self.renewed[node_id] = timestamp
+            heapq.heappush(self._expiry, (timestamp + self.ttl, node_id))
+        self._records += 1
+
+    def _refresh(self):
+        ''' Applies the records appended by other processes.  Must be
+        called with the lock held. '''
+
+        try:
+            fhandler = open(self.filename)
+        except IOError:
+            if self._inode is not None:
+                self._reset()
+            return
+
+        with fhandler:
+            stat = os.fstat(fhandler.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                self._reset()
+                self._inode = stat.st_ino
+            fhandler.seek(self._offset)
+            for line in fhandler:
+                if not line.endswith('\n'):
+                    # partial record (interrupted write)
+                    break
+                self._offset += len(line)
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, TypeError, IndexError):
+                    log.warning('%s: ignoring corrupt lease record: %s' %
+                                (self.filename, line.strip()))
+
+    def _reset(self):
+        self.renewed = dict()
+        self._expiry = list()
+        self._inode = None
+        self._offset = 0
+        self._records = 0
+
+    def _write(self, records):
+        ''' Appends records to the lease file.  Must be called with the
+        exclusive lock held. '''
+
+        lines = ''.join(json.dumps(x) + '\n' for x in records)
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0664)
+        try:
+            stat = os.fstat(fd)
+            if stat.st_ino != self._inode:
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size != self._offset:
+                # drop any partial record left behind by a failed write
+                os.ftruncate(fd, self._offset)
+            os.write(fd, lines)
+        finally:
+            os.close(fd)
+
+        self._offset += len(lines)
+        for record in records:
+            self._apply(record)
+
+        if self._records > COMPACT_RATIO * max(len(self.renewed), 256):
+            self._compact()
+
+    def _compact(self):
+        records = sorted(self.renewed.items())
+        tmp = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(tmp, 'w') as fhandler:
+            for record in records:
+                fhandler.write(json.dumps(record) + '\n')
+        os.rename(tmp, self.filename)
+
+        self._reset()
+        self._inode = os.stat(self.filename).st_ino
+        for record in records:
+            self._offset += len(json.dumps(record)) + 1
+            self._apply(record)
+
+    def _locked(self):
+        path = os.path.dirname(self.filename)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return LEASE_LOCKS.exclusive(self.lockfile)
+
+    def renew(self, node_id, now=None):
+        ''' Renews the lease of node_id '''
+
+        now = int(time.time() if now is None else now)
+        with self._lock:
+            with self._locked():
+                self._refresh()
+                self._write([[node_id, now]])
+
+    def expires(self, node_id):
+        ''' Returns the expiry time of the lease of node_id (or None) '''
+
+        with self._lock:
+            with self._locked():
+                self._refresh()
+                renewed = self.renewed.get(node_id)
+                return None if renewed is None else renewed + self.ttl
+
+    def sweep(self, release, now=None, limit=None):
+        ''' Calls release(node_id) for (up to limit of) the nodes whose
+        lease has expired, oldest first, and drops their leases.  Returns
+        the list of nodes released.
+        '''
+
+        now = int(time.time() if now is None else now)
+        released = list()
+        with self._lock:
+            with self._locked():
+                self._refresh()
+                while self._expiry and self._expiry[0][0] <= now:
+                    if limit is not None and len(released) >= limit:
+                        break
+
+                    (expiry, node_id) = heapq.heappop(self._expiry)
+                    renewed = self.renewed.get(node_id)
+                    if renewed is None or renewed + self.ttl != expiry:
+                        # renewed (or released) since
+                        continue
+
+                    try:
+                        release(node_id)
+                    except Exception as exc:    #pylint: disable=W0703
+                        log.error('%s: failed to release expired lease: %s'
+                                  % (node_id, exc))
+                        heapq.heappush(self._expiry, (expiry, node_id))
+                        break
+                    released.append(node_id)
+
+                if released:
+                    self._write([[x, None] for x in released])
+        return released
+
+
+_tables = dict()                    #pylint: disable=C0103
+_tables_lock = threading.Lock()     #pylint: disable=C0103
+
+def lease_table(plugin, pool):
+    ''' Returns the (per process) :py:class:`LeaseTable` for the pool, or
+    None if no lease time is configured for it '''
+
+    ttl = lease_times().get((plugin, pool))
+    if ttl is None:
+        return None
+
+    filename = os.path.join(leases_path(), '%s.%s' % (plugin, pool))
+    table = _tables.get(filename)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(filename)
+            if table is None:
+                table = LeaseTable(filename, ttl)
+                _tables[filename] = table
+    table.ttl = ttl
+    return table
+
+def renew_leases(references, node_id):
+    ''' Renews the leases of node_id for a collection of (plugin, pool)
+    references '''
+
+    for (plugin, pool) in sorted(references):
+        table = lease_table(plugin, pool)
+        if table is not None:
+            try:
+                table.renew(node_id)
+            except Exception as exc:        #pylint: disable=W0703
+                log.error('%s: failed to renew lease for %s(\'%s\'): %s' %
+                          (node_id, plugin, pool, exc))
+
+
+class LeaseSweeper(object):
+    ''' The :py:class:`LeaseSweeper` periodically frees the resources of
+    the nodes whose lease has expired (at most batch nodes per pool and
+    per sweep) '''
+
+    def __init__(self, interval=60, batch=100):
+        self.interval = interval
+        self.batch = batch
+        self.pid = None
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return 'LeaseSweeper(interval=%s, batch=%s)' % \
+            (self.interval, self.batch)
+
+    def start(self):
+        self.pid = os.getpid()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='lease-sweeper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as exc:        #pylint: disable=W0703
+                log.error('lease sweeper: %s' % exc)
+
+    def sweep(self, now=None):
+        ''' Frees expired leases in all pools.  Returns a dict mapping
+        (plugin, pool) to the list of nodes released. '''
+
+        result = dict()
+        for (plugin, pool) in sorted(lease_times()):
+            table = lease_table(plugin, pool)
+            release = lambda x, plugin=plugin, pool=pool: \
+                run_release(plugin, x, pool)
+            released = table.sweep(release, now, self.batch)
+            if released:
+                log.info('lease sweeper: released %s(\'%s\') for %s' %
+                         (plugin, pool, ', '.join(released)))
+                result[(plugin, pool)] = released
+        return result
+
+
+_sweeper = None                     #pylint: disable=C0103
+_sweeper_lock = threading.Lock()    #pylint: disable=C0103
+
+def lease_sweeper():
+    ''' Returns the (per process) :py:class:`LeaseSweeper`, starting it on
+    first use, or None if no leases are configured '''
+
+    global _sweeper                 #pylint: disable=W0603
+
+    if not lease_times():
+        return None
+
+    sweeper = _sweeper
+    if sweeper is None or sweeper.pid != os.getpid():
+        with _sweeper_lock:
+            sweeper = _sweeper
+            if sweeper is None or sweeper.pid != os.getpid():
+                sweeper = LeaseSweeper(runtime.resources.sweep_interval,
+                                       runtime.resources.sweep_batch)
+                sweeper.start()
+                atexit.register(sweeper.stop)
+                _sweeper = sweeper
+    return sweeper
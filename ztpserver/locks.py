@@ -0,0 +1,224 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.locks
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The locks module provides reader/writer locks for files which are
+        shared by threads and processes.  A :py:class:`LockManager` maps
+        each file to one of a fixed number of in-process reader/writer
+        locks (stripes) and, once that is held, takes an fcntl (flock)
+        lock on the file - so threads queue up in-process and only the
+        processes contend on the file lock.  Shared (read) locks never
+        exclude each other.  The time spent waiting for locks is reported
+        in the lock_wait_seconds histogram.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import fcntl
+import os
+import threading
+import time
+
+from ztpserver.metrics import registry as metrics
+
+DEFAULT_STRIPES = 64
+
+
+class FileLock(object):
+    ''' Context manager for an fcntl (flock) lock on filename '''
+
+    def __init__(self, filename, shared=False):
+        self.filename = filename
+        self.shared = shared
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0664)
+        try:
+            fcntl.flock(self.fd,
+                        fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        except Exception:
+            os.close(self.fd)
+            self.fd = None
+            raise
+        return self
+
+    def __exit__(self, *args):
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+
+class RWLock(object):
+    ''' In-process reader/writer lock: any number of readers or a single
+    writer.  Waiting writers block new readers, so writers are not
+    starved.  The lock is not reentrant.
+    '''
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0           # writers waiting
+        self._sleeping = 0          # threads blocked on _cond
+
+    def __repr__(self):
+        return 'RWLock(readers=%s, writer=%s, waiting=%s)' % \
+            (self._readers, self._writer, self._waiting)
+
+    def _wait(self):
+        self._sleeping += 1
+        try:
+            self._cond.wait()
+        finally:
+            self._sleeping -= 1
+
+    def acquire_shared(self):
+        with self._mutex:
+            while self._writer or self._waiting:
+                self._wait()
+            self._readers += 1
+
+    def release_shared(self):
+        with self._mutex:
+            self._readers -= 1
+            # (Condition.notify_all is comparatively expensive)
+            if not self._readers and self._sleeping:
+                self._cond.notify_all()
+
+    def acquire_exclusive(self):
+        with self._mutex:
+            self._waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._wait()
+            finally:
+                self._waiting -= 1
+            self._writer = True
+
+    def release_exclusive(self):
+        with self._mutex:
+            self._writer = False
+            if self._sleeping:
+                self._cond.notify_all()
+
+
+class LockManager(object):
+    ''' Hands out shared and exclusive locks on (lock) files.
+
+    Several files map to the same stripe, so a thread must not hold two
+    locks from the same manager at once.  Subsystems which nest locks
+    (e.g. lease tables, which release resources from pools) use separate
+    managers and always take them in the same order.
+    '''
+
+    def __init__(self, name, stripes=DEFAULT_STRIPES):
+        self.name = name
+        self._stripes = [RWLock() for _ in range(stripes)]
+        self._wait = dict()
+
+    def __repr__(self):
+        return 'LockManager(name=%s, stripes=%s)' % \
+            (self.name, len(self._stripes))
+
+    def stripe(self, filename):
+        return self._stripes[hash(filename) % len(self._stripes)]
+
+    def wait_histogram(self, shared):
+        ''' Returns the lock_wait_seconds histogram for the mode '''
+
+        histogram = self._wait.get(shared)
+        if histogram is None:
+            histogram = metrics.histogram(
+                'lock_wait_seconds',
+                dict(lock=self.name,
+                     mode='shared' if shared else 'exclusive'))
+            self._wait[shared] = histogram
+        return histogram
+
+    def shared(self, filename):
+        ''' Context manager for a shared (read) lock on filename '''
+        return _ManagedLock(self, filename, True)
+
+    def exclusive(self, filename):
+        ''' Context manager for an exclusive (write) lock on filename '''
+        return _ManagedLock(self, filename, False)
+
+
+class _ManagedLock(object):
+    ''' Stripe lock + file lock, as handed out by a LockManager '''
+
+    def __init__(self, manager, filename, shared):
+        self.manager = manager
+        self.stripe = manager.stripe(filename)
+        self.shared = shared
+        self.filelock = FileLock(filename, shared=shared)
+
+    def __enter__(self):
+        start = time.time()
+        if self.shared:
+            self.stripe.acquire_shared()
+        else:
+            self.stripe.acquire_exclusive()
+        try:
+            self.filelock.__enter__()
+        except Exception:
+            self._release()
+            raise
+        self.manager.wait_histogram(self.shared).observe(time.time() - start)
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.filelock.__exit__(*args)
+        finally:
+            self._release()
+
+    def _release(self):
+        if self.shared:
+            self.stripe.release_shared()
+        else:
+            self.stripe.release_exclusive()
@@ -0,0 +1,259 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.logqueue
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The logqueue module keeps log I/O off the request threads: a
+        :py:class:`QueueHandler` puts the records on a bounded queue
+        (dropping them when it is full) and a background
+        :py:class:`QueueListener` thread passes them on to the actual
+        handlers.  :py:class:`NodeLevelFilter` applies per-node log
+        levels, based on the node being served by the current thread (see
+        :py:func:`node_context`), and :py:class:`DuplicateFilter`
+        suppresses the records which repeat within an interval.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import atexit
+import logging
+import os
+import threading
+import Queue
+
+from contextlib import contextmanager
+
+from ztpserver.metrics import registry as metrics
+
+# maximum number of distinct messages tracked by DuplicateFilter
+DUPLICATE_CACHE_SIZE = 10000
+
+_context = threading.local()     #pylint: disable=C0103
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+
+@contextmanager
+def node_context(node_id):
+    ''' Tags the records logged by the current thread with node_id '''
+
+    previous = getattr(_context, 'node_id', None)
+    _context.node_id = node_id
+    try:
+        yield
+    finally:
+        _context.node_id = previous
+
+
+def current_node():
+    ''' Returns the node served by the current thread (or None) '''
+
+    return getattr(_context, 'node_id', None)
+
+
+def node_levels(entries):
+    ''' Returns a dict mapping node IDs to log levels, from a list of
+    <node_id>:<level> entries '''
+
+    result = dict()
+    for entry in entries or []:
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            (node_id, level) = [x.strip() for x in entry.split(':')]
+            result[node_id] = int(logging.getLevelName(level.upper()))
+        except ValueError:
+            log.error('invalid node log level \'%s\' - expecting '
+                      '<node_id>:<level>' % entry)
+    return result
+
+
+class NodeLevelFilter(logging.Filter):
+    ''' Filters records by level: the level of the node served by the
+    current thread, if any, or the default level '''
+
+    def __init__(self, level, levels=None):
+        super(NodeLevelFilter, self).__init__()
+        self.level = level
+        self.levels = levels or dict()
+
+    def filter(self, record):
+        node_id = current_node()
+        record.node_id = node_id
+        if node_id is not None and self.levels:
+            return record.levelno >= self.levels.get(node_id, self.level)
+        return record.levelno >= self.level
+
+
+class DuplicateFilter(logging.Filter):
+    ''' Suppresses the records whose message (and level) was logged less
+    than interval seconds earlier.  The next record with that message
+    after the interval reports how many were suppressed. '''
+
+    def __init__(self, interval):
+        super(DuplicateFilter, self).__init__()
+        self.interval = interval
+        self._seen = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        message = record.getMessage()
+        key = (record.name, record.levelno, message)
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and \
+               record.created - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+
+            if entry is not None and entry[1]:
+                record.msg = '%s (repeated %d more times)' % \
+                    (message, entry[1])
+                record.args = None
+
+            if len(self._seen) >= DUPLICATE_CACHE_SIZE:
+                self._expire(record.created)
+            self._seen[key] = [record.created, 0]
+        return True
+
+    def _expire(self, now):
+        for (key, entry) in self._seen.items():
+            if now - entry[0] >= self.interval:
+                del self._seen[key]
+        if len(self._seen) >= DUPLICATE_CACHE_SIZE:
+            self._seen.clear()
+
+
+class QueueListener(object):
+    ''' Passes the records from queue on to handlers, in a background
+    thread '''
+
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+
+    def __repr__(self):
+        return 'QueueListener(handlers=%r)' % self.handlers
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            self.handle(record)
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self, timeout=5):
+        ''' Writes the queued records and stops the thread '''
+
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+
+class QueueHandler(logging.Handler):
+    ''' Puts the records on a bounded queue, from where a
+    :py:class:`QueueListener` passes them on to handlers.  The records
+    are dropped (and counted in log_records_dropped) when the queue is
+    full. '''
+
+    def __init__(self, handlers, size):
+        super(QueueHandler, self).__init__()
+        self.handlers = handlers
+        self.size = size
+        self.listener = None
+        self._pid = None
+        self._dropped = metrics.counter('log_records_dropped')
+        self._start()
+        atexit.register(self.stop)
+
+    def __repr__(self):
+        return 'QueueHandler(size=%s, handlers=%r)' % (self.size,
+                                                       self.handlers)
+
+    def _start(self):
+        # also called in forked processes, which must not share the
+        # queue (and its locks) with the parent
+        self._pid = os.getpid()
+        self.listener = QueueListener(Queue.Queue(self.size), self.handlers)
+        self.listener.start()
+
+    def stop(self):
+        if self._pid == os.getpid():
+            self.listener.stop()
+
+    @staticmethod
+    def prepare(record):
+        ''' Merges the arguments and the exception into the message, so
+        that the record can be formatted by another thread '''
+
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            if self._pid != os.getpid():
+                self._start()
+            self.listener.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self._dropped.inc()
+        except Exception:    #pylint: disable=W0703
+            self.handleError(record)
+
+    def close(self):
+        self.stop()
+        super(QueueHandler, self).close()
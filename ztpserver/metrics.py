@@ -0,0 +1,328 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.metrics
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The metrics module provides thread-safe counters, gauges and
+        latency histograms which are updated in-line (no rescans are
+        needed in order to report them), a registry which keeps track of
+        them and renders them in the Prometheus text format, and a WSGI
+        middleware which records per-route request metrics.
+
+        Updates are lock-free: each thread updates its own cell of a
+        metric and the cells are only summed when the metric is read.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+
+# latency histogram buckets (upper bounds, in seconds)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# prefix of the metric names in the Prometheus text format
+PREFIX = 'ztps_'
+
+
+class _Cells(object):
+    ''' Per-thread cells (lists of numbers): a thread only ever updates
+    its own cell, so no lock is needed; readers add up all the cells.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._cells = list()
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0] * self.size
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+
+    def total(self):
+        with self._lock:
+            cells = list(self._cells)
+        return [sum(x) for x in zip(*cells)] or [0] * self.size
+
+
+class Counter(object):
+    ''' A monotonically increasing counter '''
+
+    kind = 'counter'
+
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels or dict()
+        self._cells = _Cells(1)
+
+    def __repr__(self):
+        return 'Counter(name=%s, labels=%s, value=%s)' % \
+            (self.name, self.labels, self.value)
+
+    def inc(self, value=1):
+        self._cells.get()[0] += value
+
+    @property
+    def value(self):
+        return self._cells.total()[0]
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(Counter):
+    ''' A value which goes up and down (e.g. requests in progress) '''
+
+    kind = 'gauge'
+
+    def __repr__(self):
+        return 'Gauge(name=%s, labels=%s, value=%s)' % \
+            (self.name, self.labels, self.value)
+
+    def dec(self, value=1):
+        self._cells.get()[0] -= value
+
+
+class Histogram(object):
+    ''' A histogram with fixed buckets (upper bounds).  Each observation
+    is counted in the first bucket it fits in (or in the implicit +Inf
+    bucket) - buckets are cumulative when reported.
+    '''
+
+    kind = 'histogram'
+
+    def __init__(self, name, labels=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels or dict()
+        self.buckets = tuple(sorted(buckets))
+        # cell: bucket counts, +Inf count, count, sum
+        self._cells = _Cells(len(self.buckets) + 3)
+
+    def __repr__(self):
+        return 'Histogram(name=%s, labels=%s, count=%s)' % \
+            (self.name, self.labels, self.count)
+
+    def observe(self, value):
+        cell = self._cells.get()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self):
+        ''' Context manager which observes the time spent in its body '''
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start)
+
+    @property
+    def count(self):
+        return self._cells.total()[-2]
+
+    def snapshot(self):
+        ''' Returns a dict with the count, sum and cumulative bucket
+        counts (keyed by upper bound, as a string) '''
+
+        total = self._cells.total()
+        result = dict(count=total[-2], sum=float(total[-1]))
+
+        buckets = list()
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + ('+Inf',), total[:-2]):
+            cumulative += count
+            buckets.append([str(bound), cumulative])
+        result['buckets'] = buckets
+        return result
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels.items()) + list(extra or [])
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace(
+        '\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for (key, value) in items)
+
+
+class Registry(object):
+    ''' The :py:class:`Registry` keeps track of all the counters, gauges
+    and histograms of a process, by name and labels '''
+
+    def __init__(self):
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'Registry(metrics=%d)' % len(self._metrics)
+
+    def _get(self, cls, name, labels, **kwargs):
+        key = (name, tuple(sorted((labels or dict()).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls(name, dict(labels or dict()), **kwargs)
+                    self._metrics[key] = metric
+        if type(metric) is not cls:
+            raise TypeError('%s is a %s' % (name, type(metric).__name__))
+        return metric
+
+    def counter(self, name, labels=None):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, labels=None):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, labels=None, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, labels, buckets=buckets)
+
+    def find(self, name):
+        ''' Returns all the metrics called name '''
+        return [y for (x, y) in sorted(self._metrics.items())
+                if x[0] == name]
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def exposition(self):
+        ''' Returns all the metrics in the Prometheus text format '''
+
+        lines = list()
+        previous = None
+        for ((name, _), metric) in sorted(self._metrics.items()):
+            name = PREFIX + name
+            if name != previous:
+                lines.append('# TYPE %s %s' % (name, metric.kind))
+                previous = name
+
+            if metric.kind != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(metric.labels),
+                                          metric.value))
+                continue
+
+            snapshot = metric.snapshot()
+            for (bound, count) in snapshot['buckets']:
+                lines.append('%s_bucket%s %s' %
+                             (name, _labels(metric.labels, [('le', bound)]),
+                              count))
+            lines.append('%s_sum%s %r' % (name, _labels(metric.labels),
+                                          snapshot['sum']))
+            lines.append('%s_count%s %s' % (name, _labels(metric.labels),
+                                            snapshot['count']))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()       #pylint: disable=C0103
+
+
+class MetricsMiddleware(object):
+    ''' WSGI middleware which records, per route (routes template, e.g.
+    /nodes/{resource}) and method:
+
+        http_requests            requests, by status code
+        http_request_seconds     time spent in the application
+        http_response_bytes      Content-Length of the responses (e.g.
+                                 the bytes served from /files)
+
+    and the number of requests in progress (http_requests_in_flight).
+    The response body is passed through untouched (so that servers can
+    still send files with sendfile()) - the latency does not include
+    sending it.
+    '''
+
+    def __init__(self, app, metrics=None):
+        self.app = app
+        self.metrics = metrics or registry
+
+    def __repr__(self):
+        return 'MetricsMiddleware(app=%r)' % self.app
+
+    @staticmethod
+    def route(environ):
+        route = environ.get('routes.route')
+        return getattr(route, 'routepath', None) or 'unmatched'
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        in_flight = self.metrics.gauge('http_requests_in_flight')
+        state = dict()
+
+        def _start_response(status, headers, exc_info=None):
+            state['status'] = status[:3]
+            if method != 'HEAD':
+                for (key, value) in headers:
+                    if key.lower() == 'content-length':
+                        state['length'] = int(value)
+            return start_response(status, headers, exc_info)
+
+        in_flight.inc()
+        start = time.time()
+        try:
+            return self.app(environ, _start_response)
+        finally:
+            elapsed = time.time() - start
+            in_flight.dec()
+
+            labels = dict(route=self.route(environ), method=method)
+            self.metrics.histogram('http_request_seconds',
+                                   labels).observe(elapsed)
+            if 'length' in state:
+                self.metrics.counter('http_response_bytes',
+                                     labels).inc(state['length'])
+            self.metrics.counter('http_requests',
+                                 dict(labels,
+                                      status=state.get('status', '500'))).inc()
@@ -0,0 +1,1389 @@
+#
+# Copyright (c) 2015, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.pools
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The pools module provides the storage engine for file-based
+        resource pools (used by the allocate plugin).
+
+        A resource pool is a key/value YAML file under
+        [data_root]/resources which maps each resource to the node it
+        is allocated to (or null).  The file is imported into an
+        in-memory index (node -> resource reverse map and a free-list
+        ordered by position in the file).  Allocations are appended to
+        a journal (.<pool>.journal) instead of rewriting the YAML file;
+        the journal is periodically compacted back into the YAML file.
+        Access across threads and processes is serialized via
+        (shared/exclusive) locks on .<pool>.lock.
+
+        Optionally, allocations from resource pools can be served by an
+        in-memory AllocationService: a single writer thread applies
+        allocations in batches (one fsync'd journal write per batch)
+        and compacts the pools in the background.
+
+        Subnet pools (used by the subnet plugin) are defined by a CIDR
+        network under [data_root]/subnets.  Addresses are computed from
+        their offset in the network and the used offsets are tracked
+        in a bitmap.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import atexit
+import binascii
+import heapq
+import json
+import logging
+import os
+import Queue
+import re
+import socket
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+import yaml
+
+from ztpserver.serializers import dump, YAMLLoader
+from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.config import runtime
+from ztpserver.locks import LockManager
+
+COMPACT_THRESHOLD = 1000
+
+FREE_VALUES = [None, '', 'None', 'null']
+
+# matches any byte in a bitmap which has at least one bit clear
+USED_BYTE_RE = re.compile('[^\xff]')
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+POOL_LOCKS = LockManager('pools')
+
+
+class PoolError(Exception):
+    ''' Base exception class for :py:class:`ResourcePool` '''
+    pass
+
+class PoolFullError(PoolError):
+    ''' Raised when there are no free resources left in a pool '''
+    pass
+
+
+class _PoolLoader(YAMLLoader):
+    ''' Safe YAML loader which preserves the order of the pool entries '''
+    # pylint: disable=R0901,R0904
+    pass
+
+_PoolLoader.add_constructor(
+    u'tag:yaml.org,2002:map',
+    lambda loader, node: loader.construct_pairs(node))
+
+
+class _Pool(object):
+    ''' Base class for the pools: concurrent readers share the pool lock
+    (see _read) while writers hold it exclusively.  Subclasses implement
+    _pending() and _refresh().
+    '''
+
+    lockfile = None
+
+    def __init__(self):
+        # serializes the writers (and refreshes) of this process
+        self._lock = threading.RLock()
+
+    def _pending(self):
+        ''' Returns a true value if the in-memory state is out of date '''
+        raise NotImplementedError
+
+    def _refresh(self):
+        ''' Reloads the in-memory state.  Must be called with the
+        exclusive lock held. '''
+        raise NotImplementedError
+
+    def _read(self, func):
+        ''' Returns func(), called with the shared lock held and the index
+        up to date.  Readers only take the exclusive lock (to refresh the
+        index) if the files were modified since the last refresh.
+        '''
+
+        refreshed = False
+        while True:
+            with POOL_LOCKS.shared(self.lockfile):
+                # a partial journal entry stays pending until the next
+                # write, hence the refreshed flag
+                if refreshed or not self._pending():
+                    return func()
+            with self._lock:
+                with POOL_LOCKS.exclusive(self.lockfile):
+                    self._refresh()
+            refreshed = True
+
+
+class ResourcePool(_Pool):
+    ''' The :py:class:`ResourcePool` represents a single file-based resource
+    pool.  All the public methods are safe to call from multiple threads
+    and multiple processes.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        (path, self.name) = os.path.split(filename)
+        self.journal = os.path.join(path, '.%s.journal' % self.name)
+        self.lockfile = os.path.join(path, '.%s.lock' % self.name)
+        super(ResourcePool, self).__init__()
+
+        self.keys = list()          # resources, in file order
+        self.owners = list()        # node allocated to each resource
+        self.positions = dict()     # resource -> position
+        self.index = dict()         # node -> position
+        self.free = list()          # heap of free positions
+        self.used = 0
+        self._duplicates = False
+
+        self._signature = None      # YAML file signature
+        self._journal_id = None     # journal inode
+        self._offset = 0            # journal bytes consumed
+        self._entries = 0           # journal entries consumed
+        self._stale = False         # YAML edited since last compaction
+
+    def __repr__(self):
+        return 'ResourcePool(name=%s, used=%s, total=%s)' % \
+            (self.name, self.used, len(self.keys))
+
+    #-------------------------------------------------------------------
+    # index
+
+    def _reset(self, pairs):
+        self.keys = list()
+        self.owners = list()
+        self.positions = dict()
+        self.index = dict()
+        self.free = list()
+        self.used = 0
+        self._duplicates = False
+
+        for (key, value) in pairs:
+            key = str(key)
+            if key in self.positions:
+                log.warning('%s: duplicate resource %s in pool %s' %
+                            (self.name, key, self.filename))
+                continue
+            position = len(self.keys)
+            self.keys.append(key)
+            self.positions[key] = position
+            self.owners.append(None)
+            if value in FREE_VALUES:
+                self.free.append(position)
+            else:
+                self._assign(position, str(value))
+        heapq.heapify(self.free)
+
+    def _assign(self, position, node_id):
+        self.owners[position] = node_id
+        if node_id in self.index:
+            # only possible if the pool was edited by hand
+            self._duplicates = True
+        else:
+            self.index[node_id] = position
+        self.used += 1
+
+    def _unassign(self, position):
+        node_id = self.owners[position]
+        self.owners[position] = None
+        if self.index.get(node_id) == position:
+            del self.index[node_id]
+            if self._duplicates:
+                # the node may still own other resources in the pool
+                for (other, owner) in enumerate(self.owners):
+                    if owner == node_id:
+                        self.index[node_id] = other
+                        break
+        heapq.heappush(self.free, position)
+        self.used -= 1
+
+    def _apply(self, entry):
+        ''' Applies a journal entry to the index.  Entries which do not
+        match the current state of the pool (e.g. after the YAML file has
+        been edited by hand) are ignored.
+        '''
+
+        (operation, key, node_id) = [str(x) for x in entry[:3]]
+        position = self.positions.get(key)
+        if position is None:
+            return False
+
+        if operation == 'a':
+            if self.owners[position] is not None or node_id in self.index:
+                return False
+            self._assign(position, node_id)
+        elif operation == 'f':
+            if self.owners[position] != node_id:
+                return False
+            self._unassign(position)
+        return True
+
+    def _next_free(self):
+        while self.free and self.owners[self.free[0]] is not None:
+            heapq.heappop(self.free)
+        if not self.free:
+            return None
+        return heapq.heappop(self.free)
+
+    #-------------------------------------------------------------------
+    # persistence
+
+    @staticmethod
+    def _stat_signature(stat):
+        return [stat.st_mtime, stat.st_size]
+
+    def _read_yaml(self):
+        try:
+            with open(self.filename) as fhandler:
+                stat = os.fstat(fhandler.fileno())
+                contents = yaml.load(fhandler.read(), Loader=_PoolLoader)
+        except (OSError, IOError) as err:
+            raise PoolError('%s: failed to load pool %s (%s)' %
+                            (self.name, self.filename, err))
+        except yaml.YAMLError as err:
+            raise PoolError('%s: unable to deserialize pool %s: %s' %
+                            (self.name, self.filename, err))
+
+        if not contents or not isinstance(contents, list):
+            raise PoolError('%s: %s' % (self.name, contents or 'empty pool'))
+
+        return (stat, contents)
+
+    def _load(self):
+        ''' Imports the YAML file and replays the journal '''
+
+        (stat, pairs) = self._read_yaml()
+        self._reset(pairs)
+        self._signature = (stat.st_ino,) + tuple(self._stat_signature(stat))
+        self._journal_id = None
+        self._offset = 0
+        self._entries = 0
+        self._stale = False
+        self._replay(base=self._stat_signature(stat))
+
+    def _replay(self, base=None):
+        ''' Applies the journal entries which have not been consumed yet '''
+
+        try:
+            fhandler = open(self.journal)
+        except IOError:
+            self._journal_id = None
+            return
+
+        with fhandler:
+            self._journal_id = os.fstat(fhandler.fileno()).st_ino
+            fhandler.seek(self._offset)
+            for line in fhandler:
+                if not line.endswith('\n'):
+                    # partial entry (interrupted write)
+                    break
+                self._offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    log.warning('%s: ignoring corrupt journal entry: %s' %
+                                (self.name, line.strip()))
+                    continue
+
+                if isinstance(entry, dict):
+                    if base is not None and entry.get('base') != base:
+                        log.warning('%s: %s was modified since the last '
+                                    'compaction - merging journal' %
+                                    (self.name, self.filename))
+                        self._stale = True
+                    continue
+
+                self._apply(entry)
+                self._entries += 1
+
+    def _pending(self):
+        ''' Returns the update required to bring the index up to date
+        with the files on disk ('load', 'replay' or None), without
+        modifying it '''
+
+        try:
+            stat = os.stat(self.filename)
+        except OSError as err:
+            raise PoolError('%s: failed to load pool %s (%s)' %
+                            (self.name, self.filename, err))
+
+        signature = (stat.st_ino,) + tuple(self._stat_signature(stat))
+        try:
+            jstat = os.stat(self.journal)
+        except OSError:
+            jstat = None
+
+        if signature != self._signature or \
+           (jstat and jstat.st_ino != self._journal_id) or \
+           (jstat is None and self._journal_id is not None) or \
+           (jstat and jstat.st_size < self._offset):
+            return 'load'
+        elif jstat and jstat.st_size > self._offset:
+            return 'replay'
+        return None
+
+    def _refresh(self):
+        ''' Brings the index up to date with the files on disk (which may
+        have been modified by other processes).  Must be called with the
+        exclusive lock held.
+        '''
+
+        pending = self._pending()
+        if pending == 'load':
+            self._load()
+        elif pending == 'replay':
+            self._replay()
+
+    def _append(self, entries, sync=False, compact=True):
+        ''' Appends entries to the journal (and fsyncs it if sync is set).
+        Must be called with the exclusive lock held.
+        '''
+
+        if self._journal_id is None:
+            self._new_journal()
+
+        lines = ''.join(json.dumps(x) + '\n' for x in entries)
+        fd = os.open(self.journal, os.O_WRONLY | os.O_APPEND)
+        try:
+            if os.fstat(fd).st_size != self._offset:
+                # drop any partial entry left behind by a failed write
+                os.ftruncate(fd, self._offset)
+            os.write(fd, lines)
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self._offset += len(lines)
+        self._entries += len(entries)
+
+        if compact and (self._stale or self._entries >= COMPACT_THRESHOLD):
+            self._compact()
+
+    def _new_journal(self):
+        stat = os.stat(self.filename)
+        header = json.dumps(dict(base=self._stat_signature(stat))) + '\n'
+
+        tmp = '%s.%s.tmp' % (self.journal, os.getpid())
+        with open(tmp, 'w') as fhandler:
+            fhandler.write(header)
+        os.rename(tmp, self.journal)
+
+        self._signature = (stat.st_ino,) + tuple(self._stat_signature(stat))
+        self._journal_id = os.stat(self.journal).st_ino
+        self._offset = len(header)
+        self._entries = 0
+        self._stale = False
+
+    def _compact(self):
+        ''' Writes the current state to the YAML file and starts a new
+        journal.  Must be called with the exclusive lock held.
+        '''
+
+        log.debug('%s: compacting pool %s' % (self.name, self.filename))
+        data = OrderedDict()
+        for (key, owner) in zip(self.keys, self.owners):
+            data[key] = owner
+        # the journal is discarded next: the pool must be on disk first
+        dump(data, self.filename, CONTENT_TYPE_YAML, self.name, sync=True)
+        self._new_journal()
+
+    #-------------------------------------------------------------------
+    # public API
+
+    def lookup(self, node_id):
+        ''' Returns the resource allocated to node_id (or None) '''
+
+        def _lookup():
+            position = self.index.get(node_id)
+            return None if position is None else self.keys[position]
+        return self._read(_lookup)
+
+    def allocate(self, node_id):
+        ''' Returns the resource allocated to node_id, allocating the
+        first free resource in the pool if required
+
+        :raises: PoolFullError
+        '''
+
+        # preallocated (or previously allocated) resources only require
+        # the shared lock
+        resource = self.lookup(node_id)
+        if resource is not None:
+            return resource
+        return self.allocate_many([node_id])[node_id]
+
+    def allocate_many(self, node_ids):
+        ''' Allocates a resource to each of node_ids, with the pool locked
+        once and a single journal write.  Returns an OrderedDict mapping
+        each node to its resource.
+
+        If the pool runs out of resources, the allocations made so far
+        are kept (and persisted) before PoolFullError is raised.
+
+        :raises: PoolFullError
+        '''
+
+        result = OrderedDict()
+        entries = list()
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+                try:
+                    for node_id in node_ids:
+                        result[node_id] = self._allocate(node_id, entries)
+                finally:
+                    if entries:
+                        self._append(entries)
+        return result
+
+    def _allocate(self, node_id, entries):
+        position = self.index.get(node_id)
+        if position is not None:
+            log.debug('%s: already allocated resource \'%s\':\'%s\'' %
+                      (node_id, self.name, self.keys[position]))
+            return self.keys[position]
+
+        position = self._next_free()
+        if position is None:
+            raise PoolFullError('%s: no resource free in \'%s\'' %
+                                (node_id, self.name))
+
+        key = self.keys[position]
+        self._assign(position, node_id)
+        entries.append(['a', key, node_id])
+        log.debug('%s: allocated \'%s\':\'%s\'' %
+                  (node_id, self.name, key))
+        return key
+
+    def release(self, node_id):
+        ''' Frees all the resources allocated to node_id.  Returns the list
+        of resources freed.
+        '''
+
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+
+                entries = list()
+                released = self._release(node_id, entries)
+                if entries:
+                    self._append(entries)
+                return released
+
+    def _release(self, node_id, entries):
+        released = list()
+        while node_id in self.index:
+            position = self.index[node_id]
+            entries.append(['f', self.keys[position], node_id])
+            released.append(self.keys[position])
+            self._unassign(position)
+        return released
+
+    def clear(self):
+        ''' Frees all the resources in the pool '''
+
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+                for position, owner in enumerate(self.owners):
+                    if owner is not None:
+                        self._unassign(position)
+                self._compact()
+
+    def compact(self):
+        ''' Folds the journal back into the YAML file '''
+
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+                self._compact()
+
+    def flush(self):
+        ''' Folds the journal back into the YAML file if it has any
+        entries.  Returns True if the pool was compacted. '''
+
+        if not self._read(lambda: self._entries or self._stale):
+            return False
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+                if not (self._entries or self._stale):
+                    return False
+                self._compact()
+                return True
+
+    def stats(self):
+        ''' Returns a dict with the used, free and total counts '''
+
+        return self._read(lambda: dict(used=self.used,
+                                       free=len(self.keys) - self.used,
+                                       total=len(self.keys)))
+
+
+def address_to_int(address):
+    ''' Returns (family, integer value) for an IPv4/IPv6 address '''
+
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    try:
+        packed = socket.inet_pton(family, address.strip())
+    except (socket.error, ValueError):
+        raise PoolError('invalid address %s' % address)
+    return (family, int(binascii.hexlify(packed), 16))
+
+def int_to_address(family, value):
+    width = 32 if family == socket.AF_INET6 else 8
+    return socket.inet_ntop(family, binascii.unhexlify('%0*x' %
+                                                       (width, value)))
+
+def parse_network(network):
+    ''' Returns (family, first address, last address, prefixlen) for a
+    CIDR network (or a single address) '''
+
+    network = str(network).strip()
+    if '/' in network:
+        (address, prefixlen) = network.split('/', 1)
+    else:
+        (address, prefixlen) = (network, None)
+
+    (family, value) = address_to_int(address)
+    bits = 128 if family == socket.AF_INET6 else 32
+    try:
+        prefixlen = bits if prefixlen is None else int(prefixlen)
+    except ValueError:
+        raise PoolError('invalid network %s' % network)
+    if not 0 <= prefixlen <= bits:
+        raise PoolError('invalid network %s' % network)
+
+    hostmask = (1 << (bits - prefixlen)) - 1
+    first = value & ~hostmask & ((1 << bits) - 1)
+    return (family, first, first | hostmask, prefixlen)
+
+
+class SubnetPool(_Pool):
+    ''' The :py:class:`SubnetPool` allocates addresses from a CIDR
+    network, defined in a YAML file:
+
+        network: 192.168.0.0/16
+        exclude:
+          - 192.168.0.1
+          - 192.168.255.0/24
+
+    Addresses are computed from their offset in the network; used offsets
+    are tracked in a bitmap, which is built when the pool is loaded.
+    Allocations and releases are appended to a journal, .<pool>.state, of
+    which other processes only replay the new entries.  The journal is
+    compacted once it holds more than twice as many entries as there are
+    allocated addresses (and at least COMPACT_THRESHOLD), so allocation
+    cost does not depend on the size of the network.
+    '''
+
+    MAX_SIZE = 2 ** 24
+
+    def __init__(self, filename):
+        self.filename = filename
+        (path, self.name) = os.path.split(filename)
+        self.statefile = os.path.join(path, '.%s.state' % self.name)
+        self.lockfile = os.path.join(path, '.%s.lock' % self.name)
+        super(SubnetPool, self).__init__()
+
+        self._signature = None      # definition file signature
+        self._journal_id = None     # state journal inode
+        self._offset = 0            # state journal bytes consumed
+        self._entries = 0           # state journal entries consumed
+
+        self.family = None
+        self.first = None
+        self.size = 0
+        self.prefixlen = None
+        self.excluded = 0
+
+        self.bitmap = bytearray()
+        self.nodes = dict()         # node -> offset
+        self.hint = 0               # lowest offset which may be free
+
+    def __repr__(self):
+        return 'SubnetPool(name=%s, used=%s, total=%s)' % \
+            (self.name, len(self.nodes), self.size - self.excluded)
+
+    #-------------------------------------------------------------------
+    # bitmap
+
+    def _test(self, offset):
+        return self.bitmap[offset >> 3] & (1 << (offset & 7))
+
+    def _set(self, offset):
+        self.bitmap[offset >> 3] |= 1 << (offset & 7)
+
+    def _clear(self, offset):
+        self.bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xff
+        self.hint = min(self.hint, offset)
+
+    def _next_free(self):
+        match = USED_BYTE_RE.search(self.bitmap, self.hint >> 3)
+        if not match:
+            self.hint = self.size
+            return None
+
+        index = match.start()
+        byte = self.bitmap[index]
+        for bit in range(8):
+            if not byte & (1 << bit):
+                self.hint = (index << 3) + bit
+                return self.hint
+
+    #-------------------------------------------------------------------
+    # persistence
+
+    def _load_definition(self):
+        try:
+            with open(self.filename) as fhandler:
+                contents = yaml.load(fhandler.read(), Loader=YAMLLoader)
+        except (OSError, IOError) as err:
+            raise PoolError('%s: failed to load subnet %s (%s)' %
+                            (self.name, self.filename, err))
+        except yaml.YAMLError as err:
+            raise PoolError('%s: unable to deserialize subnet %s: %s' %
+                            (self.name, self.filename, err))
+
+        if not isinstance(contents, dict) or 'network' not in contents:
+            raise PoolError('%s: missing \'network\' in %s' %
+                            (self.name, self.filename))
+
+        (family, first, last, prefixlen) = \
+            parse_network(contents['network'])
+        if family == socket.AF_INET and prefixlen < 31:
+            # skip the network and broadcast addresses
+            first += 1
+            last -= 1
+
+        size = last - first + 1
+        if size > self.MAX_SIZE:
+            raise PoolError('%s: network %s is too large (max %d addresses)'
+                            % (self.name, contents['network'],
+                               self.MAX_SIZE))
+
+        excludes = list()
+        for entry in contents.get('exclude') or []:
+            (_family, low, high, _) = parse_network(entry)
+            if _family != family:
+                raise PoolError('%s: invalid exclude %s' % (self.name, entry))
+            (low, high) = (max(low, first), min(high, last))
+            if low <= high:
+                excludes.append((low - first, high - first))
+
+        self.family = family
+        self.first = first
+        self.size = size
+        self.prefixlen = int(contents.get('prefixlen', prefixlen))
+        return excludes
+
+    def _build(self, excludes, nodes):
+        ''' Builds the bitmap from the exclusions and the allocations '''
+
+        self.bitmap = bytearray((self.size + 7) >> 3)
+        for offset in range(self.size, len(self.bitmap) << 3):
+            self._set(offset)
+
+        self.excluded = 0
+        for (low, high) in excludes:
+            for offset in xrange(low, high + 1):
+                if not self._test(offset):
+                    self._set(offset)
+                    self.excluded += 1
+
+        self.nodes = dict()
+        for (node_id, offset) in nodes.items():
+            if 0 <= offset < self.size:
+                if self._test(offset):
+                    # allocated before being excluded
+                    self.excluded -= 1
+                self.nodes[str(node_id)] = offset
+                self._set(offset)
+        self.hint = 0
+
+    def _pending(self):
+        ''' Returns the update required to bring the bitmap up to date
+        with the files on disk ('load', 'replay' or None), without
+        modifying it '''
+
+        try:
+            stat = os.stat(self.filename)
+        except OSError as err:
+            raise PoolError('%s: failed to load subnet %s (%s)' %
+                            (self.name, self.filename, err))
+        signature = (stat.st_ino, stat.st_mtime, stat.st_size)
+        try:
+            jstat = os.stat(self.statefile)
+        except OSError:
+            jstat = None
+
+        if signature != self._signature or \
+           (jstat and jstat.st_ino != self._journal_id) or \
+           (jstat is None and self._journal_id is not None) or \
+           (jstat and jstat.st_size < self._offset):
+            return 'load'
+        elif jstat and jstat.st_size > self._offset:
+            return 'replay'
+        return None
+
+    def _read_journal(self):
+        ''' Yields the (operation, node_id, address) journal entries which
+        have not been consumed yet.  Addresses are stored as integers
+        (rather than offsets) so that they survive changes to the network
+        definition. '''
+
+        try:
+            fhandler = open(self.statefile)
+        except IOError:
+            self._journal_id = None
+            return
+
+        with fhandler:
+            self._journal_id = os.fstat(fhandler.fileno()).st_ino
+            fhandler.seek(self._offset)
+            for line in fhandler:
+                if not line.endswith('\n'):
+                    # partial entry (interrupted write)
+                    break
+                self._offset += len(line)
+                try:
+                    (operation, node_id, address) = json.loads(line)
+                    entry = (str(operation), str(node_id), int(address))
+                except (ValueError, TypeError):
+                    log.warning('%s: ignoring corrupt journal entry: %s' %
+                                (self.name, line.strip()))
+                    continue
+                self._entries += 1
+                yield entry
+
+    def _load(self):
+        ''' Imports the network definition and replays the journal '''
+
+        try:
+            stat = os.stat(self.filename)
+        except OSError as err:
+            raise PoolError('%s: failed to load subnet %s (%s)' %
+                            (self.name, self.filename, err))
+        excludes = self._load_definition()
+
+        self._journal_id = None
+        self._offset = 0
+        self._entries = 0
+        nodes = dict()
+        for (operation, node_id, address) in self._read_journal():
+            if operation == 'a':
+                nodes[node_id] = address
+            elif nodes.get(node_id) == address:
+                del nodes[node_id]
+
+        self._build(excludes, dict((x, y - self.first)
+                                   for (x, y) in nodes.items()))
+        self._signature = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+    def _replay(self):
+        ''' Applies the journal entries which have not been consumed yet
+        '''
+
+        for (operation, node_id, address) in self._read_journal():
+            offset = address - self.first
+            if not 0 <= offset < self.size:
+                continue
+            if operation == 'a':
+                if node_id not in self.nodes and not self._test(offset):
+                    self._set(offset)
+                    self.nodes[node_id] = offset
+            elif self.nodes.get(node_id) == offset:
+                del self.nodes[node_id]
+                self._clear(offset)
+
+    def _refresh(self):
+        ''' Brings the bitmap up to date with the files on disk (which
+        may have been modified by other processes).  Must be called with
+        the exclusive lock held.
+        '''
+
+        pending = self._pending()
+        if pending == 'load':
+            self._load()
+        elif pending == 'replay':
+            self._replay()
+
+    def _append(self, entries):
+        ''' Appends entries to the journal and fsyncs it.  Must be called
+        with the exclusive lock held.
+        '''
+
+        lines = ''.join(json.dumps(x) + '\n' for x in entries)
+        fd = os.open(self.statefile, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0666)
+        try:
+            stat = os.fstat(fd)
+            if self._journal_id is None:
+                self._journal_id = stat.st_ino
+            if stat.st_size != self._offset:
+                # drop any partial entry left behind by a failed write
+                os.ftruncate(fd, self._offset)
+            os.write(fd, lines)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        self._offset += len(lines)
+        self._entries += len(entries)
+
+        if self._entries >= max(COMPACT_THRESHOLD, 2 * len(self.nodes)):
+            self._compact()
+
+    def _compact(self):
+        ''' Rewrites the journal with one entry per allocated address.
+        Must be called with the exclusive lock held.
+        '''
+
+        log.debug('%s: compacting subnet %s' % (self.name, self.filename))
+        lines = ''.join(json.dumps(['a', x, self.first + y]) + '\n'
+                        for (x, y) in self.nodes.items())
+
+        (path, _) = os.path.split(self.statefile)
+        (fd, tmp) = tempfile.mkstemp(dir=path, prefix='.%s.' % self.name)
+        try:
+            os.write(fd, lines)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(tmp, self.statefile)
+
+        self._journal_id = os.stat(self.statefile).st_ino
+        self._offset = len(lines)
+        self._entries = len(self.nodes)
+
+    def _address(self, offset):
+        address = int_to_address(self.family, self.first + offset)
+        return '%s/%s' % (address, self.prefixlen)
+
+    #-------------------------------------------------------------------
+    # public API
+
+    def lookup(self, node_id):
+        ''' Returns the address allocated to node_id (or None) '''
+
+        def _lookup():
+            offset = self.nodes.get(node_id)
+            return None if offset is None else self._address(offset)
+        return self._read(_lookup)
+
+    def allocate(self, node_id):
+        ''' Returns the address allocated to node_id, allocating the
+        lowest free address in the network if required
+
+        :raises: PoolFullError
+        '''
+
+        # preallocated (or previously allocated) resources only require
+        # the shared lock
+        resource = self.lookup(node_id)
+        if resource is not None:
+            return resource
+        return self.allocate_many([node_id])[node_id]
+
+    def allocate_many(self, node_ids):
+        ''' Allocates an address to each of node_ids, with the pool
+        locked once and a single journal write.  Returns an OrderedDict
+        mapping each node to its address.
+
+        If the network runs out of addresses, the allocations made so far
+        are kept (and persisted) before PoolFullError is raised.
+
+        :raises: PoolFullError
+        '''
+
+        result = OrderedDict()
+        entries = list()
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+                try:
+                    for node_id in node_ids:
+                        offset = self.nodes.get(node_id)
+                        if offset is None:
+                            offset = self._next_free()
+                            if offset is None:
+                                raise PoolFullError(
+                                    '%s: no resource free in \'%s\'' %
+                                    (node_id, self.name))
+                            self._set(offset)
+                            self.nodes[node_id] = offset
+                            entries.append(['a', node_id,
+                                            self.first + offset])
+                        result[node_id] = self._address(offset)
+                finally:
+                    if entries:
+                        self._append(entries)
+        return result
+
+    def release(self, node_id):
+        ''' Frees the address allocated to node_id.  Returns the list of
+        addresses freed.
+        '''
+
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+
+                offset = self.nodes.pop(node_id, None)
+                if offset is None:
+                    return []
+
+                self._clear(offset)
+                self._append([['f', node_id, self.first + offset]])
+                return [self._address(offset)]
+
+    def clear(self):
+        ''' Frees all the addresses in the network '''
+
+        with self._lock:
+            with POOL_LOCKS.exclusive(self.lockfile):
+                self._refresh()
+                for offset in self.nodes.values():
+                    self._clear(offset)
+                self.nodes = dict()
+                self._compact()
+
+    def stats(self):
+        ''' Returns a dict with the used, free and total counts '''
+
+        def _stats():
+            total = self.size - self.excluded
+            return dict(used=len(self.nodes),
+                        free=total - len(self.nodes),
+                        total=total)
+        return self._read(_stats)
+
+
+_pools = dict()                     #pylint: disable=C0103
+_pools_lock = threading.Lock()      #pylint: disable=C0103
+
+def get_pool(filename, cls=ResourcePool):
+    ''' Returns the (per process) pool instance for filename '''
+
+    pool = _pools.get(filename)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(filename)
+            if pool is None:
+                pool = cls(filename)
+                _pools[filename] = pool
+    return pool
+
+def is_pool_file(filename):
+    ''' Returns False for the pool journal and lock files '''
+    return not os.path.basename(filename).startswith('.')
+
+def flush_pools():
+    ''' Folds the journals of the resource pools used by this process
+    back into their YAML files.  Returns the list of pools compacted. '''
+
+    flushed = list()
+    for pool in list(_pools.values()):
+        if not isinstance(pool, ResourcePool) or \
+           not os.path.exists(pool.filename):
+            continue
+        try:
+            if pool.flush():
+                flushed.append(pool.filename)
+        except Exception as exc:        #pylint: disable=W0703
+            log.error('%s: failed to compact pool %s: %s' %
+                      (pool.name, pool.filename, exc))
+    return flushed
+
+
+class PoolFlusher(object):
+    ''' The :py:class:`PoolFlusher` folds the journals of the resource
+    pools used by this process back into their YAML files every interval
+    seconds and when it is stopped, so that the resource files show the
+    allocations within interval seconds.
+    '''
+
+    def __init__(self, interval=5):
+        self.interval = interval
+        self.pid = None
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return 'PoolFlusher(interval=%s)' % self.interval
+
+    def start(self):
+        self.pid = os.getpid()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='pool-flusher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        ''' Stops the thread and flushes the pools one last time '''
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        flush_pools()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            flush_pools()
+
+
+class _Request(object):
+    ''' A single allocate/release request queued for the
+    :py:class:`AllocationService` writer '''
+
+    def __init__(self, operation, filename, node_id):
+        self.operation = operation
+        self.filename = filename
+        self.node_id = node_id
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class AllocationService(object):
+    ''' The :py:class:`AllocationService` serves allocations from
+    file-based resource pools out of memory.
+
+    Lookups (including allocate calls for nodes which already own a
+    resource) are answered from an in-memory node -> resource map, once
+    a stat() of the pool files has shown that no other process modified
+    them (otherwise the map is rebuilt first).  New allocations and releases are queued for a
+    single writer thread which applies them in batches: each batch takes
+    the pool lock once and appends all its entries to the pool journal
+    with a single write + fsync before any caller is answered.  Folding
+    the journal back into the YAML file (compaction) is deferred to the
+    writer and happens at most once per flush_interval.
+
+    All pools under path are loaded when the service is started.
+    '''
+
+    def __init__(self, path=None, flush_interval=5, batch_size=256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pid = None
+
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._values = dict()       # filename -> {node: resource}
+        self._versions = dict()     # filename -> state of the pool files
+        self._dirty = set()         # pools with uncompacted entries
+        self._flushed = time.time()
+
+    def __repr__(self):
+        return 'AllocationService(path=%s, pools=%d, pending=%d)' % \
+            (self.path, len(self._values), self._queue.qsize())
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        ''' Loads all the pools and starts the writer thread '''
+
+        if self.path and os.path.isdir(self.path):
+            for filename in sorted(os.listdir(self.path)):
+                filename = os.path.join(self.path, filename)
+                if is_pool_file(filename) and os.path.isfile(filename):
+                    try:
+                        self._sync(get_pool(filename))
+                    except PoolError as err:
+                        log.error('allocation service: %s' % err)
+
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run,
+                                        name='allocation-service')
+        self._thread.daemon = True
+        self._thread.start()
+        log.debug('%s started' % self)
+
+    def stop(self):
+        ''' Processes the pending requests, compacts all pools and stops
+        the writer thread '''
+
+        if self.running:
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    #-------------------------------------------------------------------
+    # public API
+
+    def lookup(self, filename, node_id):
+        ''' Returns the resource allocated to node_id in the pool (or
+        None), from memory '''
+
+        pool = get_pool(filename)
+        if pool._pending() or \
+           self._version(pool) != self._versions.get(filename):
+            # e.g. released (and maybe reallocated) by another process
+            self._sync(pool)
+        return self._values.get(filename, {}).get(node_id)
+
+    def allocate(self, filename, node_id):
+        ''' Returns the resource allocated to node_id, allocating one via
+        the writer thread if required
+
+        :raises: PoolFullError
+        '''
+
+        resource = self.lookup(filename, node_id)
+        if resource is not None:
+            return resource
+        return self._submit('allocate', filename, node_id)
+
+    def release(self, filename, node_id):
+        ''' Frees all the resources allocated to node_id.  Returns the list
+        of resources freed. '''
+
+        return self._submit('release', filename, node_id)
+
+    def _submit(self, operation, filename, node_id):
+        if not self.running:
+            raise PoolError('allocation service is not running')
+        request = _Request(operation, filename, node_id)
+        self._queue.put(request)
+        return request.wait()
+
+    #-------------------------------------------------------------------
+    # writer
+
+    def _run(self):
+        while True:
+            try:
+                request = self._queue.get(timeout=self.flush_interval)
+            except Queue.Empty:
+                self._flush()
+                continue
+
+            batch = [request]
+            while request is not None and len(batch) < self.batch_size:
+                try:
+                    request = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                batch.append(request)
+
+            self._commit([x for x in batch if x is not None])
+
+            if None in batch:
+                self._flush()
+                log.debug('%s stopped' % self)
+                return
+
+            if time.time() - self._flushed >= self.flush_interval:
+                self._flush()
+
+    @staticmethod
+    def _version(pool):
+        return (pool._signature, pool._journal_id, pool._offset)
+
+    def _sync(self, pool):
+        ''' Refreshes pool from disk and rebuilds its in-memory map if
+        the files were modified by somebody else '''
+
+        pool._read(lambda: self._update(pool))
+
+    def _refresh(self, pool):
+        pool._refresh()
+        self._update(pool)
+
+    def _update(self, pool):
+        version = self._version(pool)
+        if version != self._versions.get(pool.filename):
+            self._values[pool.filename] = \
+                dict((x, pool.keys[y]) for (x, y) in pool.index.items())
+            self._versions[pool.filename] = version
+
+    def _commit(self, batch):
+        groups = OrderedDict()
+        for request in batch:
+            groups.setdefault(request.filename, list()).append(request)
+
+        for filename, requests in groups.items():
+            pool = get_pool(filename)
+            try:
+                with pool._lock:
+                    with POOL_LOCKS.exclusive(pool.lockfile):
+                        self._refresh(pool)
+                        self._apply(pool, requests)
+            except Exception as exc:        #pylint: disable=W0703
+                log.error('allocation service: failed to update %s: %s' %
+                          (filename, exc))
+                # the in-memory state may be ahead of the journal
+                pool._signature = None
+                self._versions.pop(filename, None)
+                for request in requests:
+                    if request.error is None:
+                        request.error = PoolError('%s: %s' %
+                                                  (pool.name, exc))
+            finally:
+                for request in requests:
+                    request.done.set()
+
+    def _apply(self, pool, requests):
+        entries = list()
+        values = self._values[pool.filename]
+        for request in requests:
+            try:
+                if request.operation == 'allocate':
+                    request.result = pool._allocate(request.node_id,
+                                                    entries)
+                else:
+                    request.result = pool._release(request.node_id,
+                                                   entries)
+            except PoolError as exc:
+                request.error = exc
+
+        if entries:
+            pool._append(entries, sync=True, compact=False)
+            self._dirty.add(pool.filename)
+
+        for (operation, key, node_id) in entries:
+            if operation == 'a':
+                values[node_id] = key
+            elif values.get(node_id) == key:
+                del values[node_id]
+        self._versions[pool.filename] = self._version(pool)
+
+    def _flush(self):
+        ''' Write-behind: folds the journals of the pools modified since
+        the last flush back into their YAML files '''
+
+        for filename in sorted(self._dirty):
+            pool = get_pool(filename)
+            try:
+                with pool._lock:
+                    with POOL_LOCKS.exclusive(pool.lockfile):
+                        self._refresh(pool)
+                        if pool._entries or pool._stale:
+                            pool._compact()
+                        self._versions[filename] = self._version(pool)
+            except Exception as exc:        #pylint: disable=W0703
+                log.error('allocation service: failed to compact %s: %s' %
+                          (filename, exc))
+        self._dirty.clear()
+        self._flushed = time.time()
+
+        # pick up changes made by other processes
+        for filename in self._values.keys():
+            try:
+                self._sync(get_pool(filename))
+            except PoolError as err:
+                log.error('allocation service: %s' % err)
+
+
+_service = None                     #pylint: disable=C0103
+_service_lock = threading.Lock()    #pylint: disable=C0103
+
+def allocation_service():
+    ''' Returns the (per process) :py:class:`AllocationService`, starting
+    it on first use, or None if it is disabled in the configuration
+    ([resources] allocation_service).
+    '''
+
+    global _service                 #pylint: disable=W0603
+
+    if not runtime.resources.allocation_service:
+        return None
+
+    service = _service
+    if service is None or service.pid != os.getpid():
+        with _service_lock:
+            service = _service
+            if service is None or service.pid != os.getpid():
+                # threads do not survive fork() - each process runs its
+                # own service
+                service = AllocationService(
+                    os.path.join(runtime.default.data_root, 'resources'),
+                    flush_interval=runtime.resources.flush_interval,
+                    batch_size=runtime.resources.batch_size)
+                service.start()
+                atexit.register(service.stop)
+                _service = service
+    return service
+
+
+_flusher = None                     #pylint: disable=C0103
+_flusher_lock = threading.Lock()    #pylint: disable=C0103
+
+def pool_flusher():
+    ''' Returns the (per process) :py:class:`PoolFlusher`, starting it on
+    first use, or None if the allocation service (which flushes the pools
+    itself) is enabled '''
+
+    global _flusher                 #pylint: disable=W0603
+
+    if runtime.resources.allocation_service:
+        return None
+
+    flusher = _flusher
+    if flusher is None or flusher.pid != os.getpid():
+        with _flusher_lock:
+            flusher = _flusher
+            if flusher is None or flusher.pid != os.getpid():
+                flusher = PoolFlusher(runtime.resources.flush_interval)
+                flusher.start()
+                atexit.register(flusher.stop)
+                _flusher = flusher
+    return flusher
@@ -0,0 +1,256 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.profiling
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The profiling module runs cProfile around a sample of the requests
+        (1 in [profiling] sample, plus the requests carrying the
+        X-ZTPS-Profile header set to [profiling] token) and writes the
+        statistics (pstats files) to [profiling] directory, one file per
+        request, named after the route and the resource (e.g. the node
+        ID).  The profiles are aggregated with "ztps --profile-stats".
+
+        The :py:class:`StackSampler` samples the stacks of all the threads
+        (sys._current_frames()) for a while, in the calling thread, and
+        counts the collapsed stacks (e.g. for flame graphs).  No thread
+        is started and nothing runs in between samplings.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import collections
+import cProfile
+import hmac
+import itertools
+import logging
+import os
+import pstats
+import re
+import sys
+import thread
+import threading
+import time
+
+from ztpserver.config import runtime
+
+PROFILE_HEADER = 'X-ZTPS-Profile'
+PROFILE_SUFFIX = '.pstats'
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+
+def _tag(value):
+    return re.sub(r'[^A-Za-z0-9.]+', '_', str(value)).strip('_') or 'none'
+
+
+def authorized(request):
+    ''' Returns True if request carries the X-ZTPS-Profile header set to
+    [profiling] token '''
+
+    token = runtime.profiling.token
+    return bool(token) and hmac.compare_digest(
+        str(request.headers.get(PROFILE_HEADER, '')), token)
+
+
+class RequestProfiler(object):
+    ''' Decides which requests to profile and profiles them '''
+
+    def __init__(self):
+        self._requests = itertools.count(1)
+
+    def __repr__(self):
+        return 'RequestProfiler'
+
+    def wanted(self, request):
+        ''' Returns True if request should be profiled '''
+
+        group = runtime.profiling
+        if not group.enabled:
+            return False
+
+        if authorized(request):
+            return True
+
+        sample = group.sample
+        return bool(sample) and next(self._requests) % sample == 0
+
+    @staticmethod
+    def filename(request):
+        ''' Returns the name of the profile of request:
+
+            <route>-<resource>-<time>-<pid>.pstats
+        '''
+
+        route = request.environ.get('routes.route')
+        route = getattr(route, 'routepath', None) or request.path_info
+        resource = request.urlvars.get('resource', 'none')
+        return '%s-%s-%d-%d%s' % (_tag(route), _tag(resource),
+                                  int(time.time() * 1000000), os.getpid(),
+                                  PROFILE_SUFFIX)
+
+    def run(self, request, func, *args, **kwargs):
+        ''' Calls func(*args, **kwargs) under cProfile and writes the
+        profile of request '''
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            directory = runtime.profiling.directory
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                filename = os.path.join(directory, self.filename(request))
+                profile.dump_stats(filename)
+                log.debug('Request profile written to %s' % filename)
+            except (IOError, OSError) as err:
+                log.warning('Failed to write request profile to %s: %s' %
+                            (directory, err))
+
+profiler = RequestProfiler()      #pylint: disable=C0103
+
+
+def profile_files(paths):
+    ''' Returns the profiles (pstats files) in paths (files or
+    directories) '''
+
+    result = list()
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(sorted(os.path.join(path, x)
+                                 for x in os.listdir(path)
+                                 if x.endswith(PROFILE_SUFFIX)))
+        elif os.path.exists(path):
+            result.append(path)
+    return result
+
+
+def profile_tags(filename):
+    ''' Returns the (route, resource) tags of a profile '''
+
+    fields = os.path.basename(filename).split('-')
+    if len(fields) != 4:
+        return ('unknown', 'unknown')
+    return (fields[0], fields[1])
+
+
+def load_profiles(paths):
+    ''' Returns the aggregated statistics (pstats.Stats) of the profiles
+    in paths, or None if there are none '''
+
+    filenames = profile_files(paths)
+    if not filenames:
+        return None
+    return pstats.Stats(*filenames)     #pylint: disable=W0142
+
+
+class SamplerBusy(Exception):
+    ''' Raised when another sampling is in progress '''
+    pass
+
+
+class StackSampler(object):
+    ''' Samples the stacks of the threads of the process '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'StackSampler'
+
+    @staticmethod
+    def _frame(frame):
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        return '%s:%s' % (module, code.co_name)
+
+    def stacks(self):
+        ''' Returns the collapsed stacks (root first, ';'-separated) of
+        all the threads but the calling one, rooted by the thread name '''
+
+        current = thread.get_ident()
+        names = dict((x.ident, x.name) for x in threading.enumerate())
+        result = list()
+        #pylint: disable=W0212
+        for (ident, frame) in sys._current_frames().items():
+            if ident == current:
+                continue
+            stack = list()
+            while frame is not None:
+                stack.append(self._frame(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread-%s' % ident))
+            result.append(';'.join(reversed(stack)).replace(' ', '_'))
+        return result
+
+    def sample(self, seconds, rate):
+        ''' Samples the stacks rate times per second for seconds and
+        returns the number of samples of each collapsed stack.  Only one
+        sampling runs at a time (raises :py:class:`SamplerBusy`) '''
+
+        if not self._lock.acquire(False):
+            raise SamplerBusy('stack sampling already in progress')
+
+        try:
+            counts = collections.defaultdict(int)
+            interval = 1.0 / rate
+            end = time.time() + seconds
+            while True:
+                for stack in self.stacks():
+                    counts[stack] += 1
+                delay = min(interval, end - time.time())
+                if delay <= 0:
+                    break
+                time.sleep(delay)
+            return counts
+        finally:
+            self._lock.release()
+
+sampler = StackSampler()      #pylint: disable=C0103
+
+
+def collapsed(counts):
+    ''' Returns counts in the collapsed stack format ("<stack> <count>"
+    lines, as consumed by flamegraph.pl) '''
+
+    return ''.join('%s %d\n' % (stack, count)
+                   for (stack, count) in sorted(counts.items()))
@@ -29,14 +29,31 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
 # IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
 
 import imp
+import inspect
+import logging
 import os
+import threading
 
 from ztpserver.config import runtime
+from ztpserver.metrics import registry as metrics
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+
+class PluginError(Exception):
+    ''' Base exception class for resource plugins '''
+    pass
+
+
+def plugins_path():
+    return os.path.join(runtime.default.data_root, 'plugins')
 
 def resource_plugins():
-    path = os.path.join(runtime.default.data_root, 'plugins')
+    path = plugins_path()
 
     plugins = []
     for (_, _, filenames) in os.walk(path):
@@ -44,13 +61,251 @@ def resource_plugins():
         break
     return plugins
 
-def run_plugin(plugin, node_id, pool):
+def validate_plugin(module):
+    ''' Raises PluginError if module does not provide a main(node_id, pool)
+    entry point
+    '''
+
+    main = getattr(module, 'main', None)
+    if not inspect.isfunction(main):
+        raise PluginError('missing main() function')
+
+    (args, varargs, _, defaults) = inspect.getargspec(main)
+    required = len(args) - len(defaults or ())
+    if required > 2 or (len(args) < 2 and not varargs):
+        raise PluginError('invalid signature main(%s) - expecting '
+                          'main(node_id, pool)' % ', '.join(args))
+
+
+class Plugin(object):
+    ''' A single resource plugin module loaded from disk '''
+
+    def __init__(self, name, filename, module, signature):
+        self.name = name
+        self.filename = filename
+        self.module = module
+        self.signature = signature
+
+    def __repr__(self):
+        return 'Plugin(name=%s, filename=%s)' % (self.name, self.filename)
+
+
+class PluginRegistry(object):
+    ''' The :py:class:`PluginRegistry` keeps track of all resource plugins
+    imported by the server.  Plugins are imported on first use and
+    re-imported only if the file on disk has changed (mtime or size).
+    '''
+
+    def __init__(self):
+        self._plugins = dict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'PluginRegistry(plugins=%s)' % self.plugins
+
+    @property
+    def plugins(self):
+        ''' Returns the names of all plugins currently loaded '''
+        return sorted(x.name for x in self._plugins.values())
+
+    @staticmethod
+    def _signature(filename):
+        stat = os.stat(filename)
+        return (stat.st_mtime, stat.st_size)
+
+    def get(self, name):
+        ''' Returns the :py:class:`Plugin` for name, (re-)importing it
+        if required
+
+        :raises: PluginError
+        '''
+
+        filename = os.path.join(plugins_path(), name)
+        try:
+            signature = self._signature(filename)
+        except OSError as err:
+            raise PluginError('plugin %s not found (%s)' % (name, err))
+
+        plugin = self._plugins.get(filename)
+        if plugin and plugin.signature == signature:
+            return plugin
+
+        with self._lock:
+            plugin = self._plugins.get(filename)
+            if plugin and plugin.signature == signature:
+                return plugin
+
+            log.debug('loading resource plugin %s (%s)' % (name, filename))
+            try:
+                module = imp.load_source(name, filename)
+            except Exception as err:
+                raise PluginError('failed to load plugin %s: %s' %
+                                  (name, err))
+            validate_plugin(module)
+
+            plugin = Plugin(name, filename, module, signature)
+            self._plugins[filename] = plugin
+            return plugin
+
+    def load(self):
+        ''' Imports all plugins under [data_root]/plugins and returns a
+        dict of plugin names which failed validation, mapped to the error
+        '''
 
-    filename = os.path.join(runtime.default.data_root, 
-                            'plugins',
-                            plugin)
+        errors = dict()
+        for name in resource_plugins():
+            try:
+                self.get(name)
+            except PluginError as err:
+                log.error('%s' % err)
+                errors[name] = err
+        return errors
+
+    def clear(self):
+        with self._lock:
+            self._plugins.clear()
+
+registry = PluginRegistry()     #pylint: disable=C0103
+
+def allocation_latency(plugin):
+    return metrics.histogram('resource_allocation_seconds',
+                             dict(plugin=plugin))
+
+def allocation_errors(plugin):
+    return metrics.counter('resource_allocation_errors',
+                           dict(plugin=plugin))
+
+def run_plugin(plugin, node_id, pool):
     try:
-        module = imp.load_source(plugin, filename)
-        return module.main(node_id, pool)
+        module = registry.get(plugin).module
+        with allocation_latency(plugin).time():
+            return module.main(node_id, pool)
     except Exception as exc:
+        allocation_errors(plugin).inc()
         raise Exception('failed to run plugin: %s' % exc)
+
+def run_plugins(references, node_id):
+    ''' Resolves a collection of (plugin, pool) references for a node.
+
+    References are grouped by plugin and each plugin is invoked once for
+    all of its pools, via its optional main_batch(node_id, pools) entry
+    point.  Plugins without main_batch fall back to one main() call per
+    pool.  Every reference is resolved exactly once.
+
+    :returns: dict mapping (plugin, pool) to the allocated value
+    '''
+
+    groups = dict()
+    for (plugin, pool) in references:
+        groups.setdefault(plugin, set()).add(pool)
+
+    result = dict()
+    for plugin, pools in sorted(groups.items()):
+        pools = sorted(pools)
+        try:
+            module = registry.get(plugin).module
+            with allocation_latency(plugin).time():
+                if hasattr(module, 'main_batch'):
+                    log.debug('%s: running plugin %s for pools %s' %
+                              (node_id, plugin, pools))
+                    values = module.main_batch(node_id, pools)
+                else:
+                    values = dict((x, module.main(node_id, x))
+                                  for x in pools)
+        except Exception as exc:
+            allocation_errors(plugin).inc()
+            raise Exception('failed to run plugin: %s' % exc)
+
+        for pool in pools:
+            if pool not in values:
+                raise Exception('failed to run plugin: %s did not return a '
+                                'value for %s' % (plugin, pool))
+            result[(plugin, pool)] = values[pool]
+    return result
+
+def preallocate(assignments):
+    ''' Allocates resources ahead of time for a set of nodes.
+
+    assignments maps each (plugin, pool) reference to the list of nodes
+    which need a value from it.  Each pool is visited once, via the
+    plugin's optional main_preallocate(node_ids, pool) entry point, so
+    that the pool is locked and written once for all nodes.  Plugins
+    without main_preallocate fall back to one main() call per node.
+
+    :returns: dict mapping (plugin, pool) to a dict of node -> value
+    '''
+
+    result = dict()
+    for (plugin, pool), node_ids in sorted(assignments.items()):
+        node_ids = list(node_ids)
+        try:
+            module = registry.get(plugin).module
+            if hasattr(module, 'main_preallocate'):
+                log.debug('preallocating %s(\'%s\') for %d nodes' %
+                          (plugin, pool, len(node_ids)))
+                values = module.main_preallocate(node_ids, pool)
+            else:
+                values = dict((x, module.main(x, pool)) for x in node_ids)
+        except Exception as exc:
+            raise Exception('failed to run plugin: %s' % exc)
+
+        missing = [x for x in node_ids if x not in values]
+        if missing:
+            raise Exception('failed to run plugin: %s did not return a '
+                            'value from %s for %s' %
+                            (plugin, pool, ', '.join(missing)))
+        result[(plugin, pool)] = values
+    return result
+
+def run_release(plugin, node_id, pool):
+    ''' Frees the resources allocated to node_id from pool, via the
+    plugin's optional main_release(node_id, pool) entry point
+
+    :raises: PluginError
+    '''
+
+    module = registry.get(plugin).module
+    if not hasattr(module, 'main_release'):
+        raise PluginError('plugin %s does not support releasing resources'
+                          % plugin)
+    return module.main_release(node_id, pool)
+
+def resource_stats():
+    ''' Returns the utilization of the resource pools, per plugin:
+
+        {<plugin>: {'used': ..., 'free': ..., 'total': ...,
+                    'pools': {<pool>: {'used': ..., 'free': ...,
+                                       'total': ...}},
+                    'latency': <allocation latency histogram>}}
+
+    Pool counts are reported by the plugin's optional main_stats() entry
+    point (which should return a dict mapping each pool to its used,
+    free and total counts).  Latency histograms are only reported for
+    the plugins which have been used by the current process.
+    '''
+
+    result = dict()
+    registry.load()
+    for plugin in registry.plugins:
+        module = registry.get(plugin).module
+        if not hasattr(module, 'main_stats'):
+            continue
+
+        try:
+            pools = module.main_stats()
+        except Exception as exc:            #pylint: disable=W0703
+            log.error('failed to collect stats for plugin %s: %s' %
+                      (plugin, exc))
+            continue
+
+        entry = dict(pools=pools)
+        for key in ['used', 'free', 'total']:
+            entry[key] = sum(x[key] for x in pools.values())
+        result[plugin] = entry
+
+    for histogram in metrics.find('resource_allocation_seconds'):
+        plugin = histogram.labels['plugin']
+        entry = result.setdefault(plugin, dict())
+        entry['latency'] = histogram.snapshot()
+        entry['errors'] = allocation_errors(plugin).snapshot()
+    return result
@@ -33,49 +33,70 @@
 # pylint: disable=R0201
 #
 
-import collections
+import binascii
+import cPickle
+import errno
 import logging
 import json
 import os
+import tempfile
 import threading
 import yaml
 
 from collections import OrderedDict
 
+from ztpserver.config import runtime
 from ztpserver.constants import CONTENT_TYPE_OTHER
 from ztpserver.constants import CONTENT_TYPE_JSON
 from ztpserver.constants import CONTENT_TYPE_YAML
+from ztpserver.metrics import registry as metrics
+
+# Use the libyaml bindings if available - they provide the same (safe)
+# constructors and representers as the pure-Python implementation
+try:
+    from yaml import CSafeLoader as _SafeLoader
+    from yaml import CSafeDumper as _SafeDumper
+    YAML_BACKEND = 'libyaml'
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+    from yaml import SafeDumper as _SafeDumper
+    YAML_BACKEND = 'python'
 
-READ_WRITE_LOCK = {}
 log = logging.getLogger(__name__)   #pylint: disable=C0103
 
+# files written by dump() are created with FILE_MODE (less the umask)
+FILE_MODE = 0754
+
 class SerializerError(Exception):
     ''' base error raised by serialization functions '''
     pass
 
 
 class BaseSerializer(object):
-    ''' Base serializer object '''
+    ''' Base serializer object.  Serializers are stateless (node_id is
+    only used in error messages), so a single instance of each can be
+    shared by all callers - see register_handler.
+    '''
 
-    def __init__(self, node_id):
+    def __init__(self, node_id='N/A'):
         self.node_id = node_id
 
-    def serialize(self, data):
+    def serialize(self, data, node_id=None):
         ''' Serialize a dict to object '''
         raise NotImplementedError
 
-    def deserialize(self, data):
+    def deserialize(self, data, node_id=None):
         ''' Deserialize an object to dict '''
         raise NotImplementedError
 
 
 class TextSerializer(BaseSerializer):
 
-    def deserialize(self, data):
+    def deserialize(self, data, node_id=None):
         ''' Deserialize a text object and return a dict '''
         return str(data)
 
-    def serialize(self, data):
+    def serialize(self, data, node_id=None):
         ''' Serialize a dict object and return text '''
         return str(data)
 
@@ -113,59 +134,95 @@ def represent_odict(dump_odict, tag, mapping, flow_style=None):
             node.flow_style = best_style
     return node
 
-yaml.SafeDumper.add_representer(
-    OrderedDict,
-    lambda dumper, 
-    value: represent_odict(dumper, 
-                           u'tag:yaml.org,2002:map', 
-                           value))
+def _represent_odict(dumper, value):
+    return represent_odict(dumper, u'tag:yaml.org,2002:map', value)
+
+yaml.SafeDumper.add_representer(OrderedDict, _represent_odict)
 #------------------------------------------------------------------------------
 
+class YAMLLoader(_SafeLoader):
+    ''' Safe YAML loader (libyaml-based, if available) '''
+    # pylint: disable=R0901,R0904
+    pass
+
+class YAMLDumper(_SafeDumper):
+    ''' Safe YAML dumper (libyaml-based, if available) which preserves
+    the order of OrderedDicts '''
+    # pylint: disable=R0901,R0904
+    pass
+
+YAMLDumper.add_representer(OrderedDict, _represent_odict)
+
+# Strings are converted to str while the document is being constructed
+# (instead of in a second pass over the whole document).  Both loaders
+# only return unicode for non-ASCII strings; str() raises for those, as
+# it always has.
+def _construct_str(loader, node):
+    return str(loader.construct_scalar(node))
+
+YAMLLoader.add_constructor(u'tag:yaml.org,2002:str', _construct_str)
+
+def _to_str(value):
+    if isinstance(value, unicode):
+        return str(value)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            value[index] = _to_str(item)
+    return value
+
+def _json_object(pairs):
+    return dict((str(key), _to_str(value)) for (key, value) in pairs)
+
+
 class YAMLSerializer(BaseSerializer):
 
-    def deserialize(self, data):
+    def deserialize(self, data, node_id=None):
         ''' Deserialize a YAML object and return a dict '''
 
         try:
-            return yaml.safe_load(data)
+            return yaml.load(data, Loader=YAMLLoader)
         except yaml.YAMLError as err:
             msg = '''%s: unable to deserialize YAML data:
 %s 
 
 Error:
-%s''' % (self.node_id, data, err)
+%s''' % (node_id or self.node_id, data, err)
             raise SerializerError(msg)
 
-    def serialize(self, data):
+    def serialize(self, data, node_id=None):
         ''' Serialize a dict object and return YAML '''
 
         try:
-            return yaml.safe_dump(data, default_flow_style=False)
+            return yaml.dump(data, Dumper=YAMLDumper,
+                             default_flow_style=False)
         except yaml.YAMLError as err:
             msg = '''%s: unable to serialize YAML data:
 %s 
 
 Error:
-%s''' % (self.node_id, data, err)
+%s''' % (node_id or self.node_id, data, err)
             raise SerializerError(msg)
 
 
 class JSONSerializer(BaseSerializer):
 
-    def deserialize(self, data):
+    def deserialize(self, data, node_id=None):
         ''' Deserialize a JSON object and return a dict '''
 
         try:
-            return json.loads(data)
+            # objects are built (with str keys and values) by the hook
+            return _to_str(json.loads(data, object_pairs_hook=_json_object))
+        except UnicodeEncodeError:
+            raise
         except Exception as err:
             msg = '''%s: unable to deserialize JSON data:
 %s 
 
 Error:
-%s''' % (self.node_id, data, err)
+%s''' % (node_id or self.node_id, data, err)
             raise SerializerError(msg)
 
-    def serialize(self, data):
+    def serialize(self, data, node_id=None):
         ''' Serialize a dict object and return JSON '''
 
         try:
@@ -175,80 +232,165 @@ Error:
 %s 
 
 Error:
-%s''' % (self.node_id, data, err)
+%s''' % (node_id or self.node_id, data, err)
             raise SerializerError(msg)
 
 
+# content type -> serializer, shared by all callers
+HANDLERS = {
+    CONTENT_TYPE_OTHER: TextSerializer(),
+    CONTENT_TYPE_JSON: JSONSerializer(),
+    CONTENT_TYPE_YAML: YAMLSerializer()
+}
+
+def register_handler(content_type, instance):
+    ''' Registers the serializer used (by all callers) for content_type '''
+
+    if content_type in HANDLERS:
+        log.warning('overwriting previous loaded handler %s' % content_type)
+    HANDLERS[content_type] = instance
+
+def get_handler(content_type):
+    return HANDLERS.get(content_type) or HANDLERS[CONTENT_TYPE_OTHER]
+
+
 class Serializer(object):
 
     def __init__(self, node_id):
         self.node_id = node_id
-
-        self._handlers = {
-            CONTENT_TYPE_OTHER: TextSerializer(self.node_id),
-            CONTENT_TYPE_JSON: JSONSerializer(self.node_id),
-            CONTENT_TYPE_YAML: YAMLSerializer(self.node_id)
-        }
+        self._handlers = dict()     # overrides of the shared handlers
 
     @property
     def handlers(self):
-        return self._handlers
+        handlers = dict(HANDLERS)
+        handlers.update(self._handlers)
+        return handlers
 
     def add_handler(self, content_type, instance):
-        if content_type in self._handlers:
-            log.warning('%s: overwriting previous loaded handler %s', 
+        if content_type in self.handlers:
+            log.warning('%s: overwriting previous loaded handler %s' %
                         (self.node_id, content_type))
         self._handlers[content_type] = instance
 
+    def _handler(self, content_type):
+        return self._handlers.get(content_type) or get_handler(content_type)
+
     def serialize(self, data, content_type):
         ''' Serialize the data based on the content_type '''
 
-        handler = self.handlers.get(content_type, 
-                                    TextSerializer(self.node_id))
-        return handler.serialize(data)
+        return self._handler(content_type).serialize(data, self.node_id)
 
     def deserialize(self, data, content_type=None):
         ''' Deserialize the data based on the content_type '''
 
-        handler = self.handlers.get(content_type, 
-                                    TextSerializer(self.node_id))
-        data = self._convert_from_unicode(handler.deserialize(data))
-        return data
-
-    @staticmethod
-    def _convert_from_unicode(data):
-        if isinstance(data, basestring):
-            return str(data)
-        elif isinstance(data, collections.Mapping):
-            return dict([Serializer._convert_from_unicode(x)
-                         for x in data.items()])
-        elif isinstance(data, collections.Iterable):
-            return type(data)([Serializer._convert_from_unicode(x)
-                               for x in data])
-        else:
-            return data
+        return self._handler(content_type).deserialize(data, self.node_id)
+
+
+class FileCache(object):
+    ''' Size-bounded LRU cache of deserialized files.
+
+    Entries are keyed by (path, content_type, inode, mtime, size) - as
+    reported by fstat() on the handle the file is read from - so any
+    change to a file (including replacing it) invalidates its entry.
+    Entries are stored pickled and every hit returns a fresh copy, so
+    callers are free to modify the result (e.g. the actions of a
+    definition are updated in place during variable substitution).
+    '''
+
+    def __init__(self, size=0):
+        self.size = size
+        self._entries = OrderedDict()   # key -> pickled data
+        self._paths = dict()            # path -> key
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'FileCache(size=%s, entries=%s)' % \
+            (self.size, len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._paths.clear()
+
+    def _evict(self):
+        while len(self._entries) > self.size:
+            (key, _) = self._entries.popitem(last=False)
+            if self._paths.get(key[0]) == key:
+                del self._paths[key[0]]
+
+    def load(self, fhandler, file_path, content_type, node_id):
+        ''' Returns the deserialized contents of the (open) file '''
+
+        stat = os.fstat(fhandler.fileno())
+        key = (file_path, content_type, stat.st_ino, stat.st_mtime,
+               stat.st_size)
+
+        with self._lock:
+            pickled = self._entries.pop(key, None)
+            if pickled is not None:
+                self._entries[key] = pickled
+        if pickled is not None:
+            metrics.counter('file_cache_hits').inc()
+            return cPickle.loads(pickled)
+
+        metrics.counter('file_cache_misses').inc()
+        result = loads(fhandler.read(), content_type, node_id)
+        pickled = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            previous = self._paths.get(file_path)
+            if previous is not None:
+                self._entries.pop(previous, None)
+            self._entries[key] = pickled
+            self._paths[file_path] = key
+            self._evict()
+        return result
+
+    def stats(self):
+        return dict(size=self.size,
+                    entries=len(self._entries),
+                    hits=metrics.counter('file_cache_hits').value,
+                    misses=metrics.counter('file_cache_misses').value)
+
+FILE_CACHE = FileCache()
+
+def file_cache():
+    ''' Returns the file cache if enabled (file_cache_size > 0) '''
+
+    size = runtime.default.file_cache_size
+    if size != FILE_CACHE.size:
+        FILE_CACHE.resize(size)
+    return FILE_CACHE if size else None
 
 
 def loads(data, content_type, node_id):
-    serializer = Serializer(node_id)
-    return serializer.deserialize(data, content_type)
+    return get_handler(content_type).deserialize(data, node_id)
+
+def _load(file_path, content_type, node_id):
+    with open(file_path) as fhandler:
+        cache = file_cache()
+        if cache is not None:
+            return cache.load(fhandler, file_path, content_type, node_id)
+        return loads(fhandler.read(), content_type, node_id)
 
 def load(file_path, content_type, node_id='N/A', lock=False):
-    log.debug('%s: reading %s...' % (node_id, file_path))
+    ''' Loads and deserializes file_path.  Files are replaced atomically
+    by dump(), so no lock is needed - the lock argument is ignored (and
+    only kept for backwards compatibility).
+    '''
+    #pylint: disable=W0613
 
-    if lock and file_path not in READ_WRITE_LOCK:
-        READ_WRITE_LOCK[file_path] = threading.Lock()
+    log.debug('%s: reading %s...' % (node_id, file_path))
 
     try:
-        if lock:
-            with READ_WRITE_LOCK[file_path]:
-                with open(file_path) as fhandler:
-                    data = fhandler.read()
-        else:
-            with open(file_path) as fhandler:
-                data = fhandler.read()            
-
-        result = loads(data, content_type, node_id)
+        result = _load(file_path, content_type, node_id)
     except (OSError, IOError) as err:
         log.error('%s: failed to load file from %s (%s)' % 
                   (node_id, file_path, err))
@@ -260,32 +402,79 @@ def load(file_path, content_type, node_id='N/A', lock=False):
     return result
 
 def dumps(data, content_type, node_id):
-    serializer = Serializer(node_id)
     if hasattr(data, 'serialize'):
         data = data.serialize()
-    return serializer.serialize(data, content_type)
+    return get_handler(content_type).serialize(data, node_id)
 
 
-def dump(data, file_path, content_type, node_id='N/A', lock=False):
+def _mkstemp(path, name, mode):
+    ''' Returns (fd, filename) of a new temporary file in path, created
+    with mode less the umask (unlike tempfile.mkstemp, which uses 0600 -
+    and reading the umask means setting it, for all the threads) '''
+
+    for _ in range(tempfile.TMP_MAX):
+        tmp = os.path.join(path, '.%s.%s' %
+                           (name, binascii.hexlify(os.urandom(6))))
+        try:
+            return (os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode),
+                    tmp)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+    raise IOError(errno.EEXIST, 'No usable temporary file name found')
+
+def _replace(contents, file_path, sync):
+    # write a temporary file in the same directory and rename it over
+    # file_path: readers see either the old or the new contents, never a
+    # partially written file
+    file_path = os.path.realpath(file_path)
+    (path, name) = os.path.split(file_path)
+    try:
+        mode = os.stat(file_path).st_mode & 07777
+    except OSError:
+        mode = None
+
+    (fd, tmp) = _mkstemp(path, name, FILE_MODE if mode is None else mode)
+    try:
+        try:
+            if mode is not None:
+                # keep the mode of the file being replaced, whatever the
+                # umask
+                os.fchmod(fd, mode)
+            while contents:
+                contents = contents[os.write(fd, contents):]
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(tmp, file_path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+    if sync:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def dump(data, file_path, content_type, node_id='N/A', lock=False,
+         sync=False):
+    ''' Serializes data and atomically replaces file_path with it.  If
+    sync is set, the file (and its directory) are fsync'ed before
+    returning.  Readers never see a partially written file, so no lock is
+    needed - the lock argument is ignored (and only kept for backwards
+    compatibility).
+    '''
+    #pylint: disable=W0613
+
     log.debug('%s: writing %s...' % (node_id, file_path))
 
-    if lock and file_path not in READ_WRITE_LOCK:
-        READ_WRITE_LOCK[file_path] = threading.Lock()
+    contents = dumps(data, content_type, node_id)
 
     try:
-        if lock:
-            with READ_WRITE_LOCK[file_path]:
-                with os.fdopen(os.open(file_path, 
-                                       os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
-                                       0754),
-                               'w') as fhandler:
-                    fhandler.write(dumps(data, content_type, node_id))
-        else:
-            with os.fdopen(os.open(file_path, 
-                                   os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
-                                   0754),
-                           'w') as fhandler:
-                fhandler.write(dumps(data, content_type, node_id))            
+        _replace(contents, file_path, sync)
     except (OSError, IOError) as err:
         log.error('%s: failed to write file to %s (%s)' % 
                   (node_id, file_path, err))
@@ -0,0 +1,680 @@
+#
+# Copyright (c) 2014, Arista Networks, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#   Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+#
+#   Neither the name of Arista Networks nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL ARISTA NETWORKS
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN
+# IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#
+'''
+    MODULE:
+        ztpserver.server
+
+    AUTHOR:
+        Arista Networks
+
+    DESCRIPTION:
+        The server module provides the WSGI servers used by the standalone
+        ztps server: a server which handles requests from a pool of worker
+        threads (with HTTP/1.1 keep-alive) and a pre-fork supervisor which
+        runs several such servers in child processes, all listening on
+        the same port (via SO_REUSEPORT, if available).
+
+        Files returned via wsgi.file_wrapper (e.g. by webob's FileApp,
+        which serves /files) are sent with sendfile(), including byte
+        ranges - the data is never copied through Python.
+
+    :copyright: Copyright (c) 2015, Arista Networks
+    :license: BSD, see LICENSE for more details
+
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import Queue
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+from wsgiref import simple_server
+from wsgiref.util import FileWrapper as _FileWrapper
+
+# Linux value, for Python builds which do not export it
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+# seconds a request (after its first line) may take to arrive
+REQUEST_TIMEOUT = 60
+
+# interval at which idle keep-alive connections check whether other
+# connections are waiting for a thread
+IDLE_POLL_INTERVAL = 0.05
+
+# request bodies left unread by the application are drained (up to
+# DRAIN_LIMIT bytes) so that the connection can be reused
+DRAIN_LIMIT = 65536
+
+# block size used when a file cannot be sent with sendfile()
+BLOCK_SIZE = 1 << 16
+
+# maximum number of bytes per sendfile() call
+SENDFILE_CHUNK = 1 << 26
+
+log = logging.getLogger(__name__)   #pylint: disable=C0103
+
+# pid of the PreforkServer supervisor, in its workers
+supervisor = None                   #pylint: disable=C0103
+
+
+def _libc_sendfile():
+    ''' Returns sendfile(out_fd, in_fd, offset, count) - os.sendfile or
+    the Linux system call via ctypes - or None if it is not available '''
+
+    if hasattr(os, 'sendfile'):
+        return os.sendfile
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = getattr(libc, 'sendfile64', None) or libc.sendfile
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int,
+                     ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    func.restype = ctypes.c_ssize_t
+
+    def _sendfile(out_fd, in_fd, offset, count):
+        position = ctypes.c_int64(offset)
+        sent = func(out_fd, in_fd, ctypes.byref(position), count)
+        if sent < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return sent
+    return _sendfile
+
+# None disables sendfile() (files are then read and written in blocks)
+sendfile = _libc_sendfile()     #pylint: disable=C0103
+
+
+class FileWrapper(_FileWrapper):
+    ''' wsgi.file_wrapper which can be restricted to a byte range (webob
+    calls app_iter_range() in order to serve Range requests).  The
+    server sends it with sendfile() if it wraps a real file.
+    '''
+
+    def __init__(self, filelike, blksize=BLOCK_SIZE, start=None, stop=None):
+        _FileWrapper.__init__(self, filelike, blksize)
+        self.start = start
+        self.stop = stop
+        self._remaining = None
+
+    def app_iter_range(self, start, stop):
+        return FileWrapper(self.filelike, self.blksize, start, stop)
+
+    def _read(self):
+        if self._remaining is None:
+            if self.start is not None:
+                self.filelike.seek(self.start)
+            self._remaining = -1
+            if self.stop is not None:
+                self._remaining = self.stop - (self.start or 0)
+
+        size = self.blksize
+        if self._remaining >= 0:
+            size = min(size, self._remaining)
+        data = self.filelike.read(size) if size else ''
+        if self._remaining >= 0:
+            self._remaining -= len(data)
+        return data
+
+    def __getitem__(self, key):
+        data = self._read()
+        if data:
+            return data
+        raise IndexError
+
+    def next(self):
+        data = self._read()
+        if data:
+            return data
+        raise StopIteration
+
+
+class _Input(object):
+    ''' wsgi.input which stops at the end of the request body '''
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=None):     #pylint: disable=W0613
+        return list(iter(self.readline, ''))
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def drain(self):
+        ''' Discards the rest of the body - returns False if it is too
+        large to bother '''
+
+        if self.remaining > DRAIN_LIMIT:
+            return False
+        while self.remaining:
+            if not self.read(self.remaining):
+                return False
+        return True
+
+
+class _ServerHandler(simple_server.ServerHandler):
+    ''' Response handler which keeps the connection open if the response
+    is delimited (has a Content-Length) and sends files with sendfile()
+    '''
+
+    wsgi_file_wrapper = FileWrapper
+
+    def sendfile(self):
+        wrapper = self.result
+        if sendfile is None:
+            return False
+        try:
+            in_fd = wrapper.filelike.fileno()
+            offset = wrapper.start
+            if offset is None:
+                offset = wrapper.filelike.tell()
+            size = os.fstat(in_fd).st_size
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+
+        count = max(size - offset, 0)
+        if wrapper.stop is not None:
+            count = min(count, wrapper.stop - offset)
+        length = int(self.headers.get('Content-Length', count))
+        if length != count:
+            # the file changed - the response is cut short
+            self.request_handler.close_connection = 1
+            count = min(count, length)
+
+        if not self.headers_sent:
+            self.headers.setdefault('Content-Length', str(count))
+            self.send_headers()
+        self._flush()
+
+        connection = self.request_handler.connection
+        try:
+            _sendfile_all(connection.fileno(), in_fd, offset, count,
+                          connection.gettimeout())
+        except Exception:
+            self.request_handler.close_connection = 1
+            raise
+        self.bytes_sent = count
+        return True
+
+    def cleanup_headers(self):
+        simple_server.ServerHandler.cleanup_headers(self)
+
+        request = self.request_handler
+        if 'Content-Length' not in self.headers:
+            request.close_connection = 1
+        if request.close_connection:
+            self.headers['Connection'] = 'close'
+        elif request.request_version == 'HTTP/1.0':
+            self.headers['Connection'] = 'keep-alive'
+
+
+def _sendfile_all(out_fd, in_fd, offset, count, timeout):
+    # the socket is non-blocking if it has a timeout
+    while count > 0:
+        try:
+            sent = sendfile(out_fd, in_fd, offset,
+                            min(count, SENDFILE_CHUNK))
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            if err.errno != errno.EAGAIN:
+                raise
+            if not select.select([], [out_fd], [], timeout)[1]:
+                raise socket.timeout('timed out')
+            continue
+        if not sent:
+            # the file was truncated
+            raise IOError(errno.EIO, 'unexpected end of file')
+        offset += sent
+        count -= sent
+
+
+def _buffered(rfile):
+    ''' Returns the number of bytes which rfile (a socket._fileobject)
+    read from the socket but did not return yet - or None if it cannot
+    tell.  Depending on the Python 2.7 release, the buffer is a str or a
+    StringIO positioned at the end of the data. '''
+
+    buf = getattr(rfile, '_rbuf', None)
+    if isinstance(buf, basestring):
+        return len(buf)
+    try:
+        return buf.tell()
+    except (AttributeError, IOError, ValueError):
+        return None
+
+
+class RequestHandler(simple_server.WSGIRequestHandler):
+    ''' WSGI request handler which serves a single request per connection
+    (sending files with sendfile()) '''
+
+    def handle(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+
+        if not self.parse_request():
+            return
+
+        self.close_connection = 1
+        handler = _ServerHandler(self.rfile, self.wfile, self.get_stderr(),
+                                 self.get_environ())
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class KeepAliveRequestHandler(RequestHandler):
+    ''' WSGI request handler which serves several requests per connection
+    (HTTP/1.1 persistent connections and HTTP/1.0 keep-alive).  Idle
+    connections are closed after the server's keepalive_timeout, or as
+    soon as other connections are waiting for a thread.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    # the status line, headers and body are buffered and sent together
+    # (and not delayed by Nagle's algorithm)
+    wbufsize = -1
+
+    def setup(self):
+        RequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection and self._idle():
+            self.handle_one_request()
+
+    def _idle(self):
+        ''' Waits for the next request - returns False if the connection
+        should be closed instead '''
+
+        buffered = _buffered(self.rfile)
+        if buffered is None:
+            # the next request may already be buffered - let
+            # handle_one_request() wait for it (up to keepalive_timeout)
+            return True
+        if buffered:
+            return True
+
+        deadline = time.time() + self.server.keepalive_timeout
+        while not self.server.pending():
+            timeout = min(IDLE_POLL_INTERVAL, deadline - time.time())
+            if timeout <= 0:
+                return False
+            if select.select([self.connection], [], [], timeout)[0]:
+                return True
+        return False
+
+    def handle_one_request(self):
+        self.close_connection = 1
+        try:
+            self.connection.settimeout(self.server.keepalive_timeout)
+            self.raw_requestline = self.rfile.readline(65537)
+            if not self.raw_requestline:
+                return
+            self.connection.settimeout(REQUEST_TIMEOUT)
+        except socket.timeout:
+            return
+
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+
+        if not self.parse_request():
+            return
+
+        try:
+            length = int(self.headers.getheader('content-length') or 0)
+        except ValueError:
+            length = 0
+        if self.headers.getheader('transfer-encoding'):
+            # chunked request bodies are not supported - the connection
+            # is closed after the request
+            self.close_connection = 1
+            body = self.rfile
+        else:
+            body = _Input(self.rfile, length)
+
+        handler = _ServerHandler(body, self.wfile, self.get_stderr(),
+                                 self.get_environ(), multithread=True)
+        handler.http_version = self.request_version[len('HTTP/'):]
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+        if body is not self.rfile and not body.drain():
+            self.close_connection = 1
+        self.wfile.flush()
+
+
+class WSGIServer(simple_server.WSGIServer):
+    ''' WSGI server which handles requests in a pool of worker threads.
+    Accepted connections are queued for the workers (up to threads * 4
+    of them; beyond that, they wait in the listen backlog).
+    '''
+
+    request_queue_size = socket.SOMAXCONN
+    daemon_threads = True
+
+    def __init__(self, server_address, handler, threads=1,
+                 keepalive_timeout=5, reuse_port=False):
+        self.threads = threads
+        self.keepalive_timeout = keepalive_timeout
+        self.reuse_port = reuse_port
+        self._requests = Queue.Queue(threads * 4)
+        self._workers = list()
+        self._closing = False
+        simple_server.WSGIServer.__init__(self, server_address, handler)
+
+    def __repr__(self):
+        return 'WSGIServer(address=%s, threads=%s)' % \
+            (self.server_address, self.threads)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        simple_server.WSGIServer.server_bind(self)
+
+    def _worker(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            (request, client_address) = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:           #pylint: disable=W0703
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def start_workers(self):
+        for _ in range(self.threads - len(self._workers)):
+            worker = threading.Thread(target=self._worker)
+            worker.daemon = self.daemon_threads
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def pending(self):
+        ''' Returns True if connections are waiting for a thread (or the
+        server is shutting down) '''
+        return self._closing or not self._requests.empty()
+
+    def serve_forever(self, poll_interval=0.5):
+        self.start_workers()
+        simple_server.WSGIServer.serve_forever(self, poll_interval)
+
+    def server_close(self, timeout=REQUEST_TIMEOUT):
+        ''' Closes the listening socket and waits (up to timeout seconds)
+        for the requests in progress '''
+
+        simple_server.WSGIServer.server_close(self)
+        self._closing = True
+        for _ in self._workers:
+            self._requests.put(None)
+        deadline = time.time() + timeout
+        for worker in self._workers:
+            worker.join(max(deadline - time.time(), 0))
+        self._workers = list()
+
+
+def make_server(host, port, app, threads=1, keepalive_timeout=5,
+                reuse_port=False):
+    ''' Returns a :py:class:`WSGIServer` for app.  Connections are kept
+    alive (HTTP/1.1) if the server has several threads and
+    keepalive_timeout is set - a single thread would be tied up by idle
+    connections.
+    '''
+
+    if threads > 1 and keepalive_timeout:
+        handler = KeepAliveRequestHandler
+    else:
+        handler = RequestHandler
+    server = WSGIServer((host, port), handler, threads=threads,
+                        keepalive_timeout=keepalive_timeout,
+                        reuse_port=reuse_port)
+    server.set_app(app)
+    return server
+
+
+class PreforkServer(object):
+    ''' Runs workers child processes, each serving app via its own
+    :py:class:`WSGIServer`.  The application should be loaded (and
+    warmed up) before run() is called so that the children share it.
+
+    With SO_REUSEPORT each child binds its own socket and the kernel
+    balances the connections between them; otherwise the children
+    accept() from a socket bound by the parent.
+
+    init() is called in each child (after the fork) and returns a list of
+    objects whose stop() method is called before the child exits - e.g.
+    background threads, which do not survive fork().  Children which
+    exit unexpectedly are restarted.
+
+    On SIGHUP, on_reload() is called in the parent (so that restarted
+    children inherit the result) and the signal is forwarded to the
+    children, which call on_reload() as well.
+    '''
+
+    def __init__(self, host, port, app, workers, threads=1,
+                 keepalive_timeout=5, init=None, on_reload=None):
+        self.host = host
+        self.port = port
+        self.app = app
+        self.workers = workers
+        self.threads = threads
+        self.keepalive_timeout = keepalive_timeout
+        self.init = init
+        self.on_reload = on_reload
+
+        self.children = dict()          # pid -> worker number
+        self.running = False
+        self.server = None
+
+    def __repr__(self):
+        return 'PreforkServer(address=%s:%s, workers=%s, threads=%s)' % \
+            (self.host, self.port, self.workers, self.threads)
+
+    def _make_server(self, reuse_port):
+        return make_server(self.host, self.port, self.app,
+                           threads=self.threads,
+                           keepalive_timeout=self.keepalive_timeout,
+                           reuse_port=reuse_port)
+
+    def _listen(self):
+        try:
+            # bound in the parent (and closed) only to fail early if the
+            # address is not usable
+            self._make_server(reuse_port=True).server_close()
+            return None
+        except socket.error as err:
+            if err.errno not in (errno.ENOPROTOOPT, errno.EINVAL):
+                raise
+            log.warning('SO_REUSEPORT is not supported - workers share '
+                        'a single listening socket')
+            return self._make_server(reuse_port=False)
+
+    def _reload(self, *args):           #pylint: disable=W0613
+        if not self.on_reload:
+            return
+        try:
+            self.on_reload()
+        except Exception as exc:        #pylint: disable=W0703
+            log.error('Reload failed (pid %d): %s' % (os.getpid(), exc))
+
+    def _child(self, number):
+        global supervisor               #pylint: disable=W0603
+        supervisor = os.getppid()
+        signal.signal(signal.SIGTERM, _exit)
+        signal.signal(signal.SIGINT, _exit)
+        signal.signal(signal.SIGHUP, self._reload)
+        code = 0
+        services = list()
+        try:
+            services = self.init() if self.init else list()
+            server = self.server or self._make_server(reuse_port=True)
+            log.info('Worker %d (pid %d) serving on http://%s:%s' %
+                     (number, os.getpid(), self.host, self.port))
+            server.serve_forever()
+        except (SystemExit, KeyboardInterrupt):
+            pass
+        except Exception as exc:        #pylint: disable=W0703
+            log.error('Worker %d (pid %d) failed: %s' %
+                      (number, os.getpid(), exc))
+            code = 1
+        finally:
+            for service in services:
+                try:
+                    service.stop()
+                except Exception as exc:    #pylint: disable=W0703
+                    log.error('Worker %d: failed to stop %s: %s' %
+                              (number, service, exc))
+            os._exit(code)              #pylint: disable=W0212
+
+    def _spawn(self, number):
+        pid = os.fork()
+        if pid == 0:
+            self._child(number)
+        self.children[pid] = number
+
+    def stop(self, *args):              #pylint: disable=W0613
+        self.running = False
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def hangup(self, *args):            #pylint: disable=W0613
+        ''' Reloads the parent and the children '''
+
+        log.info('SIGHUP received - reloading %d workers' %
+                 len(self.children))
+        self._reload()
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError:
+                pass
+
+    def run(self):
+        ''' Starts the workers and supervises them until a SIGTERM or
+        SIGINT is received '''
+
+        self.server = self._listen()
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.hangup)
+
+        for number in range(self.workers):
+            self._spawn(number)
+
+        while self.children:
+            try:
+                (pid, status) = os.wait()
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+
+            number = self.children.pop(pid, None)
+            if number is None or not self.running:
+                continue
+            log.warning('Worker %d (pid %d) exited (status %d) - '
+                        'restarting it' % (number, pid, status))
+            # avoid spinning if workers die straight away
+            time.sleep(1)
+            self._spawn(number)
+
+        if self.server:
+            self.server.server_close()
+
+
+def reload_workers():
+    ''' Asks the PreforkServer supervisor to reload all of its workers -
+    returns False if this process is not one of them '''
+
+    if supervisor is None:
+        return False
+    try:
+        os.kill(supervisor, signal.SIGHUP)
+    except OSError as exc:
+        log.error('Failed to signal the supervisor (pid %d): %s' %
+                  (supervisor, exc))
+        return False
+    return True
+
+
+def _exit(*args):                       #pylint: disable=W0613
+    raise SystemExit()
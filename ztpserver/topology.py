@@ -161,34 +161,66 @@ def create_node(nodeattrs):
     except KeyError as err:
         log.error('Failed to create node - missing attribute: %s' % err)
 
-def load_resources(attributes, node, node_id):
+def map_values(value, func):
+    ''' Returns a copy of value with func applied to each scalar - dicts
+    and lists (including dicts in lists, and so on) are walked
+    recursively.  find_resources and load_resources both use it, so that
+    every reference which is allocated is also substituted.
+    '''
+
+    if hasattr(value, 'items'):
+        return dict((key, map_values(item, func))
+                    for (key, item) in value.items())
+    if hasattr(value, '__iter__'):
+        return [map_values(item, func) for item in value]
+    return func(value)
+
+def find_resources(attributes):
+    ''' Returns the set of (plugin, pool) references found in attributes
+
+    The attributes are walked recursively; each string value which
+    matches FUNC_RE (e.g. allocate('mgmt_subnet')) is a reference.
+    '''
+
+    references = set()
+
+    def find(value):
+        match = FUNC_RE.match(str(value))
+        if match:
+            references.add((match.group('function'), match.group('arg')))
+        return value
+
+    map_values(attributes, find)
+    return references
+
+def load_resources(attributes, node, node_id, resources=None):
+    ''' Returns a copy of attributes with all plugin references replaced
+    by their allocated values
+
+    If resources is specified, it must map (plugin, pool) to the value
+    already allocated for the node (see find_resources and
+    ztpserver.resources.run_plugins).  References missing from resources
+    are resolved by running the plugin.
+    '''
+
     log.debug('%s: computing resources (attr=%s)' % 
               (node_id, attributes))
 
-    _attributes = dict()
-    for key, value in attributes.items():
-        if hasattr(value, 'items'):
-            value = load_resources(value, node, node_id)
-        elif hasattr(value, '__iter__'):
-            _value = list()
-            for item in value:
-                match = FUNC_RE.match(item)
-                if match:
-                    plugin = match.group('function')
-                    _value.append(run_plugin(plugin, 
-                                             node_id, 
-                                             match.group('arg')))
-                else:
-                    _value.append(item)
-            value = _value
-        else:
-            match = FUNC_RE.match(str(value))
-            if match:
-                plugin = match.group('function')
-                value = run_plugin(plugin, 
-                                   node_id, 
-                                   match.group('arg'))
-        _attributes[key] = value
+    if resources is None:
+        resources = dict()
+
+    def resolve(value):
+        match = FUNC_RE.match(str(value))
+        if not match:
+            return value
+        reference = (match.group('function'), match.group('arg'))
+        if reference not in resources:
+            resources[reference] = run_plugin(reference[0],
+                                              node_id,
+                                              reference[1])
+        return resources[reference]
+
+    _attributes = map_values(attributes, resolve)
     log.debug('%s: resources: %s' % (node_id, _attributes))
     return _attributes
 
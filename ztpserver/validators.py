@@ -68,12 +68,31 @@ class ValidationError(Exception):
 
 class Validator(object):
 
+    # class -> names of its validate_* methods
+    _validators = dict()
+
     def __init__(self, node_id):
         self.node_id = node_id
         self.data = dict()
         self.fail = False
         self.errors = list()
 
+    @classmethod
+    def validators(cls):
+        ''' Returns the names of the validate_* methods of the class, in
+        alphabetical order (the order in which they run).  The list is
+        computed once per class - a validator is created for each
+        pattern and interface in neighbordb. '''
+
+        try:
+            return cls._validators[cls]
+        except KeyError:
+            names = tuple(name for (name, _) in
+                          inspect.getmembers(cls, predicate=inspect.ismethod)
+                          if name.startswith('validate_'))
+            cls._validators[cls] = names
+            return names
+
     def validate(self, data=None):
         log.debug('%s: running %s.validate' % 
                   (self.node_id, self.__class__.__name__))
@@ -82,23 +101,21 @@ class Validator(object):
         else:
             self.data = dict()
 
+        if 'name' not in self.data:
+            name_string  = ''
+        else:
+            name_string  = 'for \'%s\'' % self.data['name']
+
         error = None
-        methods = inspect.getmembers(self, predicate=inspect.ismethod)
-        for name in methods:
-            if name[0].startswith('validate_'):
-                if 'name' not in self.data:
-                    name_string  = ''
-                else:
-                    name_string  = 'for \'%s\'' % self.data['name']
-
-                log.debug('%s: running %s.%s %s' % 
-                          (self.node_id, self.__class__.__name__,
-                           name[0], name_string))
-                try:
-                    getattr(self, name[0])()
-                except ValidationError as err:
-                    if not error:
-                        error = err
+        for name in self.validators():
+            log.debug('%s: running %s.%s %s' % 
+                      (self.node_id, self.__class__.__name__,
+                       name, name_string))
+            try:
+                getattr(self, name)()
+            except ValidationError as err:
+                if not error:
+                    error = err
         if error:
             self.error(err)
 
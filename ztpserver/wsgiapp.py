@@ -40,6 +40,8 @@ import webob.exc
 
 from routes.middleware import RoutesMiddleware
 
+from ztpserver.metrics import MetricsMiddleware
+from ztpserver.profiling import profiler
 from ztpserver.serializers import dumps
 from ztpserver.constants import CONTENT_TYPE_HTML, HTTP_STATUS_OK
 
@@ -73,6 +75,13 @@ class WSGIController(object):
 
     @webob.dec.wsgify
     def __call__(self, request):
+        if profiler.wanted(request):
+            return profiler.run(request, self.dispatch, request)
+        return self.dispatch(request)
+
+    def dispatch(self, request):
+        ''' Calls the action of the request and builds the response '''
+
         action = request.urlvars['action']
 
         try:
@@ -107,7 +116,8 @@ class WSGIRouter(object):
 
     def __init__(self, mapper):
         self.map = mapper
-        self.router = RoutesMiddleware(self.route, self.map)
+        self.router = MetricsMiddleware(RoutesMiddleware(self.route,
+                                                         self.map))
 
     @webob.dec.wsgify
     def __call__(self, request):